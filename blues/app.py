@@ -16,6 +16,10 @@ Application Blueprint
         git_url: git@github.com:foo/bar.git[@branch]  # Git repository to clone
         # git_branch: master                          # Branch to clone, if not specified in `git_url` setting
         # git_source: ./                              # Relative path within repository added to python path (Default: src/)
+        # git_depth: 50                               # Shallow clone and fetch, keeping depth commits of history (Default: full history)
+        # git_filter: blob:none                       # Partial clone, fetching file contents on demand, requires git >= 2.19 (Optional)
+        # git_reference: /srv/git/objects.git         # Per host object store shared by all projects, borrowed from by clones (Optional)
+        # git_delivery: bundle                        # Push source to hosts as incremental git bundles built locally, instead of each host fetching origin (Default: fetch)
         # Do not reset these paths even if they are git-ignored
         # git_force_ignore:
         #  - /node_modules
@@ -24,6 +28,18 @@ Application Blueprint
         # use_python: false                           # Enable python support, required for virtualenv (Default: true)
         # use_virtualenv: false                       # Enable virtualenv and pip requirements, unless `use_python` is false (Default: true)
         # requirements: requirements/live.txt         # Pip requirements file to install (Default: requirements.txt)
+        # merged_requirements: true                   # Install several requirement files in one pip pass, downloaded in parallel, then setup.py develop targets (Default: false)
+        # incremental_requirements: true              # On deploy, only install added or changed and uninstall removed requirements, unless includes, options or constraints changed (Default: false)
+        # virtualenvs:
+        #   content_addressed: true                   # Virtualenv per requirements hash, relinked instead of running pip when already built (Default: false)
+        #   keep: 3                                   # Virtualenvs to keep (Default: 3)
+        # releases:                                 # Deploy into releases/<commit> dirs, switching a current symlink atomically (Optional)
+        #   keep: 5                                   # Releases to keep for `app.rollback` (Default: 5)
+        #   virtualenv: true                          # Own virtualenv per release, instead of a shared one (Default: false)
+        # parallel:
+        #   pool_size: 10                             # Max hosts at a time for the `app.parallel` task (Default: 10)
+        # rolling:
+        #   batch: 25%                                # Hosts per `app.rolling_reload` batch, number or percentage (Default: 1)
         # system_dependencies:                        # List of debian packages to install
         #   - build-essential  # gcc
         #   - libmemcached-dev # memcached
@@ -45,6 +61,24 @@ Application Blueprint
           provider: uwsgi                             # Set web provider
           # module: foobar.wsgi                       # Set wsgi module (Default: django.core.handlers.wsgi:WSGIHandler())
           # socket: 127.0.0.1:3031                    # Set vassal socket (Default: 0.0.0.0:3030)
+          # health_url: /health/                      # Gate reloads on socket answering url with status < 400 (Optional)
+          # health_timeout: 60                        # Seconds to wait for health url after reload (Default: 60)
+          # preload: true                             # Load app in master, freeze its gc and fork workers from it, reloads restart the master (Default: false)
+          # reload: chain                             # uWSGI: Reload web workers one at a time via master FIFO, unless vassal ini changed (Default: touch)
+          # reload_timeout: 120                       # Seconds to wait for all uWSGI, or supervised Gunicorn, workers to be replaced on reload (Default: 120)
+          # cheaper: busyness                         # uWSGI: Spawn workers on demand up to `workers`, by algorithm spare, backlog or busyness (Optional)
+          # cheaper_min: 2                            # uWSGI: Workers always kept (Default: by cores and workers)
+          # cheaper_initial: 4                        # uWSGI: Workers spawned at start (Default: by cores and workers)
+          # cheaper_step: 2                           # uWSGI: Workers spawned at a time (Default: by cores and workers)
+          # cheaper_overload: 3                       # uWSGI: Seconds between checks, or queued requests to spawn at for backlog (Default: uWSGI's)
+          # tuning:                                   # uWSGI: Size workers and memory limits from stats socket samples, kept locally across deploys
+          #   enabled: true                           # (Default: false)
+          #   budget: 75%                             # Memory for web workers, in MB or percent of host memory (Default: 75%)
+          #   headroom: 1.5                           # Memory limits relative to 95th percentile of sampled worker memory (Default: 1.5)
+          #   utilization: 0.5                        # Target share of busy workers at the busiest sample (Default: 0.5)
+          #   sample_interval: 5                      # Seconds between the two stats reads of a sample (Default: 5)
+          #   history: 20                             # Samples kept per host and vassal (Default: 20)
+          #   cache_path: ~/.cache/blues/tuning       # Local sample history (Default: ~/.cache/blues/tuning)
           # hosts:                                    # Optional host list restricting web provider installation
           #   - 10.0.0.10
           #   - 10.0.0.11
@@ -84,10 +118,12 @@ blueprint = blueprints.get(__name__)
 
 from .application.tasks import setup, configure, deploy, deployed, start, stop,\
     reload, configure_providers, generate_nginx_conf, notify_deploy, \
-    install_requirements, notify_deploy_start, install_system_dependencies
+    install_requirements, notify_deploy_start, install_system_dependencies, \
+    parallel, rolling_reload, rollback
 
 from .application.deploy import update_source
 
 __all__ = ['setup', 'configure', 'deploy', 'deployed', 'start', 'stop',
            'reload', 'configure_providers', 'generate_nginx_conf',
-           'install_requirements', 'install_system_dependencies']
+           'install_requirements', 'install_system_dependencies', 'parallel',
+           'rolling_reload', 'rollback']
@@ -1,7 +1,8 @@
 import os
 from functools import partial
 
-from fabric.context_managers import cd
+from fabric.context_managers import cd, settings
+from fabric.contrib import files
 from fabric.state import env
 from fabric.utils import indent, abort, warn
 from blues.application.project import git_repository_path
@@ -18,7 +19,9 @@ from .. import git
 from .. import user
 from .. import python
 from .. import util
+from ..tracing import traced
 from .. import virtualenv
+from .. import wheelhouse
 
 __all__ = [
     'install_project',
@@ -30,12 +33,16 @@ __all__ = [
     'install_or_update_source',
     'install_source',
     'update_source',
+    'get_changes',
     'install_providers'
 ]
 
 
 blueprint = blueprints.get('blues.app')
 
+# Commit range deployed per host during this run
+_deployed = {}
+
 
 def install_project():
     create_app_root()
@@ -63,7 +70,7 @@ def install_project_user():
     """
     from .project import project_home, user_name, log_path
 
-    with sudo():
+    with sudo(), debian.queued():
         info('Install application user')
         username = user_name()
         home_path = project_home()
@@ -89,15 +96,16 @@ def install_project_user():
     dirs = blueprint.get('directories') or []
     if dirs:
         info('Create application directories')
-    for d in dirs:
-        if isinstance(d, basestring):
-            d = {'path': d}
-        info('  %s' % d['path'])
-        mode = d.get('mode')
-        debian.mkdir(d['path'], recursive=True,
-                     owner=d.get('owner') or username,
-                     group=d.get('group') or 'app-data',
-                     mode=int(mode) if mode else 1775)
+    with debian.queued():
+        for d in dirs:
+            if isinstance(d, basestring):
+                d = {'path': d}
+            info('  %s' % d['path'])
+            mode = d.get('mode')
+            debian.mkdir(d['path'], recursive=True,
+                         owner=d.get('owner') or username,
+                         group=d.get('group') or 'app-data',
+                         mode=int(mode) if mode else 1775)
 
 
 def install_project_structure():
@@ -106,7 +114,7 @@ def install_project_structure():
     """
     from .project import static_base, use_static
 
-    with sudo():
+    with sudo(), debian.queued():
         info('Install application directory structure')
 
         create_app_root()
@@ -156,18 +164,166 @@ def install_virtualenv():
     """
     Create a project virtualenv.
     """
-    from .project import sudo_project, virtualenv_path
+    from .project import sudo_project, virtualenv_path, use_release_virtualenv
+    from .virtualenvs import is_enabled as use_virtualenvs
 
     with sudo():
         virtualenv.install()
 
+    if use_release_virtualenv() or use_virtualenvs():
+        # Created per release, or per requirements
+        return
+
     with sudo_project():
         virtualenv.create(virtualenv_path())
 
 
+@traced()
 def maybe_install_requirements(previous_commit, current_commit, force=False, update_pip=False):
+    details = {}
+    changed_files = get_changed_requirements(previous_commit, current_commit,
+                                             force=force, details=details)
+
+    if changed_files and use_incremental_requirements() and not force:
+        changes = get_incremental_changes(details)
+        if changes is not None:
+            install_incremental(*changes, constraints=details['constraints'],
+                                update_pip=update_pip, installation_files=changed_files)
+            return
+        info('Requirement includes or options changed, installing in full')
+
+    if changed_files:
+        info('Install requirements {}', ', '.join(changed_files))
+        install_requirements(changed_files, update_pip=update_pip)
+    else:
+        info(indent('(requirements not changed in {}...skipping)'),
+             '{}..{}'.format(previous_commit, current_commit))
+
+
+def use_incremental_requirements():
+    """
+    Install only added and changed requirements, and uninstall removed ones?
+    """
+    return bool(blueprint.get('incremental_requirements', False))
+
+
+def get_incremental_changes(details):
+    """
+    Get requirement specifiers to install and packages to uninstall.
+
+    :param details: Collected by `get_changed_requirements`
+    :return: tuple(specifiers, package names) or None, if a full install is
+        needed, e.g. includes, options or constraints changed
+    """
+    added, removed = set(), set()
+    for additions, removals in details['diffs'].values():
+        if additions is None or any(spec.startswith('-') for spec in additions | removals):
+            return None
+        added |= additions
+        removed |= removals
+
+    added_names = set(util.requirement_name(spec) for spec in added)
+    removed_names = set(util.requirement_name(spec) for spec in removed)
+    current_names = set(util.requirement_name(spec) for spec in details['current'])
+    if None in added_names | removed_names:
+        return None
+
+    # Bumped or moved to another file, or still required elsewhere, is not removed
+    return sorted(added), sorted(removed_names - added_names - current_names)
+
+
+@traced()
+def install_incremental(specifiers, names, constraints=(), update_pip=False,
+                        installation_files=()):
+    """
+    Pip install requirement specifiers, and uninstall packages, in project virtualenv.
+
+    :param installation_files: Changed requirement files, to get wheelhouses for
+    """
+    from .project import sudo_project, virtualenv_path, git_repository_path
+
+    repository_path = git_repository_path()
+
+    with sudo_project(), virtualenv.activate(virtualenv_path()), cd(repository_path):
+        if update_pip:
+            python.update_pip()
+
+        if names:
+            # Dropped from requirement files, but maybe a dependency of another package
+            required = get_required(names)
+            if required:
+                info('Keeping removed requirements {}, still required', ', '.join(required))
+            names = [name for name in names if name not in required]
+
+        if names:
+            info('Uninstall removed requirements {}', ', '.join(names))
+            python.pip('uninstall', '-y', *names)
+
+        if specifiers:
+            info('Install changed requirements {}', ', '.join(specifiers))
+            options = ['-c {}'.format(path) for path in sorted(constraints)]
+            if wheelhouse.is_enabled():
+                options.append('--no-index')
+                for installation_file in installation_files:
+                    if get_installation_method(installation_file) == 'pip':
+                        path = wheelhouse.ensure(installation_file, repository_path)
+                        options.append('--find-links {}'.format(path))
+            python.pip('install', *(["'{}'".format(spec) for spec in specifiers] +
+                                    options))
+
+
+# Prints given package names that other installed distributions depend on
+REQUIRED_SCRIPT = """
+import re, sys, pkg_resources
+
+
+def normalize(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+names = set(normalize(name) for name in sys.argv[1:])
+required = set()
+for dist in pkg_resources.working_set:
+    if normalize(dist.project_name) not in names:
+        required.update(normalize(req.project_name) for req in dist.requires(dist.extras))
+print(' '.join(sorted(names & required)))
+"""
+
+
+def get_required(names):
+    """
+    Get package names that installed distributions, other than the named
+    ones, depend on, in activated virtualenv.
+
+    :param names: Normalized package names, see `util.requirement_name`
+    :return: set of names
+    """
+    with silent(), settings(warn_only=True):
+        output = run("python - {} <<'EOF'{}EOF".format(' '.join(names), REQUIRED_SCRIPT),
+                     pty=False)
+
+    if output.return_code != 0:
+        # Unknown, keep them all
+        return set(names)
+
+    return set(output.strip().split())
+
+
+def get_changed_requirements(previous_commit, current_commit, force=False,
+                             details=None):
+    """
+    Get requirement files that need to be installed for a commit range.
+
+    :param details: dict to collect `diffs`, i.e. (additions, removals) per
+        changed file, (None, None) if not diffed by requirement, `current`, all
+        requirements at current commit, and `constraints` files (Optional)
+    :return: list of installation files
+    """
     from .project import requirements_txt, git_repository_path
 
+    if details is None:
+        details = {}
+    details.update(diffs={}, current=set(), constraints=set())
+
     changed_files = []
 
     commit_range = '{}..{}'.format(previous_commit, current_commit)
@@ -178,50 +334,99 @@ def maybe_install_requirements(previous_commit, current_commit, force=False, upd
         changed_files = installation_files
 
     else:
+        # Both revisions of every requirement file, in one round-trip, includes
+        # missing from the snapshot are read from the checkout by the tree
         with sudo(), cd(git_repository_path()), silent():
-            tree = util.RequirementTree(paths=installation_files)
+            snapshot = git.show_files(git_repository_path(),
+                                      [previous_commit, current_commit],
+                                      extensions=util.REQUIREMENT_EXTENSIONS,
+                                      paths=installation_files)
+            tree = util.RequirementTree(paths=installation_files,
+                                        contents=snapshot[current_commit])
+
+        changes = get_changes(previous_commit, current_commit)
 
         for installation_file in tree.all_files():
+            if changes is not None and installation_file not in changes:
+                # Untouched in commit range, no need to diff
+                continue
+
             installation_method = get_installation_method(installation_file)
 
-            if not force:
-                if installation_method == 'pip':
-                    has_changed, added, removed = diff_requirements(
-                        previous_commit,
-                        current_commit,
-                        installation_file)
-
-                    if has_changed:
-                        info('Requirements have changed, '
-                             'added: {}, removed: {}'
-                             .format(', '.join(added), ', '.join(removed)))
-                else:
-                    # Check if installation_file has changed
-                    has_changed, _, _ = git.diff_stat(
-                        git_repository_path(),
-                        commit_range,
-                        installation_file)
+            if installation_method == 'pip':
+                has_changed, added, removed = diff_requirements(
+                    previous_commit,
+                    current_commit,
+                    installation_file,
+                    snapshot=snapshot)
 
                 if has_changed:
-                    changed_files.append(installation_file)
+                    info('Requirements have changed, '
+                         'added: {}, removed: {}'
+                         .format(', '.join(added), ', '.join(removed)))
+                    smart = isinstance(added, set) and not tree.is_constraint(installation_file)
+                    details['diffs'][installation_file] = \
+                        (added, removed) if smart else (None, None)
+            elif changes is not None:
+                has_changed = True
+            else:
+                # Check if installation_file has changed
+                has_changed, _, _ = git.diff_stat(
+                    git_repository_path(),
+                    commit_range,
+                    installation_file)
+
+            if has_changed:
+                changed_files.append(installation_file)
+                details['diffs'].setdefault(installation_file, (None, None))
 
-        changed_files = tree.get_changed(all_changed_files=changed_files)
+        with sudo(), cd(git_repository_path()), silent():
+            changed_files = tree.get_changed(all_changed_files=changed_files)
 
-    if changed_files:
-        info('Install requirements {}', ', '.join(changed_files))
-        install_requirements(changed_files, update_pip=update_pip)
-    else:
-        info(indent('(requirements not changed in {}...skipping)'),
-             commit_range)
+            details['constraints'] = set(path for path in tree.all_files()
+                                         if tree.is_constraint(path))
+            for path in tree.all_files():
+                if get_installation_method(path) == 'pip' and \
+                        path not in details['constraints']:
+                    details['current'].update(
+                        util.iter_requirements(tree.get_content(path)))
 
+    return changed_files
 
-def diff_requirements(previous_commit, current_commit, filename):
+
+def get_changes(previous_commit=None, current_commit=None):
+    """
+    Get index of files changed in commit range, or in the range deployed on
+    current host during this run.
+
+    Diffed once per host and range, for every deploy step to query, e.g.
+    ``get_changes().changed('requirements/', '*/migrations/*')``.
+
+    :return: git.ChangedFiles or None, if no range is known or it can not be diffed
+    """
+    from .project import git_repository_path
+
+    if previous_commit is None and current_commit is None:
+        previous_commit, current_commit = _deployed.get(env.host_string, (None, None))
+
+    if not previous_commit or not current_commit:
+        return None
+
+    if previous_commit == current_commit:
+        return git.ChangedFiles()
+
+    return git.changed_files(git_repository_path(),
+                             '{}..{}'.format(previous_commit, current_commit))
+
+
+def diff_requirements(previous_commit, current_commit, filename, snapshot=None):
     """
     Diff requirements file
 
     :param previous_commit:
     :param current_commit:
     :param filename:
+    :param snapshot: File contents per commit, see `git.show_files` (Optional)
     :return: 3-tuple with (has_changed, additions, removals) where
         has_changed is a bool, additions and removals may be sets or None.
     """
@@ -229,7 +434,8 @@ def diff_requirements(previous_commit, current_commit, filename):
         return diff_requirements_smart(previous_commit,
                                        current_commit,
                                        filename,
-                                       strict=True)
+                                       strict=True,
+                                       snapshot=snapshot)
     except ValueError:
         warn('Smart requirements diff failed, falling back to git diff')
 
@@ -242,11 +448,15 @@ def diff_requirements(previous_commit, current_commit, filename):
 
 
 def diff_requirements_smart(previous_commit, current_commit, filename,
-                            strict=False):
+                            strict=False, snapshot=None):
 
-    get_requirements = partial(git.show_file,
-                               repository_path=git_repository_path(),
-                               filename=filename)
+    if snapshot is not None:
+        def get_requirements(revision):
+            return snapshot.get(revision, {}).get(os.path.normpath(filename), '')
+    else:
+        get_requirements = partial(git.show_file,
+                                   repository_path=git_repository_path(),
+                                   filename=filename)
 
     force_changed = False
 
@@ -289,9 +499,14 @@ def get_installation_method(filename):
         return 'setuptools'
 
 
-def install_requirements(installation_files=None, update_pip=False):
+@traced()
+def install_requirements(installation_files=None, update_pip=False, env_path=None,
+                         repository_path=None):
     """
     Pip install requirements in project virtualenv.
+
+    :param env_path: Virtualenv to install in (Default: project virtualenv)
+    :param repository_path: Checkout to install from (Default: project source)
     """
     from .project import sudo_project, virtualenv_path, requirements_txt, \
         git_repository_path
@@ -302,20 +517,31 @@ def install_requirements(installation_files=None, update_pip=False):
     if isinstance(installation_files, basestring):
         installation_files = [installation_files]
 
+    repository_path = repository_path or git_repository_path()
+
+    if use_merged_requirements() and len(installation_files) > 1:
+        install_merged_requirements(installation_files, update_pip=update_pip,
+                                    env_path=env_path or virtualenv_path(),
+                                    repository_path=repository_path)
+        return
+
     with sudo_project():
-        path = virtualenv_path()
+        path = env_path or virtualenv_path()
 
         for installation_file in installation_files:
             info('Installing requirements from file {}', installation_file)
 
-            with virtualenv.activate(path), cd(git_repository_path()):
+            with virtualenv.activate(path), cd(repository_path):
                 installation_method = get_installation_method(installation_file)
                 if installation_method == 'pip':
                     if update_pip:
                         python.update_pip()
-                    python.pip('install', '-r', installation_file)
+                    if wheelhouse.is_enabled():
+                        wheelhouse.install(installation_file, repository_path)
+                    else:
+                        python.pip('install', '-r', installation_file)
                 elif installation_method == 'setuptools':
-                    with cd(git_repository_path()):
+                    with cd(repository_path):
                         run('python {} develop'.format(installation_file))
                 else:
                     raise ValueError(
@@ -323,6 +549,90 @@ def install_requirements(installation_files=None, update_pip=False):
                             installation_file))
 
 
+def use_merged_requirements():
+    """
+    Install several requirement files in one pip pass, next to setup.py develop?
+    """
+    return bool(blueprint.get('merged_requirements', False))
+
+
+@traced()
+def install_merged_requirements(installation_files, update_pip=False, env_path=None,
+                                repository_path=None):
+    """
+    Pip install all requirement files in one resolver pass, then run setup.py
+    develop targets, which install whatever of their dependencies pip did not.
+
+    Without wheelhouse, packages of several requirement files are first
+    downloaded by parallel pip runs, and installed from there without an index.
+    """
+    from .project import sudo_project
+
+    methods = dict((installation_file, get_installation_method(installation_file))
+                   for installation_file in installation_files)
+    invalid = [f for f, method in methods.items() if method not in ('pip', 'setuptools')]
+    if invalid:
+        raise ValueError('"{}" is not a valid installation file'.format(invalid[0]))
+
+    pip_files = [f for f in installation_files if methods[f] == 'pip']
+    develop_files = [f for f in installation_files if methods[f] == 'setuptools']
+
+    info('Installing requirements from files {}', ', '.join(installation_files))
+
+    with sudo_project(), virtualenv.activate(env_path), cd(repository_path):
+        if update_pip:
+            python.update_pip()
+
+        requirements = []
+        for installation_file in pip_files:
+            requirements += ['-r', installation_file]
+
+        if wheelhouse.is_enabled():
+            options = []
+            for installation_file in pip_files:
+                options += ['--no-index', '--find-links',
+                            wheelhouse.ensure(installation_file, repository_path)]
+            python.pip('install', *(options + requirements))
+        elif len(pip_files) > 1:
+            install_downloaded(pip_files, requirements)
+        elif pip_files:
+            python.pip('install', *requirements)
+
+        # Not concurrently with pip, both write the virtualenv's easy-install.pth
+        for installation_file in develop_files:
+            run('python {} develop'.format(installation_file))
+
+
+def install_downloaded(installation_files, requirements):
+    """
+    Download packages of each requirement file in parallel, then pip install
+    requirements from the downloads, or from the index if the downloads, each
+    resolved on their own, do not satisfy them all.
+
+    Called as project user, with the project virtualenv activated.
+    """
+    with silent():
+        download_path = run('mktemp -d', pty=False).strip()
+
+    find_links = []
+    downloads = []
+    for i, installation_file in enumerate(installation_files):
+        path = os.path.join(download_path, str(i))
+        find_links += ['--find-links', path]
+        downloads.append(python.pip_command('download', '--quiet', '--dest', path,
+                                            '-r', installation_file, verbose=False))
+
+    info('Downloading requirements from files {}', ', '.join(installation_files))
+    with silent():
+        run('{} wait'.format(''.join('{} & '.format(download) for download in downloads)),
+            pty=False)
+
+    info('Running pip install')
+    offline = python.pip_command('install', '--no-index', *(find_links + requirements))
+    online = python.pip_command('install', *requirements)
+    run('{} || {}; status=$?; rm -rf {}; exit $status'.format(offline, online, download_path))
+
+
 def install_or_update_source():
     """
     Try to install source, if already installed then update.
@@ -338,23 +648,49 @@ def install_source():
 
     :return: True, if repository got cloned
     """
-    from .project import sudo_project, git_repository, git_root
+    from .project import sudo_project, git_repository, git_repository_path, git_root, \
+        project_name
 
     with sudo():
         git.install()
 
+    repository = git_repository()
+    branch = repository['branch']
+
+    options = git_options()
+    installed = files.exists(os.path.join(git_repository_path(), '.git'))
+
+    bundle = None
+    if use_bundles():
+        branch = branch or git.default_branch(repository['url'])
+        if not installed:
+            bundle = git.upload_bundle(repository['url'], branch)
+
+    if options['reference'] and not installed:
+        with sudo():
+            git.init_reference(options['reference'])
+
     with sudo_project() as username:
         path = git_root()
         debian.mkdir(path, owner=username, group=username)
+
+        if options['reference'] and not installed and not bundle:
+            git.update_reference(options['reference'], repository['url'],
+                                 project_name())
+
         with cd(path):
-            repository = git_repository()
-            path, cloned = git.clone(repository['url'], branch=repository['branch'])
+            path, cloned = git.clone(repository['url'], branch=branch, bundle=bundle,
+                                     **options)
             if cloned is None:
                 abort('Failed to install source, aborting!')
 
+    if bundle:
+        debian.rm(bundle)
+
     return cloned
 
 
+@traced()
 def update_source():
     """
     Update application repository with configured branch.
@@ -363,23 +699,63 @@ def update_source():
     """
     from .project import sudo_project, git_repository_path, git_repository
 
+    path = git_repository_path()
+    repository = git_repository()
+    branch = repository['branch']
+
     with sudo_project():
         # Get current commit
-        path = git_repository_path()
-        previous_commit = git.get_commit(path, short=True)
+        previous_commit = git.get_commit(path)
 
-        # Update source from git (reset)
-        repository = git_repository()
-        current_commit = git.reset(repository['branch'],
-                                   repository_path=path,
-                                   ignore=blueprint.get('git_force_ignore'))
+    bundle = None
+    if use_bundles():
+        # Ship the missing commits, instead of every host fetching origin
+        branch = branch or git.default_branch(repository['url'])
+        bundle = git.upload_bundle(repository['url'], branch,
+                                   base_commit=previous_commit)
 
-        if current_commit is not None and current_commit != previous_commit:
-            info(indent('(new version)'))
+    with sudo_project():
+        if use_bundles() and bundle is None:
+            # Already at branch tip, only reset
+            current_commit = git.reset(branch, repository_path=path, fetch=False,
+                                       ignore=blueprint.get('git_force_ignore'))
         else:
-            info(indent('(same commit)'))
+            # Update source from git (reset)
+            current_commit = git.reset(branch, repository_path=path, bundle=bundle,
+                                       depth=git_options()['depth'],
+                                       ignore=blueprint.get('git_force_ignore'))
+
+    if bundle:
+        debian.rm(bundle)
+
+    previous_commit = previous_commit[:7]
+    if current_commit is not None and current_commit != previous_commit:
+        info(indent('(new version)'))
+    else:
+        info(indent('(same commit)'))
+
+    if current_commit is not None:
+        _deployed[env.host_string] = (previous_commit, current_commit)
+
+    return previous_commit, current_commit
 
-        return previous_commit, current_commit
+
+def git_options():
+    """
+    Get shallow, partial and shared-reference clone settings.
+    """
+    return {
+        'depth': blueprint.get('git_depth'),
+        'filter': blueprint.get('git_filter'),
+        'reference': blueprint.get('git_reference'),
+    }
+
+
+def use_bundles():
+    """
+    Deliver source as git bundles built locally, instead of fetching origin?
+    """
+    return blueprint.get('git_delivery', 'fetch') == 'bundle'
 
 
 def install_providers():
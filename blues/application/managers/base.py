@@ -3,7 +3,7 @@ from fabric.state import env
 
 from ..project import *
 
-from ... import debian
+from ... import facts
 from ...app import blueprint
 
 from refabric.utils import info
@@ -25,10 +25,37 @@ class BaseManager(object):
         """
         raise NotImplementedError
 
+    def reload(self, program=None):
+        """
+        Reload program(s) run by manager.
+
+        :param program: Program name (Default: all)
+        """
+        raise NotImplementedError
+
+    def restart(self, program=None):
+        """
+        Restart program(s) run by manager, e.g. to reload a preloaded app.
+
+        Managers without a master process to restart reload instead.
+
+        :param program: Program name (Default: all)
+        """
+        self.reload(program)
+
+    def get_workers(self, program):
+        """
+        Get pids of processes forked by program, e.g. its workers.
+
+        :param program: Program name
+        :return: Set of pids, or None if not observable
+        """
+        return None
+
     def get_context(self):
         context = {
             'current_host': env.host_string,
-            'user': debian.get_user(name=self.user)
+            'user': facts.get_user(self.user)
         }
 
         return context
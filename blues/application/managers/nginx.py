@@ -7,6 +7,7 @@ from refabric.contrib import blueprints
 from .base import BaseManager
 
 from ... import nginx
+from ... import uploads
 
 blueprint = blueprints.get('blues.app')
 
@@ -18,7 +19,7 @@ class NginxManager(BaseManager):
         with sudo():
             nginx.install()
 
-    def reload(self):
+    def reload(self, program=None):
         with sudo():
             nginx.reload()
 
@@ -35,13 +36,14 @@ class NginxManager(BaseManager):
         default_templates = nginx.blueprint.get_default_template_root()
 
         with settings(template_dirs=[default_templates]):
-            uploads = blueprint.upload(
+            updates = uploads.upload(
+                blueprint,
                 template,
                 os.path.join(destination,
                              '{}.conf'.format(program_name)),
                 context=context)
 
-        self.updates.extend(uploads)
+        self.updates.extend(updates)
 
         self.reload()
 
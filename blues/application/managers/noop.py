@@ -6,7 +6,7 @@ class NoopManager(BaseManager):
     def install(self):
         pass
 
-    def reload(self):
+    def reload(self, program=None):
         pass
 
     def configure_provider(self, provider, context, program_name=None):
@@ -9,6 +9,7 @@ from ..project import *
 
 from ... import debian
 from ... import supervisor
+from ... import uploads
 
 blueprint = blueprints.get('blues.app')
 
@@ -68,7 +69,13 @@ class SupervisorManager(BaseManager):
             destination = os.path.join(destination, name)
 
         with settings(template_dirs=[default_templates]):
-            return blueprint.upload(template, destination, context=context)
+            return uploads.upload(blueprint, template, destination, context=context)
 
     def reload(self, program=None):
         supervisor.reload(program)
+
+    def restart(self, program=None):
+        supervisor.restart(program)
+
+    def get_workers(self, program):
+        return supervisor.get_child_pids(program)
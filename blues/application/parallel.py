@@ -0,0 +1,169 @@
+"""
+Parallel execution of application tasks over all hosts.
+
+Each host runs in its own forked worker with stdout/stderr buffered and
+printed, prefixed by host, when the host is done. Workers return small
+picklable summaries that are aggregated into one report.
+"""
+import sys
+import traceback
+from collections import Counter
+from functools import wraps
+from StringIO import StringIO
+
+from fabric import decorators
+from fabric.state import env
+from fabric.tasks import execute as fabric_execute
+from fabric.utils import indent, puts, warn
+
+from refabric.contrib import blueprints
+from refabric.utils import info
+
+__all__ = ['execute', 'runs_once', 'is_worker', 'report']
+
+
+blueprint = blueprints.get('blues.app')
+
+DEFAULT_POOL_SIZE = 10
+
+
+def is_worker():
+    """
+    Are we executing inside a parallel host worker?
+    """
+    return bool(env.get('blues_parallel_hosts'))
+
+
+def is_primary_host():
+    """
+    Is current host the one running `runs_once` tasks during fan out?
+    """
+    hosts = env.get('blues_parallel_hosts')
+    return not hosts or env.host_string == hosts[0]
+
+
+def runs_once(func):
+    """
+    Like fabric's `runs_once`, but also only run once while fanned out.
+
+    Forked workers do not share fabric's memoized return value, so inside
+    a worker the task only runs on the first host of the fan out.
+    """
+    once = decorators.runs_once(func)
+
+    @wraps(once)
+    def decorated(*args, **kwargs):
+        if is_worker() and not is_primary_host():
+            return None
+        return once(*args, **kwargs)
+
+    return decorated
+
+
+def execute(func, hosts=None, pool_size=None, *args, **kwargs):
+    """
+    Execute function on all hosts in parallel, with bounded worker pool.
+
+    :param func: Function to run per host, should return a picklable value
+    :param hosts: Hosts to run on (Default: all hosts of current command)
+    :param pool_size: Max concurrent hosts (Default: app.parallel.pool_size or 10)
+    :return: dict(host=dict(result, output, error))
+    """
+    hosts = list(hosts or env.all_hosts or [env.host_string])
+    if pool_size is None:
+        pool_size = blueprint.get('parallel.pool_size', DEFAULT_POOL_SIZE)
+    pool_size = int(pool_size)
+
+    @decorators.parallel(pool_size=pool_size)
+    @wraps(func)
+    def worker():
+        env.blues_parallel_hosts = hosts
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = buffer = StringIO()
+        try:
+            result, error = func(*args, **kwargs), None
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            result = None
+            if isinstance(e, SystemExit):
+                # Raised by abort(), find its message in the buffered output
+                fatal = [line for line in buffer.getvalue().splitlines()
+                         if 'Fatal error:' in line]
+                error = fatal[-1].split('Fatal error:', 1)[1].strip() if fatal else 'aborted'
+            else:
+                error = str(e) or e.__class__.__name__
+                traceback.print_exc()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+        return {'result': result, 'output': buffer.getvalue(), 'error': error}
+
+    info('Executing {} on {} host(s), {} at a time',
+         func.__name__, len(hosts), min(pool_size, len(hosts)))
+
+    results = fabric_execute(worker, hosts=hosts)
+
+    for host in hosts:
+        result = results.get(host)
+        if not isinstance(result, dict):
+            # Worker died without returning
+            results[host] = {'result': None, 'output': '', 'error': str(result)}
+
+        print_output(host, results[host]['output'])
+
+    return results
+
+
+def print_output(host, output):
+    prefix = '[{}]'.format(host)
+    for line in output.splitlines():
+        if not line.startswith(prefix):
+            line = '{} {}'.format(prefix, line)
+        puts(line, show_prefix=False)
+
+
+def report(results, key=None):
+    """
+    Print aggregated summary and list failed and diverged hosts.
+
+    A host has diverged if its `key` value differs from the majority.
+
+    :param results: Results from `execute`
+    :param key: Summary key to compare between hosts, e.g. commit
+    :return: (failed hosts, diverged hosts)
+    """
+    failed = sorted(host for host, r in results.items() if r['error'])
+    succeeded = [host for host in results if host not in failed]
+
+    diverged = []
+    if key and succeeded:
+        values = Counter(results[host]['result'].get(key) for host in succeeded)
+        majority, count = values.most_common(1)[0]
+        diverged = sorted(host for host in succeeded
+                          if results[host]['result'].get(key) != majority)
+        info('{}/{} host(s) at {} {}', count, len(results), key, majority)
+
+    for host in sorted(succeeded):
+        summary = results[host]['result'] or {}
+        details = ', '.join('{}: {}'.format(k, format_value(v))
+                            for k, v in sorted(summary.items()))
+        puts(indent('{}: {}'.format(host, details or 'ok')), show_prefix=False)
+
+    if failed:
+        warn('Failed on {} host(s):'.format(len(failed)))
+        for host in failed:
+            puts(indent('{}: {}'.format(host, results[host]['error'])), show_prefix=False)
+
+    if diverged:
+        warn('Diverged {} on {} host(s): {}'.format(key, len(diverged), ', '.join(diverged)))
+
+    return failed, diverged
+
+
+def format_value(value):
+    if isinstance(value, (list, tuple, set)):
+        return ', '.join(str(v) for v in value) or '-'
+    if value is None or value is False:
+        return '-'
+    return str(value)
@@ -10,7 +10,8 @@ __all__ = [
     'app_root', 'project_home', 'git_root', 'use_virtualenv', 'virtualenv_path',
     'git_repository', 'git_repository_path', 'python_path', 'sudo_project',
     'requirements_txt', 'use_python', 'static_base', 'project_name',
-    'user_name', 'log_path',
+    'user_name', 'log_path', 'use_releases', 'use_release_virtualenv',
+    'releases_path', 'current_path', 'source_path',
 ]
 
 blueprint = blueprints.get('blues.app')
@@ -21,6 +22,13 @@ use_python = lambda: blueprint.get('use_python', True)
 # install virtualenv and python dependencies
 use_virtualenv = lambda: blueprint.get('use_virtualenv', True) and use_python()
 
+# deploy into atomically switched release dirs
+use_releases = lambda: bool(blueprint.get('releases'))
+
+# own virtualenv per release, instead of a shared one
+use_release_virtualenv = lambda: use_releases() and use_virtualenv() and \
+    bool(blueprint.get('releases.virtualenv', False))
+
 # Should we set up /srv/www?
 use_static = lambda: blueprint.get('use_static', True)
 
@@ -31,8 +39,13 @@ project_home = lambda: os.path.join(app_root(), project_name())
 # /srv/app/project/src
 git_root = lambda: os.path.join(project_home(),
                                 'src')
-# /srv/app/project/env
-virtualenv_path = lambda: os.path.join(project_home(),
+# /srv/app/project/releases
+releases_path = lambda: os.path.join(project_home(), 'releases')
+# /srv/app/project/current -> releases/<commit>
+current_path = lambda: os.path.join(project_home(), 'current')
+# /srv/app/project/env or /srv/app/project/current/env
+virtualenv_path = lambda: os.path.join(current_path() if use_release_virtualenv()
+                                       else project_home(),
                                        'env')
 # git repo dict
 git_repository = lambda: git.parse_url(blueprint.get('git_url'),
@@ -40,8 +53,11 @@ git_repository = lambda: git.parse_url(blueprint.get('git_url'),
 # /srv/app/project/src/repo.git
 git_repository_path = lambda: os.path.join(git_root(),
                                            git_repository()['name'])
-# /srv/app/project/src/repo.git
-python_path = lambda: os.path.join(git_repository_path(),
+# /srv/app/project/src/repo.git or /srv/app/project/current/repo.git
+source_path = lambda: os.path.join(current_path(), git_repository()['name']) \
+    if use_releases() else git_repository_path()
+# /srv/app/project/src/repo.git/src
+python_path = lambda: os.path.join(source_path(),
                                    blueprint.get('git_source', 'src'))
 # <project>
 project_name = lambda: blueprint.get('project')
@@ -1,8 +1,12 @@
 # coding=utf-8
+import os
+
 from fabric.state import env
 
 from ..project import *
-from ... import debian
+from ... import facts
+from ... import uploads
+from ...app import blueprint
 from ..managers import get_manager
 
 
@@ -42,7 +46,7 @@ class BaseProvider(object):
 
         context.update(get_project_info())
 
-        owner = debian.get_user(self.user)
+        owner = facts.get_user(self.user)
         context.update(owner)  # name, uid, gid, ...
 
         return context
@@ -69,6 +73,53 @@ class BaseProvider(object):
         """
         pass
 
+    def use_preload(self):
+        """
+        Load the web app in the master process and fork workers from it?
+        """
+        return blueprint.get('web.preload') in (True, 'true')
+
+    def get_preload_path(self):
+        return os.path.join(project_home(), 'wsgi_preload.py')
+
+    def configure_preload(self, module):
+        """
+        Render and upload wsgi module, loading the app and freezing the
+        garbage collector in the master process.
+
+        :param module: Wsgi module of app, <module>[:<callable>]
+        :return: Updated files
+        """
+        return uploads.upload(blueprint, 'preload/wsgi_preload.py', self.get_preload_path(),
+                              context={'module': module})
+
+    def get_workers(self):
+        """
+        Get serving web workers, to observe a reload by.
+
+        :return: Set of worker pids, or None if not observable
+        """
+        return None
+
+    def wait_until_reloaded(self, workers, timeout=None):
+        """
+        Wait for web workers from before a reload to be replaced.
+
+        :param workers: Workers from `get_workers`, before the reload
+        :param timeout: Seconds to wait
+        :return: bool, reloaded?
+        """
+        return True
+
+    def wait_until_healthy(self, timeout=None):
+        """
+        Wait for provider to serve again after a reload.
+
+        :param timeout: Seconds to wait
+        :return: bool, healthy?
+        """
+        return True
+
 
 def get_project_info():
     from .. import project
@@ -9,6 +9,7 @@ from ..project import *
 
 from ... import debian
 from ...app import blueprint
+from ...tracing import traced
 
 
 class CeleryProvider(ManagedProvider):
@@ -33,6 +34,7 @@ class CeleryProvider(ManagedProvider):
 
         return context
 
+    @traced()
     def reload(self):
         for program in self.get_programs():
             name, _, _ = program.partition('.')
@@ -1,4 +1,5 @@
 import os
+import time
 
 from refabric.context_managers import sudo
 from refabric.utils import info
@@ -8,6 +9,7 @@ from ..project import sudo_project, virtualenv_path
 
 from ... import debian, python, virtualenv
 from ...app import blueprint
+from ...tracing import traced
 
 from .base import ManagedProvider
 
@@ -20,7 +22,11 @@ class GunicornProvider(ManagedProvider):
         with sudo_project(), virtualenv.activate(virtualenv_path()):
             python.pip('install', 'gunicorn')
 
+    @traced()
     def reload(self):
+        if self.use_preload():
+            # HUP forks new workers from the preloaded app, a new master loads new code
+            return self.manager.restart(self.project)
         return self.manager.reload(self.project)
 
     def get_context(self):
@@ -34,6 +40,7 @@ class GunicornProvider(ManagedProvider):
             'socket': socket_string,
             'workers': blueprint.get('web.workers', debian.nproc() * 2),
             'module': blueprint.get('web.module'),
+            'preload': self.use_preload(),
         }
 
         context.update(bp)
@@ -43,9 +50,55 @@ class GunicornProvider(ManagedProvider):
     def configure(self):
         context = self.get_context()
 
+        if context['preload']:
+            self.updates.extend(self.configure_preload(
+                context['module'] or 'django.core.handlers.wsgi:WSGIHandler()'))
+
         self.manager.configure_provider(self,
                                         context,
                                         program_name=self.project)
 
     def configure_web(self):
         return self.configure()
+
+    def get_workers(self):
+        """
+        Get pids of gunicorn workers, forked by the master the manager runs
+
+        :return: Set of worker pids, or None if not running or observable
+        """
+        return self.manager.get_workers(self.project)
+
+    def wait_until_reloaded(self, workers, timeout=None):
+        """
+        Wait for all gunicorn workers to be replaced after a reload
+
+        :param workers: Worker pids from before the reload
+        :param timeout: Seconds to wait
+        :return: bool, reloaded?
+        """
+        if not workers:
+            return True
+
+        timeout = int(timeout or blueprint.get('web.reload_timeout', 120))
+        started = time.time()
+        while time.time() - started < timeout:
+            time.sleep(1)
+            current = self.get_workers()
+            if current and not current & workers:
+                return True
+
+        return False
+
+    def wait_until_healthy(self, timeout=None):
+        """
+        Wait for gunicorn socket to answer health url
+
+        :param timeout: Seconds to wait
+        :return: bool, healthy?
+        """
+        from ..rolling import wait_for_socket
+
+        socket = blueprint.get('web.socket') or '0.0.0.0:8000'
+
+        return wait_for_socket(socket, protocol='http', timeout=timeout)
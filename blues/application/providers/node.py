@@ -7,6 +7,7 @@ from refabric.contrib import blueprints
 from refabric.operations import run
 
 from ... import node, debian
+from ...tracing import traced
 
 from ..project import sudo_project, project_home, git_repository_path,\
     static_base
@@ -43,9 +44,15 @@ class NodeProvider(ManagedProvider):
         self.build()
 
     def install_requirements(self):
+        from ..deploy import get_changes
+
+        # Only when package.json or bower.json changed in deployed range, if known
+        changes = get_changes()
         with sudo_project(), bash_profile(), cd(git_repository_path()):
-            node.install_dependencies(production=True)
+            node.install_dependencies(production=True,
+                                      changed=True if changes is None else changes)
 
+    @traced()
     def reload(self):
         self.build()
 
@@ -1,5 +1,6 @@
 from refabric.contrib import blueprints
 from .base import ManagedProvider
+from ...tracing import traced
 
 blueprint = blueprints.get('blues.app')
 
@@ -11,6 +12,7 @@ class ProgramProvider(ManagedProvider):
     def install(self):
         pass
 
+    @traced()
     def reload(self):
         self.manager.reload(self.project)
 
@@ -9,9 +9,12 @@ from refabric.context_managers import sudo, silent
 
 from .base import ManagedProvider
 from ..project import *
+from .. import tuning
 
 from ... import debian
+from ... import uploads
 from ...app import blueprint
+from ...tracing import traced
 
 
 class UWSGIProvider(ManagedProvider):
@@ -62,8 +65,9 @@ class UWSGIProvider(ManagedProvider):
 
         # Memory optimized options
         cpu_count = blueprint.get('web.max_cores', debian.nproc())
-        total_memory = int(round(debian.total_memory() / 1024.0 / 1024.0 / 1024.0))
-        total_memory = blueprint.get('web.max_memory', default=total_memory)
+        total_memory_mb = debian.total_memory() / 1024.0 / 1024.0
+        # Fractional GB, a 1.6 GB host is not rounded to 2 GB, or 0.4 GB to 0
+        total_memory = blueprint.get('web.max_memory', default=round(total_memory_mb / 1024.0, 2))
         workers = blueprint.get('web.workers', default=uwsgi.get_worker_count(cpu_count))
         gevent = blueprint.get('web.gevent', default=0)
         info('Generating uWSGI conf based on {} core(s), {} GB memory and {} worker(s)',
@@ -71,7 +75,6 @@ class UWSGIProvider(ManagedProvider):
 
         # TODO: Handle different loop engines (gevent)
         context.update({
-            'cpu_affinity': uwsgi.get_cpu_affinity(cpu_count, workers),
             'workers': workers,
             'max_requests': int(uwsgi.get_max_requests(total_memory)),
             'reload_on_as': int(uwsgi.get_reload_on_as(total_memory)),
@@ -79,11 +82,26 @@ class UWSGIProvider(ManagedProvider):
             'limit_as': int(uwsgi.get_limit_as(total_memory)),
             'gevent': gevent,
             'http': blueprint.get('web.http') == 'true',
+            'preload': self.use_preload(),
+            'preload_path': self.get_preload_path(),
         })
 
+        vassal = self.get_web_vassal()
+        if vassal and tuning.is_enabled():
+            # Workers and limits from sampled workers, explicit settings still win below
+            context.update(tuning.tune(os.path.splitext(vassal)[0], cpu_count,
+                                       float(total_memory) * 1024))
+
+        workers = blueprint.get('web.workers', context['workers'])
+        context['cpu_affinity'] = uwsgi.get_cpu_affinity(cpu_count, workers)
+
         # Override context defaults with blueprint settings
         context.update(blueprint.get('web'))
 
+        # Adaptive process spawning, workers is then the maximum
+        budget = int(tuning.memory_budget(float(total_memory) * 1024)) * 1024 * 1024
+        context.update(uwsgi.get_cheaper_context(context, cpu_count, budget))
+
         return context
 
     def configure_web(self):
@@ -97,6 +115,10 @@ class UWSGIProvider(ManagedProvider):
         destination = self.get_config_path()
         context = self.get_context()
 
+        if context['preload']:
+            self.updates.extend(self.configure_preload(
+                context.get('module') or 'django.core.handlers.wsgi:WSGIHandler()'))
+
         ini = self.get_web_vassal()
         template = os.path.join('uwsgi', ini)
 
@@ -107,9 +129,10 @@ class UWSGIProvider(ManagedProvider):
                 # Upload default web vassal
                 info(indent('...using default web vassal'))
                 template = os.path.join('uwsgi', 'default', 'web.ini')
-                uploads = blueprint.upload(template, os.path.join(destination, ini), context=context)
-                if uploads:
-                    self.updates.extend(uploads)
+                web_vassal = uploads.upload(blueprint, template, os.path.join(destination, ini),
+                                            context=context)
+                if web_vassal:
+                    self.updates.extend(web_vassal)
 
             # Upload remaining (local) vassals
             user_vassals = blueprint.upload('uwsgi/', destination, context=context)  # TODO: skip subdirs
@@ -138,12 +161,12 @@ class UWSGIProvider(ManagedProvider):
         context.update(blueprint.get('worker'))
 
         # Upload vassals
-        for vassal in self.list_worker_vassals():
-            template = os.path.join('uwsgi', 'default', vassal)
-            default_templates = uwsgi.blueprint.get_default_template_root()
-            with settings(template_dirs=[default_templates]):
-                uploads = blueprint.upload(template, destination, context=context)
-            self.updates.extend(uploads)
+        templates = [os.path.join('uwsgi', 'default', vassal)
+                     for vassal in sorted(self.list_worker_vassals())]
+        default_templates = uwsgi.blueprint.get_default_template_root()
+        with settings(template_dirs=[default_templates]):
+            self.updates.extend(uploads.upload(blueprint, templates, destination,
+                                               context=context))
 
         return self.updates
 
@@ -206,14 +229,71 @@ class UWSGIProvider(ManagedProvider):
 
         return vassals
 
+    @traced()
     def reload(self, vassals=None):
         """
-        Touch reload specified vassals
+        Touch reload specified vassals, or chain reload the web vassal
 
         :param vassals: Vassals to reload
         """
         from blues import uwsgi
 
+        # Workers of a preloaded app are forked from the old app, restart the master
+        chain = blueprint.get('web.reload') == 'chain' and not self.use_preload()
+        web_vassal = self.get_web_vassal()
+
         for vassal_ini in vassals or self.list_vassals():
             vassal_ini_path = os.path.join(self.get_config_path(), vassal_ini)
-            uwsgi.reload(vassal_ini_path)
+            # A changed ini is only read by the emperor on touch
+            if chain and vassal_ini == web_vassal and vassal_ini_path not in self.updates:
+                uwsgi.chain_reload(vassal_ini_path,
+                                   timeout=int(blueprint.get('web.reload_timeout', 120)))
+            else:
+                uwsgi.reload(vassal_ini_path)
+
+    def get_workers(self):
+        """
+        Get pids of web vassal workers, from its stats socket
+
+        :return: Set of worker pids, or None if not running
+        """
+        from blues import uwsgi
+
+        vassal = self.get_web_vassal()
+        if not vassal:
+            return None
+
+        vassal_name = os.path.splitext(vassal)[0]
+        stats = uwsgi.read_stats(vassal_name).get(vassal_name)
+        return uwsgi.worker_pids(stats) if stats else None
+
+    def wait_until_reloaded(self, workers, timeout=None):
+        """
+        Wait for all web vassal workers to be respawned after a reload
+
+        :param workers: Worker pids from before the reload
+        :param timeout: Seconds to wait
+        :return: bool, reloaded?
+        """
+        from blues import uwsgi
+
+        if not workers:
+            return True
+
+        vassal_name = os.path.splitext(self.get_web_vassal())[0]
+        timeout = int(timeout or blueprint.get('web.reload_timeout', 120))
+        return uwsgi.wait_for_workers(vassal_name, workers, timeout=timeout) is not None
+
+    def wait_until_healthy(self, timeout=None):
+        """
+        Wait for web vassal socket to answer health url
+
+        :param timeout: Seconds to wait
+        :return: bool, healthy?
+        """
+        from ..rolling import wait_for_socket
+
+        socket = blueprint.get('web.socket', '0.0.0.0:3030')
+        protocol = 'http' if blueprint.get('web.http') in (True, 'true') else 'uwsgi'
+
+        return wait_for_socket(socket, protocol=protocol, timeout=timeout)
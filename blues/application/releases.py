@@ -0,0 +1,185 @@
+"""
+Atomic releases.
+
+Each deployed commit gets a release dir, releases/<commit>, holding a shared
+clone of the source, and optionally its own virtualenv. The `current` symlink
+is switched to a release with one atomic rename, and the last releases are
+kept for instant rollback.
+
+The source checkout, src/<repo>, is still what gets fetched and reset on deploy,
+releases are local clones of it, with hardlinked objects of their own, so gc or
+a shallow fetch in the source checkout never breaks a kept release.
+"""
+import os
+
+from fabric.context_managers import cd
+from fabric.contrib import files
+from fabric.utils import abort
+
+from refabric.context_managers import silent
+from refabric.operations import run
+from refabric.utils import info
+from refabric.contrib import blueprints
+
+from .. import debian
+from .. import virtualenv
+
+__all__ = ['release', 'rollback', 'get_current', 'list_releases']
+
+
+blueprint = blueprints.get('blues.app')
+
+DEFAULT_KEEP = 5
+
+
+def keep():
+    return max(int(blueprint.get('releases.keep', DEFAULT_KEEP)), 1)
+
+
+def release_path(commit):
+    from .project import releases_path
+    return os.path.join(releases_path(), commit)
+
+
+def source_path(commit):
+    from .project import git_repository
+    return os.path.join(release_path(commit), git_repository()['name'])
+
+
+def get_current():
+    """
+    Get commit of current release.
+
+    :return: commit or None if no release is current
+    """
+    from .project import current_path, sudo_project
+
+    with sudo_project(), silent():
+        output = run('readlink {}; true'.format(current_path()), pty=False)
+
+    target = output.strip()
+    return os.path.basename(target) if target else None
+
+
+def list_releases():
+    """
+    List release commits, newest first.
+    """
+    from .project import releases_path, sudo_project
+
+    with sudo_project(), silent():
+        output = run('ls -1t {} 2>/dev/null; true'.format(releases_path()), pty=False)
+
+    return output.split()
+
+
+def create(commit):
+    """
+    Create release dir for commit, unless already there.
+
+    :return: True, if created
+    """
+    from .deploy import install_requirements
+    from .project import sudo_project, git_repository_path, use_release_virtualenv
+
+    path = release_path(commit)
+    checkout_path = source_path(commit)
+
+    with sudo_project():
+        if files.exists(checkout_path):
+            info('Release {} already exists', commit)
+            # Newest again, when pruning
+            run('touch {}'.format(path))
+            return False
+
+        info('Creating release {}', commit)
+        debian.mkdir(path)
+        # Hardlinks objects of the source checkout, nothing is fetched, but unlike
+        # --shared they stay when the source checkout is gc'ed or fetched shallow
+        run('git clone --quiet --local --no-checkout {} {}'.format(
+            git_repository_path(), checkout_path))
+        with cd(checkout_path):
+            run('git checkout --quiet {}'.format(commit))
+
+        if use_release_virtualenv():
+            virtualenv.create(os.path.join(path, 'env'))
+
+    if use_release_virtualenv():
+        install_requirements(env_path=os.path.join(path, 'env'),
+                             repository_path=checkout_path)
+
+    return True
+
+
+def switch(commit):
+    """
+    Atomically point current symlink to release of commit.
+    """
+    from .project import current_path, project_home, sudo_project
+
+    current = current_path()
+    tmp_path = '{}.tmp'.format(current)
+    target = os.path.relpath(release_path(commit), project_home())
+
+    info('Switching current release to {}', commit)
+    with sudo_project():
+        # Rename over the old link, instead of ln -sf unlink and create
+        run('ln -sfn {} {} && mv -T {} {}'.format(target, tmp_path, tmp_path, current))
+
+
+def prune(current=None):
+    """
+    Remove old releases, keeping the newest and current one.
+    """
+    from .project import sudo_project
+
+    old = [commit for commit in list_releases()[keep():] if commit != current]
+    if old:
+        info('Removing old releases {}', ', '.join(old))
+        with sudo_project():
+            debian.rm(' '.join(release_path(commit) for commit in old), recursive=True)
+
+
+def release(commit, force=False):
+    """
+    Create release for commit, make it current and remove old releases.
+
+    :param commit: Commit checked out in source checkout
+    :param force: Switch even if commit already is current
+    :return: True, if current release changed
+    """
+    if not force and get_current() == commit:
+        info('Release {} already current', commit)
+        return False
+
+    create(commit)
+    switch(commit)
+    prune(current=commit)
+
+    return True
+
+
+def rollback(commit=None):
+    """
+    Make previous, or given, release current.
+
+    :param commit: Release to roll back to (Default: the one before current)
+    :return: commit of release made current
+    """
+    releases = list_releases()
+    current = get_current()
+
+    if commit is None:
+        older = releases[releases.index(current) + 1:] if current in releases else []
+        if not older:
+            abort('No release to roll back to from {}'.format(current))
+        commit = older[0]
+    else:
+        matches = [name for name in releases if name.startswith(commit)]
+        if not matches:
+            abort('No release {} to roll back to, available: {}'.format(
+                commit, ', '.join(releases)))
+        commit = matches[0]
+
+    switch(commit)
+    return commit
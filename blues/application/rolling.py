@@ -0,0 +1,126 @@
+"""
+Rolling, health gated reload of application providers.
+
+Hosts are reloaded in batches and every web provider in a batch has to
+answer its health url before the next batch is touched.
+"""
+import math
+import os
+
+from fabric.state import env
+
+from refabric.api import run, info
+from refabric.context_managers import silent
+from refabric.contrib import blueprints
+
+__all__ = ['batch_size', 'split_batches', 'wait_for_socket']
+
+
+blueprint = blueprints.get('blues.app')
+
+DEFAULT_HEALTH_TIMEOUT = 60
+
+# Remote probe answering exit code 0 once socket serves url with status < 400,
+# speaks plain HTTP or the uwsgi protocol over a tcp or unix socket.
+HEALTH_CHECK_SCRIPT = """
+import socket, struct, sys, time
+
+address, protocol, path, host, timeout = sys.argv[1:6]
+deadline = time.time() + float(timeout)
+
+
+def request():
+    if address.startswith('/'):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(5)
+        s.connect(address)
+    else:
+        ip, port = address.rsplit(':', 1)
+        s = socket.create_connection((ip or '127.0.0.1', int(port)), 5)
+
+    if protocol == 'uwsgi':
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'REQUEST_URI': path,
+               'QUERY_STRING': '', 'SERVER_NAME': host, 'SERVER_PORT': '80',
+               'HTTP_HOST': host, 'SERVER_PROTOCOL': 'HTTP/1.1'}
+        body = b''
+        for key, value in env.items():
+            key, value = key.encode('latin-1'), value.encode('latin-1')
+            body += struct.pack('<H', len(key)) + key + struct.pack('<H', len(value)) + value
+        s.sendall(struct.pack('<BHB', 0, len(body), 0) + body)
+    else:
+        s.sendall(('GET %s HTTP/1.0\\r\\nHost: %s\\r\\n\\r\\n' % (path, host)).encode('latin-1'))
+
+    status = s.recv(128).split(b'\\r\\n')[0].split()
+    s.close()
+    return int(status[1])
+
+
+while True:
+    try:
+        status = request()
+        if status < 400:
+            print('healthy %s' % status)
+            sys.exit(0)
+        print('unhealthy %s' % status)
+    except (socket.error, IndexError, ValueError) as e:
+        print('unavailable %s' % e)
+    if time.time() > deadline:
+        sys.exit(1)
+    time.sleep(1)
+"""
+
+
+def batch_size(batch, host_count):
+    """
+    Resolve batch setting to number of hosts per batch.
+
+    :param batch: Number of hosts, or percentage of hosts, e.g. "25%"
+    :param host_count: Total number of hosts
+    :return: int, at least 1
+    """
+    batch = str(batch).strip()
+    if batch.endswith('%'):
+        size = int(math.ceil(host_count * float(batch[:-1]) / 100.0))
+    else:
+        size = int(batch)
+
+    return max(1, min(size, host_count))
+
+
+def split_batches(hosts, size):
+    """
+    Split hosts into batches of given size.
+    """
+    return [hosts[i:i + size] for i in range(0, len(hosts), size)]
+
+
+def wait_for_socket(socket, protocol='http', url=None, timeout=None):
+    """
+    Wait for web socket on current host to answer health url.
+
+    :param socket: host:port, unix:/path or /path to socket
+    :param protocol: http or uwsgi
+    :param url: Health url path (Default: app web.health_url setting or /)
+    :param timeout: Seconds to wait (Default: app web.health_timeout setting or 60)
+    :return: bool, healthy?
+    """
+    url = url or blueprint.get('web.health_url', '/')
+    timeout = timeout or blueprint.get('web.health_timeout', DEFAULT_HEALTH_TIMEOUT)
+    host = blueprint.get('web.domain', 'localhost')
+    if host == '_':
+        host = 'localhost'
+
+    if socket.startswith('unix:'):
+        socket = socket[len('unix:'):]
+    if not socket.startswith('/') and socket.startswith('0.0.0.0:'):
+        socket = '127.0.0.1:' + socket.partition(':')[2]
+
+    info('Waiting for {} to answer {} (timeout {}s)', os.path.basename(socket), url, timeout)
+    with silent():
+        output = run("python - '{}' '{}' '{}' '{}' '{}' <<'EOF'{}EOF".format(
+            socket, protocol, url, host, timeout, HEALTH_CHECK_SCRIPT), pty=False)
+
+    lines = output.stdout.splitlines()
+    info('...{} on {}', lines[-1] if lines else 'no answer', env.host_string)
+
+    return output.return_code == 0
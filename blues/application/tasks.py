@@ -3,7 +3,7 @@
 import os
 
 from fabric.context_managers import settings
-from fabric.decorators import task
+from fabric.decorators import task, runs_once
 from fabric.state import env
 from fabric.utils import indent, abort
 from blues.application.deploy import maybe_install_requirements
@@ -13,7 +13,11 @@ from refabric.contrib import blueprints
 
 
 from .. import git
+from .. import rendering
 from .. import slack
+from .. import state
+from . import releases
+from . import virtualenvs
 
 blueprint = blueprints.get('blues.app')
 
@@ -32,13 +36,20 @@ def setup():
     """
     from .deploy import install_project, install_virtualenv, \
         install_requirements, install_providers
-    from .project import requirements_txt, use_virtualenv
+    from .project import requirements_txt, use_virtualenv, use_releases, \
+        use_release_virtualenv, git_repository_path
 
     install_project()
 
     if use_virtualenv():
         install_virtualenv()
-        install_requirements(requirements_txt())
+        if virtualenvs.is_enabled():
+            virtualenvs.ensure(git_repository_path())
+        elif not use_release_virtualenv():
+            install_requirements(requirements_txt())
+
+    if use_releases():
+        releases.release(_current_commit(), force=True)
 
     install_providers()
     configure_providers()
@@ -56,7 +67,8 @@ def configure():
     Deploy and configure providers
     """
     code_changed = deploy(auto_reload=False)
-    configure_providers(force_reload=code_changed)
+    providers = configure_providers(force_reload=code_changed)
+    return code_changed, providers
 
 
 @task
@@ -69,7 +81,8 @@ def deploy(auto_reload=True, force=False, update_pip=False):
     :return bool: Source code has changed?
     """
     from .deploy import update_source
-    from .project import use_virtualenv
+    from .project import use_virtualenv, use_releases, use_release_virtualenv, \
+        git_repository_path
 
     # Reset git repo
     previous_commit, current_commit = update_source()
@@ -77,11 +90,18 @@ def deploy(auto_reload=True, force=False, update_pip=False):
                    previous_commit != current_commit
 
     if code_changed or force:
-        # Install python dependencies
-        if use_virtualenv():
+        # Install python dependencies, release virtualenvs get theirs on create
+        if virtualenvs.is_enabled():
+            virtualenvs.ensure(git_repository_path())
+        elif use_virtualenv() and not use_release_virtualenv():
             maybe_install_requirements(previous_commit, current_commit, force,
                                        update_pip=update_pip)
 
+    if use_releases() and current_commit:
+        # Also switches back to the source commit after a rollback
+        code_changed = releases.release(current_commit, force=force) or code_changed
+
+    if code_changed or force:
         # Reload providers
         if auto_reload:
             reload()
@@ -89,6 +109,28 @@ def deploy(auto_reload=True, force=False, update_pip=False):
     return (previous_commit, current_commit) if code_changed else False
 
 
+@task
+def rollback(commit=None):
+    """
+    Switch back to previous, or given, release and reload providers
+
+    :param str commit: Release to roll back to (Default: the release before current)
+    :return str: Commit of current release
+    """
+    from .project import use_releases
+
+    if not use_releases():
+        abort('Rollback requires releases, enable the app.releases setting')
+
+    commit = releases.rollback(commit)
+    if virtualenvs.is_enabled():
+        # Relinks the virtualenv of the release, if still kept
+        virtualenvs.ensure(releases.source_path(commit))
+    reload()
+
+    return commit
+
+
 @task
 def install_requirements():
     from .deploy import install_requirements
@@ -149,10 +191,84 @@ def reload():
     """
     Reload all application providers on current host
     """
-    providers = get_providers(env.host_string)
+    reload_providers(get_providers(env.host_string))
+
+
+def reload_providers(providers, timeout=None):
+    """
+    Reload providers and, when a health url is configured, wait for the web
+    workers to be replaced before gating on the health url.
+
+    Probing right after a reload could be answered by the old workers.
+
+    :param providers: Application providers for current host
+    :param timeout: Seconds to wait
+    """
+    gated = 'web' in providers and blueprint.get('web.health_url')
+    workers = providers['web'].get_workers() if gated else None
+
     for provider in set(providers.values()):
         provider.reload()
 
+    if gated and not providers['web'].wait_until_reloaded(workers, timeout=timeout):
+        abort('Web provider on {} did not reload, stopping reload'.format(env.host_string))
+
+    wait_until_healthy(providers, timeout=timeout)
+
+
+def wait_until_healthy(providers, timeout=None):
+    """
+    Gate on the web provider answering its health url, when configured.
+
+    Aborts if not healthy in time, stopping a serial or rolling reload
+    before it reaches the next host.
+
+    :param providers: Application providers for current host
+    :param timeout: Seconds to wait
+    """
+    if 'web' not in providers or not blueprint.get('web.health_url'):
+        return
+
+    if not providers['web'].wait_until_healthy(timeout=timeout):
+        abort('Web provider on {} did not become healthy, '
+              'stopping reload'.format(env.host_string))
+
+
+@task
+@runs_once
+def rolling_reload(batch=None, timeout=None):
+    """
+    Reload providers batch by batch, gated on web health url
+
+    :param batch: Hosts per batch, number or percentage (Default: app.rolling.batch or 1)
+    :param timeout: Seconds to wait for each batch to answer (Default: web.health_timeout or 60)
+    """
+    from . import parallel as parallel_execution
+    from .rolling import batch_size, split_batches
+
+    hosts = list(env.all_hosts or [env.host_string])
+    batch = batch or blueprint.get('rolling.batch', 1)
+    batches = split_batches(hosts, batch_size(batch, len(hosts)))
+
+    def reload_and_wait():
+        reload_providers(get_providers(env.host_string), timeout=timeout)
+        return {}
+
+    done = []
+    for i, hosts_batch in enumerate(batches, start=1):
+        info('Rolling reload batch {}/{}: {}', i, len(batches), ', '.join(hosts_batch))
+        results = parallel_execution.execute(reload_and_wait, hosts=hosts_batch,
+                                             pool_size=len(hosts_batch))
+        failed, _ = parallel_execution.report(results)
+        if failed:
+            remaining = [host for host in hosts if host not in done + hosts_batch]
+            abort('Rolling reload stopped at batch {}/{}, failed: {}, '
+                  'untouched: {}'.format(i, len(batches), ', '.join(failed),
+                                         ', '.join(remaining) or '-'))
+        done.extend(hosts_batch)
+
+    info('Rolling reload done on {} host(s)', len(done))
+
 
 @task
 def configure_providers(force_reload=False):
@@ -166,18 +282,125 @@ def configure_providers(force_reload=False):
 
     with sudo_project():
         providers = get_providers(env.host_string)
-        if 'web' in providers:
-            providers['web'].configure_web()
-        if 'worker' in providers:
-            providers['worker'].configure_worker()
 
+        checksum = None
+        if state.is_enabled():
+            checksum = providers_checksum(providers)
+
+        if not state.unchanged('providers', checksum):
+            if 'web' in providers:
+                providers['web'].configure_web()
+            if 'worker' in providers:
+                providers['worker'].configure_worker()
+
+    reloaded = False
     for provider in set(providers.values()):
         if provider.updates or force_reload:
             provider.reload()
+            reloaded = True
+
+    if reloaded:
+        wait_until_healthy(providers)
+
+    if checksum != state.get('providers', 'checksum'):
+        state.update('providers', checksum=checksum)
 
     return providers
 
 
+def providers_checksum(providers):
+    """
+    Hash everything provider configs are rendered from; provider contexts,
+    web and worker settings and provider templates.
+    """
+    from blues import nginx, supervisor, uwsgi
+
+    contexts = dict((role, (provider.__class__.__name__, provider.get_context()))
+                    for role, provider in providers.items())
+    templates = state.directory_checksum(
+        blueprint.get_user_template_path(),
+        blueprint.get_default_template_root(),
+        uwsgi.blueprint.get_default_template_root(),
+        nginx.blueprint.get_default_template_root(),
+        supervisor.blueprint.get_default_template_root())
+
+    return state.checksum(contexts, blueprint.get('web'), blueprint.get('worker'),
+                          templates)
+
+
+@task
+@runs_once
+def parallel(command='deploy', pool_size=None):
+    """
+    Run deploy, configure, reload or deployed on all hosts in parallel
+
+    :param str command: App task to run (deploy|configure|reload|deployed)
+    :param int pool_size: Max number of hosts at a time (Default: app.parallel.pool_size or 10)
+    :return dict: Summary per host
+    """
+    from . import parallel as parallel_execution
+
+    summarizers = {
+        'deploy': _summarize_deploy,
+        'configure': _summarize_configure,
+        'reload': _summarize_reload,
+        'deployed': _summarize_deployed,
+    }
+    if command not in summarizers:
+        abort('Can not run {} in parallel, choose one of: {}'.format(
+            command, ', '.join(sorted(summarizers))))
+
+    results = parallel_execution.execute(summarizers[command],
+                                         pool_size=pool_size)
+
+    info('Parallel {} summary:', command)
+    key = None if command == 'reload' else 'commit'
+    failed, diverged = parallel_execution.report(results, key=key)
+
+    if failed:
+        abort('Parallel {} failed on: {}'.format(command, ', '.join(failed)))
+
+    return dict((host, r['result']) for host, r in results.items())
+
+
+def _current_commit():
+    from .project import sudo_project, git_repository_path
+
+    with sudo_project():
+        return git.get_commit(git_repository_path(), short=True)
+
+
+def _summarize_deploy():
+    commits = deploy()
+    return {
+        'commit': _current_commit(),
+        'changed': '{}..{}'.format(*commits) if commits else None,
+    }
+
+
+def _summarize_configure():
+    commits, providers = configure()
+    return {
+        'commit': _current_commit(),
+        'changed': '{}..{}'.format(*commits) if commits else None,
+        'updated': sorted(name for name, provider in providers.items()
+                          if provider.updates),
+    }
+
+
+def _summarize_reload():
+    reload()
+    return {}
+
+
+def _summarize_deployed():
+    head_commit, origin_commit = deployed()
+    return {
+        'commit': head_commit[:7],
+        'pending': origin_commit[:7] if origin_commit != head_commit else None,
+    }
+
+
 @task
 def generate_nginx_conf(role='www'):
     """
@@ -218,7 +441,7 @@ def generate_nginx_conf(role='www'):
         template = 'nginx/uwsgi_site.conf'
 
     with settings(template_dirs=['templates']):
-        conf = blueprint.render_template(template, context)
+        conf = rendering.render(blueprint, template, context)
         conf_dir = os.path.join(
             os.path.dirname(env['real_fabfile']),
             'templates',
@@ -0,0 +1,223 @@
+"""
+uWSGI worker and memory tuning.
+
+Samples the running web vassal's stats socket twice, a few seconds apart, for
+per worker RSS, address space, average response time and requests served. The
+samples are kept in a local history per host and vassal, so recommendations are
+made from every deploy sampled so far, not only from the current one.
+
+Memory limits are set from the 95th percentile of worker RSS and address space,
+with headroom. Workers are sized by Little's law, busy workers = request rate *
+response time, for the busiest sample to run at the target utilization, and are
+capped by how many workers at the RSS limit fit in the host's memory budget.
+"""
+import json
+import math
+import os
+import re
+import time
+
+from fabric.state import env
+
+from refabric.utils import info
+from refabric.contrib import blueprints
+
+from .. import uwsgi
+
+__all__ = ['tune', 'recommend', 'summarize']
+
+
+blueprint = blueprints.get('blues.app')
+
+DEFAULT_BUDGET = '75%'
+DEFAULT_CACHE_PATH = '~/.cache/blues/tuning'
+DEFAULT_HISTORY = 20
+DEFAULT_INTERVAL = 5
+DEFAULT_HEADROOM = 1.5
+DEFAULT_UTILIZATION = 0.5
+
+MB = 1024 * 1024
+
+# Recommendations per host and vassal, contexts are built more than once per run
+_tuned = {}
+
+
+def is_enabled():
+    return bool(blueprint.get('web.tuning.enabled', False))
+
+
+def memory_budget(total_mb):
+    """
+    Get memory budget for web workers in MB.
+
+    :param total_mb: Host memory in MB
+    :return: budget setting, in MB or percent of host memory
+    """
+    budget = str(blueprint.get('web.tuning.budget', DEFAULT_BUDGET)).strip()
+    if budget.endswith('%'):
+        return total_mb * float(budget[:-1]) / 100
+    return float(budget)
+
+
+def history_file(host, vassal_name):
+    cache_path = os.path.expanduser(blueprint.get('web.tuning.cache_path', DEFAULT_CACHE_PATH))
+    filename = re.sub(r'[^\w.@-]', '_', '{}-{}'.format(host, vassal_name))
+    return os.path.join(cache_path, '{}.json'.format(filename))
+
+
+def read_history(host, vassal_name):
+    try:
+        with open(history_file(host, vassal_name)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return []
+
+
+def write_history(host, vassal_name, history):
+    path = history_file(host, vassal_name)
+    cache_dir = os.path.dirname(path)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    size = max(int(blueprint.get('web.tuning.history', DEFAULT_HISTORY)), 1)
+    with open(path, 'w') as f:
+        json.dump(history[-size:], f)
+
+
+def percentile(values, percent):
+    """
+    Get nearest rank percentile of values.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(first, second, seconds):
+    """
+    Summarize two stats socket reads of a vassal.
+
+    :param first: Stats read first
+    :param second: Stats read seconds later
+    :param seconds: Seconds between reads
+    :return: sample dict
+    """
+    summary = uwsgi.summarize_stats(first, second, seconds)
+
+    sample = {
+        'time': int(time.time()),
+        'workers': summary['workers'],
+        'rss': [round(float(rss) / MB, 1) for _, rss in sorted(summary['rss'].items())],
+        'vsz': [round(float(vsz) / MB, 1) for _, vsz in sorted(summary['vsz'].items())],
+        'listen_queue': summary['listen_queue'],
+        'avg_rt': summary['avg_rt'],
+        'rate': summary['requests_per_second'],
+        'busy': None,
+    }
+
+    if sample['rate'] is not None and sample['avg_rt'] is not None:
+        sample['busy'] = round(sample['rate'] * sample['avg_rt'] / 1000.0, 2)
+
+    return sample
+
+
+def recommend(history, cores, budget_mb, headroom=DEFAULT_HEADROOM,
+              utilization=DEFAULT_UTILIZATION):
+    """
+    Recommend workers and memory limits from sample history.
+
+    :param history: Samples, see `summarize`
+    :param cores: Host cores
+    :param budget_mb: Memory for web workers in MB
+    :return: dict of web.ini context, empty if no worker memory was sampled
+    """
+    rss = [value for sample in history for value in sample.get('rss', [])]
+    if not rss:
+        return {}
+
+    reload_on_rss = int(math.ceil(percentile(rss, 95) * headroom))
+    vsz = [value for sample in history for value in sample.get('vsz', [])]
+    reload_on_as = int(math.ceil(percentile(vsz, 95) * headroom)) if vsz else reload_on_rss * 2
+
+    # Queued requests are demand not seen in response times
+    demand = [sample['busy'] + sample.get('listen_queue', 0)
+              for sample in history if sample.get('busy') is not None]
+    if demand:
+        workers = max(cores, int(math.ceil(max(demand) / utilization)))
+        workers = min(workers, cores * 4)
+    else:
+        workers = uwsgi.get_worker_count(cores)
+
+    # Never more workers than fit the budget at their rss limit
+    workers = max(min(workers, int(budget_mb // reload_on_rss)), 1)
+
+    return {
+        'workers': workers,
+        'reload_on_rss': reload_on_rss,
+        'reload_on_as': reload_on_as,
+        'limit_as': reload_on_as * 2,
+    }
+
+
+def sample(vassal_name, seconds=None):
+    """
+    Sample stats socket of running vassal on current host.
+
+    :return: sample dict or None if vassal is not running
+    """
+    if seconds is None:
+        seconds = float(blueprint.get('web.tuning.sample_interval', DEFAULT_INTERVAL))
+
+    first = uwsgi.read_stats(vassal_name).get(vassal_name)
+    if first is None:
+        return None
+
+    time.sleep(seconds)
+    second = uwsgi.read_stats(vassal_name).get(vassal_name)
+    if second is None:
+        return None
+
+    return summarize(first, second, seconds)
+
+
+def tune(vassal_name, cores, total_mb):
+    """
+    Sample running vassal, add sample to history and recommend web.ini context.
+
+    Samples once per host and vassal, later calls return the same context.
+
+    :param vassal_name: Web vassal, i.e. ini name without extension
+    :param cores: Host cores
+    :param total_mb: Host memory in MB
+    :return: dict of web.ini context, empty if nothing was sampled yet
+    """
+    host = env.host_string
+    key = (host, vassal_name)
+    if key not in _tuned:
+        _tuned[key] = _tune(host, vassal_name, cores, total_mb)
+
+    return dict(_tuned[key])
+
+
+def _tune(host, vassal_name, cores, total_mb):
+    history = read_history(host, vassal_name)
+
+    current = sample(vassal_name)
+    if current is not None:
+        history.append(current)
+        write_history(host, vassal_name, history)
+    else:
+        info('Vassal {} not running, tuning from {} earlier sample(s)', vassal_name, len(history))
+
+    budget_mb = memory_budget(total_mb)
+    context = recommend(history, cores, budget_mb,
+                        headroom=float(blueprint.get('web.tuning.headroom', DEFAULT_HEADROOM)),
+                        utilization=float(blueprint.get('web.tuning.utilization',
+                                                        DEFAULT_UTILIZATION)))
+    if context:
+        info('Tuned to {} worker(s), {} MB rss limit, from {} sample(s) within {} MB budget',
+             context['workers'], context['reload_on_rss'], len(history), int(budget_mb))
+
+    return context
@@ -0,0 +1,176 @@
+"""
+Content-addressed virtualenvs.
+
+Virtualenvs are built in envs/<key>, keyed by a hash of the requirement files,
+with includes, and the requested python version. The project virtualenv path,
+`env`, is a symlink switched atomically to the virtualenv matching the checked
+out requirements.
+
+A deploy with an already built key only relinks, e.g. when switching branches
+back and forth or rolling back. A new key is built in an empty virtualenv, so
+virtualenvs of the same key never differ by packages left from another commit;
+enable the wheelhouse to make that cheap. Virtualenvs no longer linked are
+removed, keeping the newest ones.
+"""
+import os
+import time
+
+from fabric.contrib import files
+
+from refabric.context_managers import silent
+from refabric.operations import run
+from refabric.utils import info
+from refabric.contrib import blueprints
+
+from .. import debian
+from .. import util
+from .. import virtualenv
+
+__all__ = ['ensure', 'get_key', 'get_current', 'list_envs']
+
+
+blueprint = blueprints.get('blues.app')
+
+DEFAULT_KEEP = 3
+
+
+def is_enabled():
+    from .project import use_virtualenv, use_release_virtualenv
+    return bool(blueprint.get('virtualenvs.content_addressed', False)) and \
+        use_virtualenv() and not use_release_virtualenv()
+
+
+def keep():
+    return max(int(blueprint.get('virtualenvs.keep', DEFAULT_KEEP)), 1)
+
+
+def envs_path(*parts):
+    from .project import project_home
+    return os.path.join(project_home(), 'envs', *parts)
+
+
+def get_key(repository_path):
+    """
+    Hash requirement files, checked out in repository, and requested python version.
+
+    :return: hex digest
+    """
+    from .project import requirements_txt
+
+    return util.requirements_key(util.read_requirements(requirements_txt(), repository_path))
+
+
+def get_current():
+    """
+    Get key of linked virtualenv.
+
+    :return: key or None if project virtualenv is not a link
+    """
+    from .project import sudo_project, virtualenv_path
+
+    with sudo_project(), silent():
+        output = run('readlink {}; true'.format(virtualenv_path()), pty=False)
+
+    target = output.strip()
+    return os.path.basename(target) if target else None
+
+
+def list_envs():
+    """
+    List virtualenv keys, newest first.
+    """
+    with silent():
+        output = run('ls -1t {} 2>/dev/null; true'.format(envs_path()), pty=False)
+
+    return output.split()
+
+
+def is_complete(key):
+    with silent():
+        return run('test -f {}'.format(envs_path(key, '.complete'))).return_code == 0
+
+
+def build(key, repository_path):
+    """
+    Build virtualenv for key from empty.
+    """
+    from .deploy import install_requirements
+    from .project import sudo_project
+
+    path = envs_path(key)
+
+    with sudo_project():
+        debian.rm(path, recursive=True)
+        debian.mkdir(envs_path())
+        virtualenv.create(path)
+
+    install_requirements(env_path=path, repository_path=repository_path)
+
+    with sudo_project():
+        run('touch {}'.format(envs_path(key, '.complete')))
+
+
+def switch(key):
+    """
+    Atomically point project virtualenv to virtualenv of key.
+    """
+    from .project import project_home, sudo_project, virtualenv_path
+
+    current = virtualenv_path()
+    tmp_path = '{}.tmp'.format(current)
+    target = os.path.relpath(envs_path(key), project_home())
+
+    info('Switching virtualenv to {}', key)
+    with sudo_project():
+        if files.exists(current) and not files.is_link(current):
+            # Move a plain virtualenv aside once, removed when pruning
+            debian.mv(current, '{}.{}'.format(current, int(time.time())))
+        # Rename over the old link, instead of ln -sf unlink and create
+        run('ln -sfn {} {} && mv -T {} {}'.format(target, tmp_path, tmp_path, current))
+        run('touch {}'.format(envs_path(key)))
+
+
+def prune(current=None):
+    """
+    Remove virtualenvs not linked, keeping the newest ones, and plain
+    virtualenvs moved aside by `switch`.
+    """
+    from .project import sudo_project, virtualenv_path
+
+    with sudo_project():
+        debian.rm('{}.[0-9]*'.format(virtualenv_path()), recursive=True)
+        old = [key for key in list_envs()[keep():] if key != current]
+        if old:
+            info('Removing old virtualenvs {}', ', '.join(old))
+            debian.rm(' '.join(envs_path(key) for key in old), recursive=True)
+
+
+def ensure(repository_path):
+    """
+    Link project virtualenv to one built for the requirements checked out in
+    repository, building it only if no virtualenv has that key yet.
+
+    :param repository_path: Checkout to read requirements from and install
+    :return: True, if project virtualenv changed
+    """
+    from .project import sudo_project
+
+    with sudo_project():
+        key = get_key(repository_path)
+
+    if get_current() == key:
+        info('Virtualenv {} already current', key)
+        return False
+
+    with sudo_project():
+        complete = is_complete(key)
+
+    if complete:
+        info('Reusing virtualenv {}', key)
+    else:
+        build(key, repository_path)
+
+    switch(key)
+    prune(current=key)
+
+    return True
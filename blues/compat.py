@@ -1,3 +1,9 @@
+"""
+Pip-backed requirements parsing, reference for the pip-free parser in
+`blues.util`, e.g. in tests and benchmarks.
+"""
+import shlex
+
 import pip
 
 
@@ -17,8 +23,20 @@ def req_file_build_parser(line=None):
         return req_file.build_parser()
 
 
+def parse_requirements(text):
+    lines_enum = req_file.preprocess(text, options=None)
+    for line_number, line in lines_enum:
+        parser = req_file_build_parser(line=line)
+        defaults = parser.get_default_values()
+        defaults.index_url = None
+        args_str, options_str = req_file.break_args_options(line)
+        opts, _ = parser.parse_args(shlex.split(options_str), defaults)
+        yield args_str, options_str, opts
+
+
 __all__ = [
     'pip_version',
     'req_file',
     'req_file_build_parser',
+    'parse_requirements',
 ]
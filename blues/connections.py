@@ -0,0 +1,322 @@
+"""
+Connection Multiplexing
+=======================
+
+Fabric keeps one ssh transport per host, but opens a new channel, and a new
+(sudo) login shell, for every command. When multiplexing is enabled, commands
+are instead written to long lived shell channels, one per host and sudo user,
+that are opened once and reused for the rest of the run.
+
+Commands that can not be multiplexed, e.g. sudo with password or group, fall
+back to a regular fabric channel. A command that times out, or loses its shell,
+once sent is never run again, it fails like fabric's would.
+
+Enable for a whole run by prefixing the tasks, e.g.
+``fab connections.multiplex app.deploy connections.stats``.
+
+**Fabric environment:**
+
+.. code-block:: yaml
+
+    settings:
+      connections:
+        # preopen:       # Sudo users to open shells for on first contact with a host (Default: root and app user)
+        #   - root
+        #   - foobar
+
+"""
+import inspect
+import os
+import re
+import socket
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+import fabric.operations
+from fabric.decorators import task
+from fabric.exceptions import CommandTimeout
+from fabric.state import connections, env, output
+from fabric.utils import error, warn
+
+from refabric.api import info
+from refabric.context_managers import hide_prefix
+from refabric.contrib import blueprints
+
+from . import tracing
+
+__all__ = ['multiplex', 'stats']
+
+
+blueprint = blueprints.get(__name__)
+
+RECV_SIZE = 32768
+
+_run_command = fabric.operations._run_command
+_shells = {}
+_stats = defaultdict(lambda: defaultdict(int))
+
+
+class ShellUnavailable(Exception):
+    pass
+
+
+class PersistentShell(object):
+    """
+    Long lived (sudo) bash on its own channel, running one command at a time.
+    """
+
+    def __init__(self, host_string, user=None):
+        self.host_string = host_string
+        self.user = user
+        self.marker = '__blues_mux_{}__'.format(uuid.uuid4().hex)
+        self.channel = None
+        self.unavailable = False
+
+    def open(self):
+        transport = connections[self.host_string].get_transport()
+        self.channel = transport.open_session()
+        self.channel.set_combine_stderr(True)
+
+        shell = '/bin/bash -l'
+        if self.user is not None:
+            # Never prompt, fall back to fabric sudo if a password is needed,
+            # and set $HOME to the sudo user's, like fabric sudo does
+            shell = 'sudo -n -H -u {} {}'.format(self.user, shell)
+        self.channel.exec_command(shell)
+
+        _, status = self.execute('true')
+        if status != 0:
+            self.close()
+            self.unavailable = True
+            raise ShellUnavailable('Could not open {} shell on {}'.format(
+                self.user or 'login', self.host_string))
+
+    @property
+    def active(self):
+        return self.channel is not None and not self.channel.closed
+
+    def execute(self, command, timeout=None):
+        """
+        Run command in a subshell, isolating cwd, env and stdin.
+
+        :return: (output, return code)
+        """
+        self.channel.settimeout(timeout)
+        script = "( {}\n) < /dev/null 2>&1\nprintf '\\n{} %s\\n' \"$?\"\n".format(
+            command, self.marker)
+        if isinstance(script, unicode):
+            script = script.encode('utf-8')
+        self.channel.sendall(script)
+
+        pattern = re.compile(r'\n{} (\d+)\r?\n'.format(self.marker))
+        buffer = ''
+        while True:
+            try:
+                data = self.channel.recv(RECV_SIZE)
+            except socket.timeout:
+                # Shell is left mid command, later markers would be out of sync
+                self.close()
+                raise CommandTimeout(timeout=timeout)
+            if not data:
+                self.close()
+                raise ShellUnavailable('Shell on {} closed'.format(self.host_string))
+            buffer += data.decode('utf-8', 'replace')
+            match = pattern.search(buffer)
+            if match:
+                return buffer[:match.start()], int(match.group(1))
+
+    def close(self):
+        if self.channel is not None:
+            self.channel.close()
+            self.channel = None
+
+
+def get_shell(user=None):
+    """
+    Get open shell for current host and sudo user, opening it if needed.
+    """
+    host = env.host_string
+    key = (os.getpid(), host, user)  # Forked parallel workers need own channels
+
+    shell = _shells.get(key)
+    if shell is not None:
+        if shell.unavailable:
+            raise ShellUnavailable()
+        if shell.active:
+            _stats[host]['reused'] += 1
+            return shell
+
+    if not any(k[:2] == key[:2] for k in _shells):
+        preopen(exclude=user)
+
+    shell = PersistentShell(host, user=user)
+    _shells[key] = shell
+    open_shell(shell)
+
+    return shell
+
+
+def drop_shell(shell):
+    """
+    Close and forget shell, a new one is opened for the next command.
+    """
+    shell.close()
+    for key, value in _shells.items():
+        if value is shell:
+            del _shells[key]
+
+
+def preopen(exclude=None):
+    """
+    Open shells for configured sudo users on current host.
+    """
+    from .application.project import user_name
+
+    users = blueprint.get('preopen')
+    if users is None:
+        users = ['root']
+        if blueprints.get('blues.app').get('project'):
+            users.append(user_name())
+
+    for user in users:
+        if user == exclude:
+            continue
+        key = (os.getpid(), env.host_string, user)
+        shell = _shells[key] = PersistentShell(env.host_string, user=user)
+        try:
+            open_shell(shell)
+        except ShellUnavailable:
+            pass
+
+
+def open_shell(shell):
+    try:
+        shell.open()
+    except Exception as e:
+        shell.close()
+        shell.unavailable = True
+        _stats[shell.host_string]['unavailable'] += 1
+        raise ShellUnavailable(str(e))
+
+    _stats[shell.host_string]['opened'] += 1
+
+
+def multiplexed_run_command(*args, **kwargs):
+    """
+    Replacement for fabric's _run_command, running in persistent shells.
+    """
+    call = inspect.getcallargs(_run_command, *args, **kwargs)
+
+    if call['group'] or call.get('stdout') or call.get('stderr'):
+        _stats[env.host_string]['fallback'] += 1
+        return _run_command(*args, **kwargs)
+
+    user = None
+    if call['sudo']:
+        user = call['user'] or env.get('sudo_user') or 'root'
+
+    try:
+        shell = get_shell(user)
+    except ShellUnavailable:
+        _stats[env.host_string]['fallback'] += 1
+        return _run_command(*args, **kwargs)
+
+    given_command = call['command']
+    command = fabric.operations._prefix_env_vars(
+        fabric.operations._prefix_commands(given_command, 'remote'))
+
+    which = 'sudo' if call['sudo'] else 'run'
+    if (output.running or output.debug) and not call['quiet']:
+        print('[{}] {}: {}'.format(env.host_string, which, given_command))
+
+    warn_only = call['warn_only'] or call['quiet']
+    try:
+        result, status = shell.execute(command, timeout=call.get('timeout'))
+    except (CommandTimeout, ShellUnavailable) as e:
+        interrupted(shell, e, which, given_command, warn_only)
+        result, status, warn_only = '', -1, True
+
+    _stats[env.host_string]['commands'] += 1
+    result = result.replace('\r\n', '\n').strip('\n')
+
+    if output.stdout and result and not call['quiet']:
+        for line in result.split('\n'):
+            print('[{}] out: {}'.format(env.host_string, line))
+
+    out = fabric.operations._AttributeString(result)
+    out.command = given_command
+    out.real_command = command
+    out.failed = status not in env.get('ok_ret_codes', [0])
+    out.return_code = status
+    out.succeeded = not out.failed
+    out.stderr = fabric.operations._AttributeString('')
+
+    if out.failed and not warn_only:
+        msg = '{}() received nonzero return code {} while executing'.format(which, status)
+        if env.warn_only:
+            msg += " '{}'!".format(given_command)
+        else:
+            msg += '!\n\nRequested: {}\nExecuted: {}'.format(given_command, command)
+        error(message=msg, stdout=out, stderr=out.stderr)
+
+    return out
+
+
+def interrupted(shell, e, which, command, warn_only=False):
+    """
+    Fail command interrupted in shell. It was sent and may have run, so it is
+    never run again on another channel.
+    """
+    drop_shell(shell)
+    if isinstance(e, CommandTimeout) and not (warn_only or env.warn_only):
+        raise e
+    if warn_only or isinstance(e, CommandTimeout):
+        warn('{}() failed: {} ({})'.format(which, e, command))
+    else:
+        error(message='{}() failed: {}\n\nRequested: {}'.format(which, e, command))
+
+
+def enable():
+    tracing.install_run_command(multiplexed_run_command)
+
+
+def disable():
+    tracing.install_run_command(_run_command)
+    for shell in _shells.values():
+        shell.close()
+    _shells.clear()
+
+
+@contextmanager
+def multiplexed():
+    """
+    Run commands through persistent shells within context.
+    """
+    enabled = tracing.get_run_command() is multiplexed_run_command
+    enable()
+    try:
+        yield
+    finally:
+        if not enabled:
+            disable()
+
+
+@task
+def multiplex():
+    """
+    Run all following commands through persistent per host shells
+    """
+    enable()
+
+
+@task
+def stats():
+    """
+    Show multiplexed shell and command statistics per host
+    """
+    with hide_prefix():
+        for host, counts in sorted(_stats.items()):
+            info('{}: {} command(s), {} shell(s) opened, {} reused, {} fallback(s)',
+                 host, counts['commands'], counts['opened'], counts['reused'],
+                 counts['fallback'])
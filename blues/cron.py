@@ -24,6 +24,7 @@ from refabric.utils import info
 
 from blues.application.providers.base import get_project_info
 from blues import debian
+from blues import uploads
 
 __all__ = ['configure']
 
@@ -38,8 +39,8 @@ def configure():
     """
     with sudo(), silent():
         with debian.temporary_dir(mode=555) as temp_dir:
-            updates = blueprint.upload('./', temp_dir,
-                                       context=get_project_info())
+            updates = uploads.upload(blueprint, './', temp_dir,
+                                     context=get_project_info())
             for update in updates:
                 user = os.path.basename(update)
                 info('Installing new crontab for {}...', user)
@@ -16,16 +16,195 @@ import fabric.contrib.project
 import fabric.context_managers
 from fabric.colors import magenta
 from fabric.decorators import task
+from fabric.state import env
 from fabric.utils import abort, puts, indent, warn
 
 from refabric.context_managers import silent, sudo
 from refabric.operations import run
 from refabric.utils import info
 
+from . import facts
+
+
+# Fabric env keys affecting how a queued command is run
+QUEUE_CONTEXT_KEYS = ('use_sudo', 'sudo_user', 'cwd', 'command_prefixes')
+QUEUE_MARKER = '__blues_queued__'
+
+_queue = None
+
+
+class QueuedCommand(object):
+    """
+    A command waiting in a CommandQueue, with its result once flushed.
+    """
+
+    def __init__(self, command, description=None, invalidates_facts=False):
+        self.command = command
+        self.description = description or command
+        self.invalidates_facts = invalidates_facts
+        self.context = dict((key, env.get(key)) for key in QUEUE_CONTEXT_KEYS)
+        self.return_code = None
+        self.output = ''
+
+    @property
+    def done(self):
+        return self.return_code is not None
+
+    @property
+    def succeeded(self):
+        return self.return_code == 0
+
+    @property
+    def failed(self):
+        return self.done and self.return_code != 0
+
+    def __repr__(self):
+        return '<QueuedCommand: {}>'.format(self.description)
+
+
+class CommandQueue(object):
+    """
+    Queue of remote commands, flushed as generated `set -e` shell scripts.
+
+    Consecutive commands sharing sudo user, cwd and prefixes are flushed
+    as one script, i.e. one round-trip.
+    """
+
+    def __init__(self):
+        self.commands = []
+        self.flushed = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, command, description=None, invalidates_facts=False):
+        queued = QueuedCommand(command, description=description,
+                               invalidates_facts=invalidates_facts)
+        self.commands.append(queued)
+        return queued
+
+    def flush(self):
+        """
+        Run all queued commands.
+
+        :return: Flushed commands, with return codes and output
+        """
+        commands, self.commands = self.commands, []
+        groups = []
+        for command in commands:
+            if groups and groups[-1][0].context == command.context:
+                groups[-1].append(command)
+            else:
+                groups.append([command])
+
+        self.flushed.extend(commands)
+
+        try:
+            for group in groups:
+                self._run_script(group)
+                failed = [c for c in group if c.failed]
+                if failed:
+                    # Never run the rest of the queue on failure
+                    msg = 'Queued command failed: {}, return code {}:\n{}'.format(
+                        failed[0].description, failed[0].return_code, failed[0].output)
+                    if not env.warn_only:
+                        raise Exception(msg)
+                    warn(msg)
+                    break
+        finally:
+            if any(c.invalidates_facts and c.done for c in commands):
+                facts.invalidate()
+
+        return commands
+
+    def _run_script(self, commands):
+        lines = ['set -e']
+        for i, command in enumerate(commands):
+            lines.append("echo '{} {}'".format(QUEUE_MARKER, i))
+            lines.append(command.command)
+        lines.append("echo '{} done'".format(QUEUE_MARKER))
+
+        c = fabric.context_managers
+        with c.settings(warn_only=True, **commands[0].context), silent():
+            output = run('\n'.join(lines))
+
+        # Split output on markers to get per command output
+        current = None
+        outputs = {}
+        for line in output.stdout.splitlines():
+            if line.startswith(QUEUE_MARKER):
+                current = line[len(QUEUE_MARKER):].strip()
+            elif current is not None:
+                outputs.setdefault(current, []).append(line)
+
+        if output.return_code == 0:
+            failed_index = None
+        elif current in (None, 'done'):
+            failed_index = 0
+        else:
+            failed_index = int(current)
+
+        for i, command in enumerate(commands):
+            command.output = '\n'.join(outputs.get(str(i), []))
+            if failed_index is None or i < failed_index:
+                command.return_code = 0
+            elif i == failed_index:
+                command.return_code = output.return_code
+
+
+@contextmanager
+def queued():
+    """
+    Queue filesystem, user and group commands and run them as a single
+    script, in one round-trip, when leaving the context.
+
+    Reading users or groups flushes the queue first. Nested contexts share
+    the outermost queue.
+
+    :return: CommandQueue
+    """
+    global _queue
+
+    if _queue is not None:
+        yield _queue
+        return
+
+    _queue = queue = CommandQueue()
+    try:
+        yield queue
+    finally:
+        _queue = None
+
+    queue.flush()
+
+
+def flush_queue():
+    """
+    Run any queued commands now.
+    """
+    if _queue is not None:
+        _queue.flush()
+
+
+def execute(command, description=None, invalidates_facts=False):
+    """
+    Run command, or add it to the active command queue.
+
+    :return: Command output, or QueuedCommand if queued
+    """
+    if _queue is not None:
+        return _queue.add(command, description=description,
+                          invalidates_facts=invalidates_facts)
+
+    output = run(command)
+    if invalidates_facts:
+        facts.invalidate()
+    return output
+
 
 def chmod(location, mode=None, owner=None, group=None, recursive=False):
     if mode:
-        run('chmod %s %s %s' % (recursive and '-R ' or '', mode,  location))
+        execute('chmod %s %s %s' % (recursive and '-R ' or '', mode,  location))
     if owner:
         chown(location, owner=owner, group=group, recursive=recursive)
     elif group:
@@ -34,45 +213,53 @@ def chmod(location, mode=None, owner=None, group=None, recursive=False):
 
 def chown(location, owner, group=None, recursive=False):
     owner = '{}:{}'.format(owner, group if group else owner)
-    run('chown {} {} {}'.format(recursive and '-R ' or '', owner, location))
+    execute('chown {} {} {}'.format(recursive and '-R ' or '', owner, location))
 
 
 def chgrp(location, group, recursive=False):
-    run('chgrp %s %s %s' % (recursive and '-R ' or '', group, location))
+    execute('chgrp %s %s %s' % (recursive and '-R ' or '', group, location))
 
 
 def rm(location, recursive=False, force=True):
     force = '-f' if force else ''
     recursive = '-r' if recursive else ''
-    run('rm %s %s %s' % (force, recursive, location))
+    execute('rm %s %s %s' % (force, recursive, location))
 
 
 def cp(source, destination, force=True, mode=None, owner=None, group=None):
     force = force and '-f' or ''
-    run('cp %s %s %s' % (force, source, destination))
+    execute('cp %s %s %s' % (force, source, destination))
     chmod(destination, mode, owner, group)
 
 
 def mv(source, destination, force=True):
     force = force and '-f' or ''
-    run('mv %s %s %s' % (force, source, destination))
+    execute('mv %s %s %s' % (force, source, destination))
 
 
 def ln(source, destination, symbolic=True, force=True, mode=None,
        owner=None, group=None):
     force = force and '-f' or ''
     symbolic = symbolic and '-sn' or ''
-    run('ln %s %s "%s" "%s"' % (symbolic, force, source, destination))
+    execute('ln %s %s "%s" "%s"' % (symbolic, force, source, destination))
     chmod(destination, mode, owner, group)
 
 
 def mkdir(location, recursive=True, mode=None, owner=None, group=None):
     with silent(), sudo():
-        result = run('test -d "%s" || mkdir %s %s "%s"'
-                     % (location,
-                        mode and '-m %s' % mode or '',
-                        recursive and '-p' or '',
-                        location))
+        command = 'test -d "%s" || mkdir %s %s "%s"' % (
+            location,
+            mode and '-m %s' % mode or '',
+            recursive and '-p' or '',
+            location)
+
+        if _queue is not None:
+            execute(command, description='mkdir {}'.format(location))
+            if owner or group:
+                chmod(location, owner=owner, group=group)
+            return
+
+        result = run(command)
 
         if result.succeeded:
             if owner or group:
@@ -106,17 +293,17 @@ def temporary_dir(mode=None):
 
 
 def lsb_release():
-    return run('lsb_release --release --short')
+    return facts.lsb_release()
 lbs_release = lsb_release  # Backwards compatibility
 
 
 def lsb_codename():
-    return run('lsb_release --codename --short')
+    return facts.lsb_codename()
 lbs_codename = lsb_codename  # Backwards compatibility
 
 
 def hostname():
-    return run('hostname -A').stdout.strip()
+    return facts.hostname()
 
 
 def apt_get(command, *options):
@@ -179,6 +366,8 @@ def command_exists(*command):
 
 
 def get_user(name):
+    flush_queue()
+
     with silent():
         d = run("cat /etc/passwd | egrep '^%s:' ; true" % name, user='root')
         s = run("cat /etc/shadow | egrep '^%s:' | awk -F':' '{print $2}'"
@@ -200,6 +389,8 @@ def get_user(name):
 
 
 def get_group(name):
+    flush_queue()
+
     group_data = run("cat /etc/group | egrep '^%s:' ; true" % name)
     if group_data:
         name, _, gid, members = group_data.split(':', 4)
@@ -209,25 +400,38 @@ def get_group(name):
 
 
 def groupadd(name, gid=None, gid_min=None, gid_max=None, system=False):
+    options = []
+    if gid:
+        options.append("-g '%s'" % gid)
+    if gid_min:
+        options.append("-K GID_MIN='%s'" % gid_min)
+    if gid_max:
+        options.append("-K GID_MAX='%s'" % gid_max)
+    if system:
+        options.append('-r')
+    command = "groupadd %s '%s'" % (' '.join(options), name)
+
+    if _queue is not None:
+        # Check for existing group remotely instead of flushing the queue
+        command = "getent group '{name}' >/dev/null || {command}".format(
+            name=name, command=command)
+        if gid is not None:
+            command += " && [ \"$(getent group '{name}' | cut -d: -f3)\" = '{gid}' ]" \
+                       " || groupmod -g '{gid}' '{name}'".format(name=name, gid=gid)
+        execute(command, description='groupadd {}'.format(name),
+                invalidates_facts=True)
+        return
+
     group = get_group(name)
     if not group:
-        options = []
-        if gid:
-            options.append("-g '%s'" % gid)
-        if gid_min:
-            options.append("-K GID_MIN='%s'" % gid_min)
-        if gid_max:
-            options.append("-K GID_MAX='%s'" % gid_max)
-        if system:
-            options.append('-r')
-        run("groupadd %s '%s'" % (' '.join(options), name))
+        execute(command, invalidates_facts=True)
     else:
         if gid is not None and group.get('gid') != gid:
             groupmod(name, gid)
 
 
 def groupmod(name, gid):
-    run("groupmod -g %s '%s'" % (gid, name))
+    execute("groupmod -g %s '%s'" % (gid, name), invalidates_facts=True)
 
 
 def useradd(name, home=None, create_home=False, shell=None, uid=None, uid_min=None, uid_max=None,
@@ -296,7 +500,8 @@ def useradd(name, home=None, create_home=False, shell=None, uid=None, uid_min=No
             options.append("-p %s" % password)  # encrypted password of the new account
 
         # Create the user
-        run("useradd {options} '{username}'".format(options=' '.join(options), username=name))
+        execute("useradd {options} '{username}'".format(options=' '.join(options), username=name),
+                description='useradd {}'.format(name), invalidates_facts=True)
 
     else:
         usermod(user, password=password, home=home, uid=uid, gid=gid, groups=groups, shell=shell)
@@ -318,7 +523,8 @@ def usermod(user, password=None, home=None, uid=None, gid=None, groups=None, she
     if shell is not None and user.get('shell') != shell:
         options.append("-s '%s'" % shell)
     if options:
-        run("usermod %s '%s'" % (' '.join(options), user['name']))
+        execute("usermod %s '%s'" % (' '.join(options), user['name']),
+                description='usermod {}'.format(user['name']), invalidates_facts=True)
     if password:
         chpasswd(user['name'], password)
 
@@ -379,40 +585,28 @@ def nproc():
     """
     Get the number of CPU cores.
     """
-    c = fabric.context_managers
-    with c.settings(c.hide('running', 'stdout')):
-        res = run('nproc').strip()
-        return int(res)
+    return facts.nproc()
 
 
 def total_memory():
     """
     Get total memory in bytes
     """
-    c = fabric.context_managers
-    with c.settings(c.hide('running', 'stdout')):
-        memory = int(run("grep MemTotal /proc/meminfo | awk '{print $2}'"))
-        # Convert to bytes
-        memory *= 1024
-        return memory
+    return facts.total_memory()
 
 
 def page_size():
     """
     Get PAGE_SIZE
     """
-    c = fabric.context_managers
-    with c.settings(c.hide('running', 'stdout')):
-        return int(run('getconf PAGE_SIZE').strip())
+    return facts.page_size()
 
 
 def phys_pages():
     """
     Get _PHYS_PAGES
     """
-    c = fabric.context_managers
-    with c.settings(c.hide('running', 'stdout')):
-        return int(run('getconf _PHYS_PAGES').strip())
+    return facts.phys_pages()
 
 
 def set_timezone(timezone):
@@ -562,5 +756,4 @@ def get_ipv4_addresses():
     Returns a dict containing pairs of interface names and their respective
     ipv4 addresses.
     """
-    output = run('ip r show | grep " src " | awk -F " " \'{print $3 " " $NF}\'')
-    return dict(entry.split() for entry in output.split("\n"))
+    return facts.ipv4_addresses()
@@ -15,12 +15,17 @@ Management helper blueprint.
         # manage: ../manage.py  # Manage module relative to python path; ./src (Default: manage.py)
         # use_south: false      # Enable south migrations, only for Django < 1.7 (Default: true)
         # use_syncdb: true      # Enable syncdb, only for Django < 1.7 (Default: false)
+        # changed_only: true    # Skip migrate or collectstatic in deploy when no related files changed in deployed commit range (Default: false)
+        # migrations:           # Paths that trigger migrate, besides requirements (Default: */migrations/*)
+        #   - '*/migrations/*'
+        # static:               # Paths that trigger collectstatic, besides requirements (Default: */static/*)
+        #   - '*/static/*'
 
 """
 import re
 
 from fabric.context_managers import cd
-from fabric.decorators import task, runs_once
+from fabric.decorators import task
 from fabric.operations import prompt
 from fabric.state import env
 from fabric.utils import warn
@@ -31,7 +36,10 @@ from refabric.contrib import blueprints
 from refabric.context_managers import silent
 
 from . import virtualenv
-from .application.project import virtualenv_path, python_path, sudo_project
+from .application.deploy import get_changes
+from .application.parallel import runs_once
+from .application.project import virtualenv_path, python_path, sudo_project, \
+    requirements_txt
 
 __all__ = [
     'manage', 'deploy', 'version', 'migrate',
@@ -40,6 +48,9 @@ __all__ = [
 
 blueprint = blueprints.get(__name__)
 
+DEFAULT_MIGRATIONS = ['*/migrations/*']
+DEFAULT_STATIC = ['*/static/*']
+
 
 @task
 def manage(cmd=''):
@@ -57,11 +68,33 @@ def deploy():
     """
     Migrate database and collect static files
     """
+    changes = get_changes() if blueprint.get('changed_only', False) else None
+
     # Migrate database
-    migrate()
+    if is_changed(changes, blueprint.get('migrations', DEFAULT_MIGRATIONS)):
+        migrate()
+    else:
+        info('No migrations changed, skipping migrate')
 
     # Collect static files
-    collectstatic()
+    if is_changed(changes, blueprint.get('static', DEFAULT_STATIC)):
+        collectstatic()
+    else:
+        info('No static files changed, skipping collectstatic')
+
+
+def is_changed(changes, patterns):
+    """
+    Did any path matching patterns, or any requirements file, change?
+
+    :param changes: Index of changed files, git.ChangedFiles, or None if unknown
+    :return: bool, True if unknown
+    """
+    if changes is None:
+        return True
+
+    # Installed packages may bring their own migrations and static files
+    return changes.changed('requirements/', *(list(patterns) + requirements_txt()))
 
 
 @task
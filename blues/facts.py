@@ -0,0 +1,248 @@
+"""
+Host Facts
+==========
+
+Collects commonly used host facts (cores, memory, release, addresses and users)
+in one remote command and caches them per host for the whole fabric run.
+
+**Fabric environment:**
+
+.. code-block:: yaml
+
+    settings:
+      facts:
+        # cache_path: ~/.cache/blues/facts  # Persist facts locally between runs (Default: disabled)
+        # cache_ttl: 3600                   # Seconds a persisted entry is valid (Default: 3600)
+
+"""
+import json
+import os
+import re
+import time
+
+from fabric.decorators import task
+from fabric.state import env
+
+from refabric.api import run, info
+from refabric.context_managers import silent, hide_prefix
+from refabric.contrib import blueprints
+
+__all__ = ['show', 'clear']
+
+
+blueprint = blueprints.get(__name__)
+
+# Facts holding one entry per line, collected as lists
+MULTI_VALUE_FACTS = ('ipv4', 'passwd')
+
+COLLECT_COMMANDS = [
+    "printf 'nproc\\t%s\\n' \"$(nproc)\"",
+    "printf 'mem_total\\t%s\\n' \"$(awk '/^MemTotal:/ {print $2}' /proc/meminfo)\"",
+    "printf 'page_size\\t%s\\n' \"$(getconf PAGE_SIZE)\"",
+    "printf 'phys_pages\\t%s\\n' \"$(getconf _PHYS_PAGES)\"",
+    "printf 'lsb_release\\t%s\\n' \"$(lsb_release --release --short 2>/dev/null)\"",
+    "printf 'lsb_codename\\t%s\\n' \"$(lsb_release --codename --short 2>/dev/null)\"",
+    "printf 'hostname\\t%s\\n' \"$(hostname -A)\"",
+    "ip r show | grep ' src ' | awk '{print \"ipv4\\t\" $3 \" \" $NF}'",
+    "sed 's/^/passwd\\t/' /etc/passwd",
+]
+
+_facts = {}
+
+
+def collect():
+    """
+    Collect all facts for current host in a single remote command.
+
+    :return: dict of raw facts
+    """
+    with silent():
+        output = run('; '.join(COLLECT_COMMANDS), pty=False)
+
+    return parse(output)
+
+
+def parse(output):
+    """
+    Parse tab separated collector output.
+
+    :param output: Collector output, one "<fact>\\t<value>" per line
+    :return: dict of raw facts
+    """
+    facts = dict((key, []) for key in MULTI_VALUE_FACTS)
+
+    for line in output.splitlines():
+        key, _, value = line.rstrip('\r').partition('\t')
+        if not key:
+            continue
+        if key in MULTI_VALUE_FACTS:
+            if value:
+                facts[key].append(value)
+        else:
+            facts[key] = value.strip()
+
+    return facts
+
+
+def get(refresh=False):
+    """
+    Get facts for current host, collecting them at most once per run.
+
+    :param refresh: Force a new remote collect
+    :return: dict of raw facts
+    """
+    host = env.host_string
+
+    if not refresh:
+        if host in _facts:
+            return _facts[host]
+
+        facts = _read_cache(host)
+        if facts is not None:
+            _facts[host] = facts
+            return facts
+
+    facts = collect()
+    _facts[host] = facts
+    _write_cache(host, facts)
+
+    return facts
+
+
+def invalidate(host=None):
+    """
+    Forget collected facts, e.g. after users or groups have changed.
+
+    :param host: Host to forget (Default: current host)
+    """
+    host = host or env.host_string
+    _facts.pop(host, None)
+
+    path = _cache_file(host)
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _cache_file(host):
+    cache_path = blueprint.get('cache_path')
+    if not cache_path or not host:
+        return None
+
+    filename = re.sub(r'[^\w.@-]', '_', host)
+    return os.path.join(os.path.expanduser(cache_path), '{}.json'.format(filename))
+
+
+def _read_cache(host):
+    path = _cache_file(host)
+    if not path or not os.path.exists(path):
+        return None
+
+    ttl = int(blueprint.get('cache_ttl', 3600))
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if time.time() - cached.get('collected', 0) > ttl:
+        return None
+
+    return cached.get('facts')
+
+
+def _write_cache(host, facts):
+    path = _cache_file(host)
+    if not path:
+        return
+
+    cache_dir = os.path.dirname(path)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    with open(path, 'w') as f:
+        json.dump({'collected': time.time(), 'facts': facts}, f)
+
+
+def nproc():
+    """
+    Get the number of CPU cores.
+    """
+    return int(get()['nproc'])
+
+
+def total_memory():
+    """
+    Get total memory in bytes
+    """
+    return int(get()['mem_total']) * 1024
+
+
+def page_size():
+    """
+    Get PAGE_SIZE
+    """
+    return int(get()['page_size'])
+
+
+def phys_pages():
+    """
+    Get _PHYS_PAGES
+    """
+    return int(get()['phys_pages'])
+
+
+def lsb_release():
+    return get()['lsb_release']
+
+
+def lsb_codename():
+    return get()['lsb_codename']
+
+
+def hostname():
+    return get()['hostname']
+
+
+def ipv4_addresses():
+    """
+    Returns a dict containing pairs of interface names and their respective
+    ipv4 addresses.
+    """
+    return dict(entry.split() for entry in get()['ipv4'])
+
+
+def get_user(name):
+    """
+    Get /etc/passwd entry for user, without the shadow password.
+
+    :param name: Username
+    :return: dict(name, uid, gid, home, shell) or None
+    """
+    for entry in get()['passwd']:
+        d = entry.split(':')
+        if d[0] == name and len(d) >= 7:
+            return dict(name=d[0], uid=d[2], gid=d[3], home=d[5], shell=d[6])
+
+
+@task
+def show(refresh=False):
+    """
+    Show collected facts for current host
+
+    :param refresh: Collect facts again, even if cached
+    """
+    facts = get(refresh=bool(refresh))
+    with hide_prefix():
+        for key in sorted(facts):
+            if key == 'passwd':
+                info('{}: {} entries', key, len(facts[key]))
+            else:
+                info('{}: {}', key, facts[key])
+
+
+@task
+def clear():
+    """
+    Clear cached facts for current host
+    """
+    invalidate()
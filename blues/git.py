@@ -11,27 +11,42 @@ Installs git and contains useful git commands for other blueprints to use.
     blueprints:
       - blues.git
 
+    settings:
+      git:
+        # cache_path: ~/.cache/blues/git  # Local mirrors and source bundles (Optional)
+
 """
+import fcntl
 import os
 import re
+import uuid
+from contextlib import contextmanager
+from fnmatch import fnmatch
 
-from fabric.context_managers import cd
+from fabric.context_managers import cd, lcd, settings
 from fabric.contrib import files
 from fabric.decorators import task
 from fabric.utils import warn
-from fabric.operations import local
+from fabric.operations import local, put
+from fabric.state import env
 
 from refabric.api import run, info
 from refabric.context_managers import sudo, silent
 from refabric.contrib import blueprints
 
 from . import debian
+from .tracing import traced
 
 __all__ = ['setup']
 
 
 blueprint = blueprints.get(__name__)
 
+DEFAULT_CACHE_PATH = '~/.cache/blues/git'
+
+_mirrors = set()
+_changed_files = {}
+
 
 @task
 def setup():
@@ -47,6 +62,7 @@ def install():
         debian.apt_get('install', 'git')
 
 
+@traced()
 def clone(url, branch=None, repository_path=None, **kwargs):
     """
     Clone repository and branch.
@@ -54,9 +70,17 @@ def clone(url, branch=None, repository_path=None, **kwargs):
     :param url: Git url to clone
     :param branch: Branch to checkout
     :param repository_path: Destination
+    :param bundle: Remote git bundle to clone from, instead of url (Optional)
+    :param depth: Shallow clone with history truncated to depth commits (Optional)
+    :param filter: Partial clone filter, e.g. blob:none (Optional)
+    :param reference: Shared object store to borrow objects from, see `update_reference` (Optional)
     :param kwargs: Not used but here for easier kwarg passing
     :return: (destination, got_cloned bool)
     """
+    bundle = kwargs.pop('bundle', None)
+    options = clone_options(depth=kwargs.pop('depth', None),
+                            filter=kwargs.pop('filter', None),
+                            reference=kwargs.pop('reference', None))
     repository = parse_url(url, branch=branch)
     name = repository['name']
     branch = repository['branch']
@@ -77,10 +101,15 @@ def clone(url, branch=None, repository_path=None, **kwargs):
             if branch is not None:
                 maybe_branch = ' -b {branch}'.format(branch=branch)
 
-            cmd = 'git clone{maybe_branch} {remote} {name}'.format(
+            cmd = 'git clone{maybe_branch}{options} {remote} {name}'.format(
                 maybe_branch=maybe_branch,
-                remote=url,
+                options=options,
+                remote=bundle or url,
                 name=name)
+            if bundle:
+                # Point origin to the real remote, not the bundle
+                cmd += ' && cd {name} && git remote set-url origin {url}'.format(
+                    name=name, url=url)
             output = run(cmd)
 
         if output.return_code != 0:
@@ -95,6 +124,53 @@ def clone(url, branch=None, repository_path=None, **kwargs):
     return repository_path, cloned
 
 
+def clone_options(depth=None, filter=None, reference=None):
+    """
+    Build git clone options for shallow, partial and shared-reference clones.
+    """
+    options = ''
+    if depth:
+        options += ' --depth {}'.format(int(depth))
+    if filter:
+        options += ' --filter={}'.format(filter)
+    if reference:
+        # Keep borrowing objects, but do not fail if store is missing
+        options += ' --reference-if-able {}'.format(reference)
+    return options
+
+
+def init_reference(reference, group='app-data'):
+    """
+    Create per host shared object store, writable by group.
+
+    :param reference: Path to bare repository
+    :param group: Group of users updating the store
+    """
+    if not files.exists(os.path.join(reference, 'objects')):
+        info('Creating shared git object store: {}', reference)
+        debian.mkdir(reference, owner='root', group=group, mode=2775)
+        with cd(reference):
+            run('git init --quiet --bare --shared=group')
+
+
+def update_reference(reference, url, name):
+    """
+    Fetch repository objects into shared object store, for later clones to
+    borrow from.
+
+    :param reference: Path to bare repository, see `init_reference`
+    :param url: Git url
+    :param name: Remote name in store, e.g. project name
+    """
+    with cd(reference), silent():
+        output = run('(git remote get-url {name} >/dev/null 2>&1 || '
+                     'git remote add {name} {url}) && git fetch --quiet {name}'.format(
+                         name=name, url=url), pty=False)
+
+    if output.return_code != 0:
+        warn('Failed to update shared git object store {}:\n{}'.format(reference, output))
+
+
 def fetch(repository_path=None):
     if not repository_path:
         repository_path = debian.pwd()
@@ -103,6 +179,29 @@ def fetch(repository_path=None):
         run('git fetch origin', pty=False)
 
 
+def remote_commit(repository_path, branch):
+    """
+    Get commit of branch on origin, without fetching it.
+
+    :return: Commit hash, or None if branch or origin is not found
+    """
+    with cd(repository_path), silent(), settings(warn_only=True):
+        output = run('git ls-remote origin refs/heads/{}'.format(branch), pty=False)
+
+    commits = output.strip().split() if output.succeeded else []
+    return commits[0] if commits else None
+
+
+def has_commit(repository_path, commit):
+    """
+    Is commit in repository objects, e.g. already fetched?
+    """
+    with cd(repository_path), silent(), settings(warn_only=True):
+        output = run('git cat-file -e {}^{{commit}}'.format(commit), pty=False)
+
+    return output.succeeded
+
+
 def show_file(repository_path, filename, revision='HEAD'):
     with cd(repository_path), silent():
         # pipe through cat to get rid of any ANSI codes
@@ -114,24 +213,103 @@ def show_file(repository_path, filename, revision='HEAD'):
     return output
 
 
+def escape_pattern(text):
+    """
+    Escape text for a grep -E pattern.
+    """
+    return re.sub(r'([.^$*+?()[\]{}|\\])', r'\\\1', text)
+
+
+def show_files(repository_path, revisions, extensions=(), paths=()):
+    """
+    Get contents of files at several revisions in one round-trip.
+
+    :param repository_path: Repository path
+    :param revisions: Commits to read files at
+    :param extensions: Read all files with these extensions, e.g. .txt
+    :param paths: Read these files, relative to repository root
+    :return: dict(revision=dict(path=content)), without missing files
+    """
+    patterns = ['{}$'.format(escape_pattern(extension)) for extension in extensions] + \
+        ['^{}$'.format(escape_pattern(os.path.normpath(path))) for path in paths]
+    if not patterns:
+        return dict((revision, {}) for revision in revisions)
+
+    # List matching files per revision, and read all of them with one cat-file
+    command = ('for rev in {revisions}; do git ls-tree -r --name-only "$rev" 2>/dev/null | '
+               'grep -E \'{pattern}\' | grep -v " " | sed "s|.*|$rev:& $rev:&|"; done | '
+               'git cat-file --batch="%(objectname) %(objecttype) %(objectsize) %(rest)"'.format(
+                   revisions=' '.join(revisions), pattern='|'.join(patterns)))
+
+    with cd(repository_path), silent():
+        output = run(command, pty=False)
+
+    return parse_batch(output, revisions)
+
+
+def parse_batch(output, revisions):
+    """
+    Parse `git cat-file --batch` output, with object name as rest of header.
+
+    :return: dict(revision=dict(path=content))
+    """
+    files = dict((revision, {}) for revision in revisions)
+
+    position = 0
+    while position < len(output):
+        end = output.find('\n', position)
+        if end == -1:
+            break
+        header = output[position:end].split(' ')
+        position = end + 1
+
+        if len(header) < 4 or header[1] != 'blob':
+            # Missing object
+            continue
+
+        size, name = int(header[2]), header[3]
+        revision, _, path = name.partition(':')
+        files.setdefault(revision, {})[path] = output[position:position + size]
+        position += size + 1
+
+    return files
+
+
+@traced()
 def reset(branch, repository_path=None, **kwargs):
     """
     Fetch, reset, clean and checkout repository branch.
 
+    :param bundle: Remote git bundle to fetch branch from, instead of origin (Optional)
+    :param fetch: Fetch before reset (Default: True)
+    :param depth: Keep shallow history of depth commits (Optional)
     :return: commit short hash or None
     """
     if not repository_path:
         repository_path = debian.pwd()
 
     ignore = kwargs.pop('ignore', None) or []
+    bundle = kwargs.pop('bundle', None)
+    depth = kwargs.pop('depth', None)
+
+    if not kwargs.pop('fetch', True):
+        fetch_command = None
+    elif bundle:
+        # Fetch into the remote branch, as if fetched from origin
+        fetch_command = 'git fetch {} +refs/heads/{}:refs/remotes/origin/{}'.format(
+            bundle, branch, branch)
+    elif depth:
+        fetch_command = 'git fetch --depth {} origin'.format(int(depth))
+    else:
+        fetch_command = 'git fetch origin'  # Fetch branches and tags
 
     with cd(repository_path):
         name = os.path.basename(repository_path)
         info('Resetting git repository: {}@{}', name, branch or '<default>')
 
         with silent('warnings'):
-            commands = [
-                'git fetch origin',  # Fetch branches and tags
+            commands = filter(None, [
+                fetch_command,
                 'git reset --hard HEAD',  # Make hard reset to HEAD
                 # Remove untracked files pyc, xxx~ etc
                 'git clean {} -fdx'.format(' '.join(['-e {}'.format(ign)
@@ -141,7 +319,7 @@ def reset(branch, repository_path=None, **kwargs):
                 # repository in case of no specified branch.
                 'git reset refs/remotes/origin/{} --hard'.format(
                     branch or 'HEAD'),
-            ]
+            ])
 
             output = run(' && '.join(commands))
 
@@ -172,6 +350,111 @@ def reset(branch, repository_path=None, **kwargs):
             return commit
 
 
+@contextmanager
+def locked(path):
+    """
+    Hold exclusive lock on local path, e.g. between forked parallel workers.
+    """
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def update_mirror(url):
+    """
+    Clone or update local mirror of repository, once per run.
+
+    :param url: Git url
+    :return: Local mirror path
+    """
+    cache_path = os.path.expanduser(blueprint.get('cache_path', DEFAULT_CACHE_PATH))
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path)
+
+    path = os.path.join(cache_path, '{}.git'.format(re.sub(r'[^\w.-]', '_', url)))
+
+    with locked(path):
+        if url not in _mirrors:
+            with settings(warn_only=False):
+                if not os.path.exists(path):
+                    info('Mirroring {} into {}', url, path)
+                    local('git clone --mirror --quiet {} {}'.format(url, path))
+                else:
+                    local('git --git-dir={} remote update --prune'.format(path))
+            _mirrors.add(url)
+
+    return path
+
+
+def default_branch(url):
+    """
+    Get default branch of repository, from local mirror.
+    """
+    with lcd(update_mirror(url)):
+        return local('git symbolic-ref --short HEAD', capture=True).strip()
+
+
+def create_bundle(url, branch, base_commit=None):
+    """
+    Build local git bundle with branch, from base commit if known, once per
+    base and branch tip.
+
+    :param url: Git url
+    :param branch: Branch to bundle
+    :param base_commit: Commit the receiver already has (Optional)
+    :return: Local bundle path, or None if receiver is up to date
+    """
+    mirror = update_mirror(url)
+
+    with lcd(mirror):
+        tip = local('git rev-parse refs/heads/{}'.format(branch), capture=True).strip()
+        if base_commit:
+            base = local('git rev-parse --verify --quiet {}^{{commit}} || true'.format(
+                base_commit), capture=True).strip()
+            if base == tip:
+                return None
+            if not base:
+                warn('Commit {} not found in {}, bundling full branch'.format(
+                    base_commit, url))
+        else:
+            base = None
+
+        path = '{}-{}-{}.bundle'.format(mirror[:-len('.git')], (base or 'full')[:12], tip[:12])
+        with locked(path):
+            if not os.path.exists(path):
+                revisions = 'refs/heads/{}'.format(branch)
+                if base:
+                    revisions += ' ^{}'.format(base)
+                tmp_path = '{}.{}'.format(path, uuid.uuid4().hex[:8])
+                local('git bundle create {} {}'.format(tmp_path, revisions), capture=True)
+                os.rename(tmp_path, path)
+
+    info('Bundled {} {}..{}, {} kB', branch, (base or '')[:7], tip[:7],
+         os.path.getsize(path) / 1024)
+
+    return path
+
+
+def upload_bundle(url, branch, base_commit=None):
+    """
+    Build incremental bundle locally and upload it to current host.
+
+    :return: Remote bundle path, or None if host is up to date
+    """
+    path = create_bundle(url, branch, base_commit=base_commit)
+    if path is None:
+        return None
+
+    remote_path = '/tmp/{}'.format(os.path.basename(path))
+    with silent():
+        put(path, remote_path, mode=0644)
+
+    return remote_path
+
+
 def get_commit(repository_path=None, short=False):
     """
     Get current checked out commit for cloned repository path.
@@ -234,6 +517,86 @@ def diff_stat(repository_path=None, commit='HEAD^', path=None):
         return changed, insertions, deletions
 
 
+class ChangedFiles(object):
+    """
+    Index of files changed in a commit range, to query without further diffs.
+    """
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        return iter(sorted(self.files))
+
+    def __contains__(self, path):
+        return os.path.normpath(path) in self.files
+
+    def matching(self, *patterns):
+        """
+        Get changed paths matching any pattern.
+
+        :param patterns: File path, dir path ending with /, or glob, e.g. */migrations/*
+        :return: list of paths
+        """
+        def matches(path, pattern):
+            if pattern.endswith('/'):
+                return path.startswith(os.path.normpath(pattern) + '/')
+            return path == os.path.normpath(pattern) or fnmatch(path, pattern)
+
+        return [path for path in self if any(matches(path, pattern) for pattern in patterns)]
+
+    def changed(self, *patterns):
+        """
+        Has any file matching any pattern changed?
+        """
+        return bool(self.matching(*patterns))
+
+
+def parse_name_status(output):
+    """
+    Parse `git diff --name-status --no-renames` output.
+
+    :return: dict(path=status)
+    """
+    files = {}
+    for line in output.splitlines():
+        status, _, path = line.strip().partition('\t')
+        if path:
+            files[path] = status
+
+    return files
+
+
+def changed_files(repository_path=None, commit='HEAD^'):
+    """
+    Get index of files changed in commit range, diffed once per host and range.
+
+    :param repository_path: Repository path
+    :param commit: Commit range, ex 12345..67890
+    :return: ChangedFiles or None, if range can not be diffed, e.g. missing
+        commit in shallow clone
+    """
+    if not repository_path:
+        repository_path = debian.pwd()
+
+    key = (env.host_string, repository_path, commit)
+    if key not in _changed_files:
+        with cd(repository_path), silent():
+            output = run('git diff --name-status --no-renames {}'.format(commit),
+                         pty=False)
+
+        if output.return_code != 0:
+            warn('Failed to diff {}, return code {}'.format(commit, output.return_code))
+            return None
+
+        _changed_files[key] = ChangedFiles(parse_name_status(output))
+
+    return _changed_files[key]
+
+
 def log(repository_path=None, commit='HEAD', count=1, path=None):
     """
     Get log for repository and optional commit range.
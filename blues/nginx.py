@@ -33,6 +33,8 @@ from refabric.context_managers import sudo, silent
 from refabric.contrib import blueprints
 
 from . import debian
+from . import state
+from . import uploads
 
 __all__ = ['start', 'stop', 'restart', 'reload', 'setup', 'configure',
            'enable', 'disable', 'tail']
@@ -162,23 +164,43 @@ def install_from_source():
                 nginx_full_distro_version=nginx_full_distro_version))
 
 
+def get_templates():
+    """
+    Get templates to configure.
+
+    :return: list of (template, destination, context)
+    """
+    context = {
+        'num_cores': debian.nproc(),
+        'ipv4_addresses': debian.get_ipv4_addresses(),
+    }
+    return [('./', nginx_root, context)]
+
+
 @task
 def configure():
     """
     Configure nginx and enable/disable sites
     """
     with sudo():
+        templates = get_templates()
+        sites = blueprint.get('sites') or []
+        auto_disable_sites = blueprint.get('auto_disable_sites', True)
+
+        checksum = None
+        if state.is_enabled():
+            checksum = state.checksum(uploads.render_all(blueprint, templates),
+                                      sites, auto_disable_sites)
+            if state.unchanged('nginx', checksum):
+                return
+
         # Upload templates
-        context = {
-            'num_cores': debian.nproc(),
-            'ipv4_addresses': debian.get_ipv4_addresses(),
-        }
-        uploads = blueprint.upload('./', nginx_root, context)
+        updates = []
+        for template, destination, context in templates:
+            updates.extend(uploads.upload(blueprint, template, destination, context))
 
         # Disable previously enabled sites not configured sites-enabled
         changes = []
-        sites = blueprint.get('sites') or []
-        auto_disable_sites = blueprint.get('auto_disable_sites', True)
         if auto_disable_sites:
             with silent():
                 enabled_site_links = run('ls {}'.format(sites_enabled_path)).split()
@@ -194,9 +216,11 @@ def configure():
             changes.append(changed)
 
         ### Reload nginx if new templates or any site has been enabled/disabled
-        if uploads or any(changes):
+        if updates or any(changes):
             reload()
 
+        state.update('nginx', checksum=checksum)
+
 
 @task
 def disable(site, do_reload=True):
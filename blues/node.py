@@ -167,10 +167,13 @@ def install_dependencies(path=None, production=True, changed=True):
     :param production:
         Boolean flag to toggle `--production` parameter for npm
     :param changed:
-        Boolean flag or tuple of two commit sha to check if package.json and
-        bower.json were changed.
+        Boolean flag, tuple of two commit sha or index of changed files
+        (`git.ChangedFiles`) to check if package.json and bower.json were
+        changed.
     :return:
     """
+    from blues import git
+    from .application.deploy import get_changes
 
     dependency_path_root = path or git_repository_path()
 
@@ -180,20 +183,17 @@ def install_dependencies(path=None, production=True, changed=True):
 
     with sudo_project(), cd(dependency_path_root):
 
-        npm_changed = bower_changed = changed
-
         if isinstance(changed, tuple):  # i.e. commits: (from_sha, to_sha)
-            changed = '{}..{}'.format(*changed)
+            changed = get_changes(*changed)
+            if changed is None:
+                # Range could not be diffed, install to be safe
+                changed = True
 
-            from blues import git
-
-            if has_package:
-                npm_changed = git.diff_stat(
-                    git_repository_path(), changed, 'package.json')[0]
+        npm_changed = bower_changed = changed
 
-            if has_bower:
-                bower_changed = git.diff_stat(
-                    git_repository_path(), changed, 'bower.json')[0]
+        if isinstance(changed, git.ChangedFiles):
+            npm_changed = 'package.json' in changed
+            bower_changed = 'bower.json' in changed
 
         if has_package and npm_changed:
             run('npm install' + (' --production' if production else ''))
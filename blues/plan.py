@@ -0,0 +1,329 @@
+"""
+Plan
+====
+
+Works out what ``app.setup``, ``app.configure`` and the service ``configure``
+tasks would change on a host, without changing anything.
+
+Templates are rendered locally and compared to the remote files with batched
+read-only commands, source and requirement changes are resolved against the
+origin branch head, from ``git ls-remote`` and commits already fetched, and the
+result is printed as diffs, the operations that would run, e.g. provider
+reloads and service restarts, and an estimated cost.
+
+Run e.g. ``fab plan.app``, ``fab plan.app:setup=yes`` or
+``fab plan.service:nginx,postgres``.
+
+**Fabric environment:**
+
+.. code-block:: yaml
+
+    settings:
+      plan:
+        # costs:              # Estimated seconds per operation, used for the total (Defaults below)
+        #   upload: 1         # Per changed file
+        #   source: 10        # Clone or update of source
+        #   requirements: 90  # Per installed requirements file
+        #   virtualenv: 30
+        #   user: 5
+        #   install: 120      # Install of providers
+        #   reload: 5         # Per provider or service reload
+        #   restart: 20       # Per service restart, interrupts service
+
+"""
+import base64
+import difflib
+import importlib
+
+from fabric.decorators import task
+from fabric.state import env
+from fabric.utils import abort, indent, puts, warn
+
+from refabric.api import run, info
+from refabric.context_managers import sudo, silent, hide_prefix
+from refabric.contrib import blueprints
+
+from . import state
+from . import uploads
+
+__all__ = ['app', 'service']
+
+
+blueprint = blueprints.get(__name__)
+
+DEFAULT_COSTS = {
+    'upload': 1,
+    'source': 10,
+    'requirements': 90,
+    'virtualenv': 30,
+    'user': 5,
+    'install': 120,
+    'reload': 5,
+    'restart': 20,
+}
+
+# Service blueprints and how they apply changed templates
+SERVICES = {
+    'nginx': 'reload',
+    'supervisor': 'reload',
+    'postgres': 'restart',
+    'redis': 'restart',
+}
+
+
+class Plan(object):
+    """
+    Operations that would run on current host.
+    """
+
+    def __init__(self):
+        self.operations = []
+        self.costs = dict(DEFAULT_COSTS, **(blueprint.get('costs') or {}))
+
+    def add(self, kind, description, count=1):
+        """
+        Add operation.
+
+        :param kind: Cost key, e.g. upload or restart
+        :param description: What would be done
+        :param count: Number of operations, e.g. changed files
+        """
+        self.operations.append((kind, description, self.costs.get(kind, 0) * count))
+
+    @property
+    def cost(self):
+        return sum(cost for _, _, cost in self.operations)
+
+    def report(self):
+        with hide_prefix():
+            if not self.operations:
+                info('Plan for {}: nothing to do', env.host_string)
+                return
+
+            info('Plan for {}:', env.host_string)
+            for kind, description, cost in self.operations:
+                puts(indent('{} {} (~{}s)'.format('!' if kind == 'restart' else '~',
+                                                  description, cost)),
+                     show_prefix=False)
+
+            restarts = len([kind for kind, _, _ in self.operations if kind == 'restart'])
+            info('Estimated cost: ~{}s, {} service restart(s)', self.cost, restarts)
+
+
+def read_files(paths):
+    """
+    Read remote files in one round-trip.
+
+    :return: dict(path=content), without missing files
+    """
+    if not paths:
+        return {}
+
+    with sudo(), silent():
+        output = run('for f in {}; do printf "%s\\t" "$f"; '
+                     'base64 -w0 "$f" 2>/dev/null || printf -- -; echo; done'.format(
+                         ' '.join('"{}"'.format(path) for path in sorted(paths))),
+                     pty=False)
+
+    files = {}
+    for line in output.splitlines():
+        path, _, content = line.strip().partition('\t')
+        if path and content != '-':
+            files[path] = base64.b64decode(content)
+
+    return files
+
+
+def print_diff(path, remote, local):
+    lines = difflib.unified_diff(
+        remote.splitlines(True) if remote is not None else [],
+        local.splitlines(True),
+        fromfile=path if remote is not None else '/dev/null',
+        tofile=path)
+
+    for line in lines:
+        # Not indent(), it would strip diff context lines
+        puts('    ' + line.rstrip('\n'), show_prefix=False)
+
+
+def plan_templates(bp, templates):
+    """
+    Render templates and diff them against remote files.
+
+    :param templates: list of (template, destination, context)
+    :return: Changed remote paths
+    """
+    files = uploads.render_all(bp, templates)
+    changed = uploads.diff(files)
+    remote = read_files(changed.keys())
+
+    with hide_prefix():
+        for path in sorted(changed):
+            print_diff(path, remote.get(path), changed[path][0])
+
+    return sorted(changed)
+
+
+def plan_service(plan, name):
+    """
+    Plan service blueprint configure.
+    """
+    module = importlib.import_module('blues.{}'.format(name))
+
+    with sudo():
+        changed = plan_templates(module.blueprint, module.get_templates())
+    if changed:
+        plan.add('upload', 'upload {} {} file(s)'.format(len(changed), name),
+                 count=len(changed))
+        plan.add(SERVICES[name], '{} {}'.format(SERVICES[name], name))
+
+
+def plan_app(plan, setup=False):
+    """
+    Plan app setup or configure.
+    """
+    from .application.project import git_repository_path, project_home, virtualenv_path
+    from .application.providers import get_providers
+
+    path = git_repository_path()
+    providers = get_providers(env.host_string)
+
+    with sudo(), silent():
+        output = run('test -d {}/.git && echo source; test -d {} && echo virtualenv; '
+                     'test -d {} && echo home; true'.format(
+                         path, virtualenv_path(), project_home()), pty=False)
+    installed = output.split()
+
+    if setup:
+        plan_setup(plan, installed, providers)
+
+    code_changed = plan_source(plan, path, installed)
+
+    plan_reloads(plan, providers, reload=code_changed or setup)
+
+
+def plan_setup(plan, installed, providers):
+    """
+    Plan project user, structure, virtualenv and providers install of setup.
+    """
+    from . import facts
+    from .application.project import project_home, use_virtualenv, user_name, virtualenv_path
+
+    if facts.get_user(user_name()) is None:
+        plan.add('user', 'create project user {}'.format(user_name()))
+    if 'home' not in installed:
+        plan.add('user', 'create project structure in {}'.format(project_home()))
+    if use_virtualenv() and 'virtualenv' not in installed:
+        plan.add('virtualenv', 'create virtualenv {}'.format(virtualenv_path()))
+    if providers:
+        plan.add('install', 'install providers {}'.format(', '.join(sorted(providers))))
+
+
+def plan_source(plan, path, installed):
+    """
+    Plan source clone or update, and requirements install.
+
+    :return: bool, would code change?
+    """
+    from . import git
+    from .application.deploy import get_changed_requirements
+    from .application.project import git_repository, requirements_txt, sudo_project, \
+        use_virtualenv
+
+    if 'source' not in installed:
+        plan.add('source', 'clone source to {}'.format(path))
+        if use_virtualenv():
+            files = requirements_txt()
+            files = [files] if isinstance(files, basestring) else files
+            plan.add('requirements', 'install requirements {}'.format(', '.join(files)),
+                     count=len(files))
+        return True
+
+    # Read only, as the project user owning the repository, nothing is fetched
+    with sudo_project():
+        previous_commit = git.get_commit(path)
+        current_commit = git.remote_commit(path, git_repository()['branch'])
+        fetched = current_commit and git.has_commit(path, current_commit)
+        if fetched:
+            commits = git.log(path, commit='{}..{}'.format(previous_commit, current_commit),
+                              count=None)
+
+    if current_commit is None:
+        warn('Branch not found on origin of {}, source update not planned'.format(path))
+        return False
+
+    if previous_commit == current_commit:
+        return False
+
+    if not fetched:
+        plan.add('source', 'update source {}..{} (not fetched yet)'.format(
+            previous_commit[:7], current_commit[:7]))
+        if use_virtualenv():
+            plan.add('requirements', 'install requirements, if changed')
+        return True
+
+    plan.add('source', 'update source {}..{} ({} commit(s))'.format(
+        previous_commit[:7], current_commit[:7], len(commits)))
+
+    if use_virtualenv():
+        files = get_changed_requirements(previous_commit, current_commit)
+        if files:
+            plan.add('requirements', 'install requirements {}'.format(
+                ', '.join(files)), count=len(files))
+
+    return True
+
+
+def plan_reloads(plan, providers, reload=False):
+    """
+    Plan provider reloads.
+
+    :param reload: Reload regardless of provider configs, e.g. on code change
+    """
+    from .application.tasks import providers_checksum
+
+    # Provider configs are uploaded by the providers themselves, compare their inputs
+    if reload:
+        reloads = providers
+    elif not state.is_enabled():
+        info('Provider configs not compared, enable state to skip reloads in plan')
+        reloads = providers
+    elif state.get('providers', 'checksum') != providers_checksum(providers):
+        reloads = providers
+    else:
+        reloads = {}
+
+    if reloads:
+        plan.add('reload', 'reload providers {}'.format(', '.join(sorted(reloads))),
+                 count=len(set(reloads.values())))
+
+
+@task
+def app(setup=False):
+    """
+    Show what app.configure, or app.setup, would change on current host
+
+    :param setup: Plan app.setup instead of app.configure
+    """
+    plan = Plan()
+    plan_app(plan, setup=str(setup).lower() in ('1', 'true', 'yes', 'y'))
+    plan.report()
+    return plan
+
+
+@task
+def service(*names):
+    """
+    Show what configure of service blueprints would change on current host
+
+    :param names: Services to plan, e.g. nginx,postgres
+    """
+    unknown = [name for name in names if name not in SERVICES]
+    if not names or unknown:
+        abort('Plan one or more of: {}'.format(', '.join(sorted(SERVICES))))
+
+    plan = Plan()
+    for name in names:
+        plan_service(plan, name)
+    plan.report()
+    return plan
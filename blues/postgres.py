@@ -37,6 +37,8 @@ from refabric.context_managers import sudo, silent
 from refabric.contrib import blueprints
 
 from . import debian
+from . import state
+from . import uploads
 
 __all__ = ['start', 'stop', 'restart', 'reload', 'setup', 'configure',
            'setup_schemas', 'generate_pgtune_conf', 'dump', 'install',
@@ -128,33 +130,47 @@ def setup():
     setup_schemas()
 
 
-@task
-def configure():
+def get_templates():
     """
-    Configure Postgresql
+    Get templates to configure.
+
+    :return: list of (template, destination, context)
     """
     context = {
         'listen_addresses': blueprint.get('bind', 'localhost'),
         'host_all_allow': blueprint.get('allow', None)
     }
+    return [
+        (os.path.join('.', 'pgtune.conf'), postgres_root(), None),
+        (os.path.join('.', 'pg_hba.conf'), postgres_root(), context),
+        (os.path.join('.', 'postgresql-{}.conf'.format(version())),
+         postgres_root('postgresql.conf'), context),
+    ]
+
+
+@task
+def configure():
+    """
+    Configure Postgresql
+    """
+    templates = get_templates()
+
+    checksum = None
+    if state.is_enabled():
+        checksum = state.checksum(version(), uploads.render_all(blueprint, templates))
+        if state.unchanged('postgres', checksum):
+            return
+
     updates = [
-        blueprint.upload(os.path.join('.', 'pgtune.conf'),
-                         postgres_root(),
-                         user='postgres'),
-        blueprint.upload(os.path.join('.', 'pg_hba.conf'),
-                         postgres_root(),
-                         context=context,
-                         user='postgres'),
-        blueprint.upload(os.path.join('.',
-                                      'postgresql-{}.conf'.format(version())),
-                         postgres_root('postgresql.conf'),
-                         context=context,
-                         user='postgres')
+        uploads.upload(blueprint, template, destination, context=context, user='postgres')
+        for template, destination, context in templates
     ]
 
     if any(updates):
         restart()
 
+    state.update('postgres', checksum=checksum)
+
 
 @task
 def setup_schemas(drop=False):
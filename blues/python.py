@@ -92,17 +92,27 @@ def install():
 
 
 def pip(command, *options, **kwargs):
+    info('Running pip {}', command)
+    run(pip_command(command, *options, **kwargs))
+
+
+def pip_command(command, *options, **kwargs):
+    """
+    Get pip command line, e.g. to combine with other commands in one run.
+
+    :param verbose: Verbose output, besides the log file (Default: True)
+    """
     # TODO: change pip log location, per env? per user?
     # Perhaps we should just remove the log_file argument and let pip put it
     # where it belongs.
-    info('Running pip {}', command)
     bin = kwargs.pop('bin',
                      'pip3' if requested_version() >= (3,)
                      else 'pip')
-    cmd = '{pip} {command} {options} -v --log={log_file} --log-file={log_file}'
+    verbose = kwargs.pop('verbose', True)
+    cmd = '{pip} {command} {options}{verbose} --log={log_file} --log-file={log_file}'
 
-    run(cmd.format(pip=bin, command=command,
-                   options=' '.join(options), log_file=pip_log_file))
+    return cmd.format(pip=bin, command=command, options=' '.join(options),
+                      verbose=' -v' if verbose else '', log_file=pip_log_file)
 
 
 @task
@@ -22,6 +22,8 @@ from refabric.context_managers import sudo
 from refabric.contrib import blueprints
 
 from . import debian
+from . import state
+from . import uploads
 from refabric.operations import run
 
 __all__ = ['start', 'stop', 'restart', 'setup', 'configure']
@@ -65,10 +67,11 @@ def get_installed_version():
         abort('Failed to get installed redis version')
 
 
-@task
-def configure():
+def get_templates():
     """
-    Configure Redis
+    Get templates to configure.
+
+    :return: list of (template, destination, context)
     """
     context = {
         'bind': blueprint.get('bind', '127.0.0.1')
@@ -83,10 +86,30 @@ def configure():
     else:
         config = 'redis-3.conf'
 
-    uploads = blueprint.upload(config, '/etc/redis/redis.conf', context)
+    return [(config, '/etc/redis/redis.conf', context)]
+
+
+@task
+def configure():
+    """
+    Configure Redis
+    """
+    templates = get_templates()
+
+    checksum = None
+    if state.is_enabled():
+        checksum = state.checksum(uploads.render_all(blueprint, templates))
+        if state.unchanged('redis', checksum):
+            return
+
+    updates = []
+    for template, destination, context in templates:
+        updates.extend(uploads.upload(blueprint, template, destination, context))
 
-    if uploads:
+    if updates:
         if debian.lbs_release() >= '16.04':
             debian.chown(location='/etc/redis/redis.conf',
                          owner='redis', group='root')
         restart()
+
+    state.update('redis', checksum=checksum)
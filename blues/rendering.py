@@ -0,0 +1,224 @@
+"""
+Template Rendering
+==================
+
+Renders blueprint templates through one Jinja environment per blueprint and
+template search path, instead of a new environment, and a new parse, per call.
+
+Rendered output is cached by template, template dirs and context, so hosts
+sharing a role and context only render once. Compiled templates, and rendered
+output, can be persisted between runs, and shared by parallel host workers,
+by setting a cache path.
+
+Used for templates rendered locally by blues, i.e. bulk uploads (see
+``uploads.bulk``) and generated nginx site configs.
+
+**Fabric environment:**
+
+.. code-block:: yaml
+
+    settings:
+      rendering:
+        # cache_path: ~/.cache/blues/rendering  # Persist bytecode and rendered output locally (Default: disabled)
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+
+from fabric.decorators import task
+
+from jinja2 import Environment, FileSystemBytecodeCache
+
+from refabric.api import info
+from refabric.context_managers import hide_prefix
+from refabric.contrib import blueprints
+
+__all__ = ['stats', 'clear']
+
+
+blueprint = blueprints.get(__name__)
+
+_environments = {}
+_fingerprints = {}
+_rendered = {}
+_stats = defaultdict(int)
+
+
+def render(bp, template, context=None):
+    """
+    Render blueprint template, at most once per template and context.
+
+    :param bp: Blueprint owning the template
+    :param template: Template name
+    :param context: Template context
+    :return: Rendered template
+    """
+    context = context or {}
+    environment = get_environment(bp)
+
+    key = cache_key(environment, template, context)
+    if key is None:
+        _stats['uncacheable'] += 1
+        return environment.get_template(template).render(**context)
+
+    if key in _rendered:
+        _stats['hits'] += 1
+        return _rendered[key]
+
+    content = _read_output(key)
+    if content is not None:
+        _stats['persisted'] += 1
+    else:
+        _stats['rendered'] += 1
+        content = environment.get_template(template).render(**context)
+        _write_output(key, content)
+
+    _rendered[key] = content
+    return content
+
+
+def get_environment(bp):
+    """
+    Get shared Jinja environment for blueprint and current template dirs.
+    """
+    loader = bp.get_template_loader()
+    key = (bp.name, tuple(searchpath(loader)))
+
+    environment = _environments.get(key)
+    if environment is None:
+        bytecode_cache = None
+        cache_path = get_cache_path('bytecode')
+        if cache_path:
+            bytecode_cache = FileSystemBytecodeCache(makedirs(cache_path))
+        environment = Environment(loader=loader, bytecode_cache=bytecode_cache)
+        _environments[key] = environment
+
+    return environment
+
+
+def searchpath(loader):
+    """
+    Flatten the directories searched by a (choice of) file system loader(s).
+    """
+    paths = list(getattr(loader, 'searchpath', []))
+    for child in getattr(loader, 'loaders', []):
+        paths.extend(searchpath(child))
+    return paths
+
+
+def fingerprint(environment):
+    """
+    Hash name, size and mtime of every template visible to environment.
+
+    Part of every cache key, to not serve stale output when an included or
+    extended template changes between runs.
+    """
+    paths = tuple(searchpath(environment.loader))
+    if paths not in _fingerprints:
+        checksum = hashlib.sha1()
+        for path in paths:
+            for root, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    stat = os.stat(os.path.join(root, filename))
+                    checksum.update('{}\0{}\0{}\n'.format(
+                        os.path.relpath(os.path.join(root, filename), path),
+                        stat.st_size, stat.st_mtime))
+        _fingerprints[paths] = checksum.hexdigest()
+
+    return _fingerprints[paths]
+
+
+def cache_key(environment, template, context):
+    """
+    Hash template, template dirs and context.
+
+    :return: hex digest or None if context can not be serialized
+    """
+    try:
+        serialized = json.dumps(context, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+    source, _, _ = environment.loader.get_source(environment, template)
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+
+    checksum = hashlib.sha1()
+    checksum.update(fingerprint(environment))
+    checksum.update(template)
+    checksum.update(hashlib.sha1(source).hexdigest())
+    checksum.update(serialized)
+
+    return checksum.hexdigest()
+
+
+def get_cache_path(*parts):
+    cache_path = blueprint.get('cache_path')
+    if not cache_path:
+        return None
+
+    return os.path.join(os.path.expanduser(cache_path), *parts)
+
+
+def makedirs(path):
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Created by another parallel worker
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def _read_output(key):
+    cache_path = get_cache_path('output')
+    if not cache_path:
+        return None
+
+    try:
+        with open(os.path.join(cache_path, key)) as f:
+            return f.read().decode('utf-8')
+    except IOError:
+        return None
+
+
+def _write_output(key, content):
+    cache_path = get_cache_path('output')
+    if not cache_path:
+        return
+
+    # Write to temp file and rename, for parallel workers to never read partial output
+    fd, path = tempfile.mkstemp(dir=makedirs(cache_path))
+    with os.fdopen(fd, 'w') as f:
+        f.write(content.encode('utf-8'))
+    os.rename(path, os.path.join(cache_path, key))
+
+
+@task
+def stats():
+    """
+    Show template render cache statistics
+    """
+    with hide_prefix():
+        info('{} rendered, {} cache hit(s), {} persisted hit(s), {} uncacheable',
+             _stats['rendered'], _stats['hits'], _stats['persisted'],
+             _stats['uncacheable'])
+
+
+@task
+def clear():
+    """
+    Clear rendered templates and bytecode, persisted and in memory
+    """
+    _environments.clear()
+    _fingerprints.clear()
+    _rendered.clear()
+
+    cache_path = get_cache_path()
+    if cache_path and os.path.exists(cache_path):
+        shutil.rmtree(cache_path)
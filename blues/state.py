@@ -0,0 +1,194 @@
+"""
+Deploy State
+============
+
+Keeps a per host manifest of what blues last configured; checksums of rendered
+templates and settings per blueprint, and provider configs.
+
+The manifest is read in one round-trip and lets `configure` tasks skip every
+step whose inputs are unchanged since the last successful run. Changes made on
+the host by hand are not detected; run `state.clear` to force a full configure.
+
+**Fabric environment:**
+
+.. code-block:: yaml
+
+    settings:
+      state:
+        enabled: true                # Skip unchanged configure steps (Default: false)
+        # path: /srv/app/foo/.blues-state  # Remote manifest, shared by all blueprints (Default: /var/lib/blues/state)
+
+"""
+import hashlib
+import json
+import os
+import uuid
+
+from fabric.decorators import task
+from fabric.state import env
+
+from refabric.api import run, info
+from refabric.context_managers import sudo, silent, hide_prefix
+from refabric.contrib import blueprints
+
+__all__ = ['show', 'clear']
+
+
+blueprint = blueprints.get(__name__)
+
+DEFAULT_PATH = '/var/lib/blues/state'
+
+_manifests = {}
+
+
+def is_enabled():
+    return bool(blueprint.get('enabled', False))
+
+
+def manifest_path():
+    return blueprint.get('path', DEFAULT_PATH)
+
+
+def checksum(*inputs):
+    """
+    Hash configure inputs, e.g. rendered templates, settings and context.
+
+    :return: hex digest
+    """
+    serialized = json.dumps(inputs, sort_keys=True, default=repr)
+    return hashlib.sha1(serialized).hexdigest()
+
+
+def directory_checksum(*paths):
+    """
+    Hash names and contents of all files in local dirs, e.g. template dirs.
+
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        for root, _, filenames in sorted(os.walk(path)):
+            for filename in sorted(filenames):
+                filename = os.path.join(root, filename)
+                with open(filename, 'rb') as f:
+                    digest.update('{}\0{}\n'.format(
+                        os.path.relpath(filename, path),
+                        hashlib.sha1(f.read()).hexdigest()))
+
+    return digest.hexdigest()
+
+
+def load(refresh=False):
+    """
+    Read manifest for current host, at most once per run.
+
+    :param refresh: Read manifest again
+    :return: dict(section=dict)
+    """
+    host = env.host_string
+    if refresh or host not in _manifests:
+        with sudo(), silent():
+            output = run('cat {} 2>/dev/null; true'.format(manifest_path()), pty=False)
+        try:
+            manifest = json.loads(output) if output.strip() else {}
+        except ValueError:
+            manifest = {}
+        _manifests[host] = manifest if isinstance(manifest, dict) else {}
+
+    return _manifests[host]
+
+
+def get(section, key=None, default=None):
+    """
+    Get manifest section, or key of section, for current host.
+    """
+    if not is_enabled():
+        return default
+
+    values = load().get(section, {})
+    if key is None:
+        return values or default
+    return values.get(key, default)
+
+
+def unchanged(section, digest):
+    """
+    Has section been configured with the same inputs before?
+
+    :param section: Manifest section, e.g. blueprint name
+    :param digest: Input checksum, see `checksum`
+    :return: bool
+    """
+    if not is_enabled() or digest is None:
+        return False
+
+    if get(section, 'checksum') == digest:
+        info('{} configuration unchanged, skipping', section.capitalize())
+        return True
+
+    return False
+
+
+def update(section, **values):
+    """
+    Update manifest section for current host and write it in one round-trip.
+
+    Should only be called once a configure step has fully succeeded.
+    """
+    if not is_enabled():
+        return
+
+    manifest = load()
+    manifest.setdefault(section, {}).update(values)
+    write(manifest)
+
+
+def write(manifest):
+    """
+    Atomically replace manifest on current host.
+    """
+    path = manifest_path()
+    tmp_path = '{}.{}'.format(path, uuid.uuid4().hex[:8])
+    marker = 'BLUES_STATE_{}'.format(uuid.uuid4().hex)
+    with sudo(), silent():
+        run("mkdir -p {dir} && cat > {tmp} <<'{marker}'\n{content}\n{marker}\n"
+            "chmod 600 {tmp} && mv -f {tmp} {path}".format(
+                dir=os.path.dirname(path), tmp=tmp_path, path=path, marker=marker,
+                content=json.dumps(manifest, indent=2, sort_keys=True)), pty=False)
+
+
+def invalidate(section=None):
+    """
+    Forget section, or whole manifest, for current host.
+    """
+    if section is None:
+        _manifests[env.host_string] = {}
+        with sudo(), silent():
+            run('rm -f {}'.format(manifest_path()))
+    elif section in load():
+        manifest = load()
+        manifest.pop(section)
+        write(manifest)
+
+
+@task
+def show():
+    """
+    Show deploy state manifest for current host
+    """
+    manifest = load(refresh=True)
+    with hide_prefix():
+        info('{}: {} section(s)', manifest_path(), len(manifest))
+        for section, values in sorted(manifest.items()):
+            info('{}: {}', section, ', '.join('{}={}'.format(k, v)
+                                              for k, v in sorted(values.items())))
+
+
+@task
+def clear(section=None):
+    """
+    Clear deploy state, forcing next configure to run all steps
+
+    :param section: Only clear given section, e.g. nginx (Default: all)
+    """
+    invalidate(section)
@@ -36,6 +36,8 @@ from refabric.contrib import blueprints
 
 from . import debian
 from . import python
+from . import state
+from . import uploads
 
 __all__ = ['start', 'stop', 'restart', 'reload', 'setup', 'configure',
            'enable', 'disable', 'ctl', 'status']
@@ -76,15 +78,29 @@ def install():
                                                    else 'latest'))
         python.pip('install', package, bin='pip2')
 
-        # Create group
-        debian.groupadd('app-data', gid_min=10000)
+        with debian.queued():
+            # Create group
+            debian.groupadd('app-data', gid_min=10000)
 
-        # Create directories
-        for d in (programs_available_path,
-                  programs_enabled_path,
-                  log_path,
-                  tmpfs_path):
-            debian.mkdir(d, owner='root', group='app-data', mode=1775)
+            # Create directories
+            for d in (programs_available_path,
+                      programs_enabled_path,
+                      log_path,
+                      tmpfs_path):
+                debian.mkdir(d, owner='root', group='app-data', mode=1775)
+
+
+def get_templates():
+    """
+    Get templates to configure.
+
+    :return: list of (template, destination, context)
+    """
+    return [
+        ('init/', '/etc/init/', None),
+        ('supervisord.conf', '/etc/', None),
+        ('programs-available/', programs_available_path + '/', None),
+    ]
 
 
 @task
@@ -93,16 +109,24 @@ def configure():
     Enable/disable configured programs
     """
     with sudo():
+        templates = get_templates()
+        programs = blueprint.get('programs') or []
+        auto_disable = blueprint.get('auto_disable_programs', True)
+
+        checksum = None
+        if state.is_enabled():
+            checksum = state.checksum(uploads.render_all(blueprint, templates),
+                                      programs, auto_disable)
+            if state.unchanged('supervisor', checksum):
+                return
+
         # Upload templates
-        uploads = blueprint.upload('init/', '/etc/init/')
-        uploads.extend(blueprint.upload('supervisord.conf', '/etc/') or [])
-        uploads.extend(blueprint.upload('programs-available/',
-                                        programs_available_path + '/') or [])
+        updates = []
+        for template, destination, context in templates:
+            updates.extend(uploads.upload(blueprint, template, destination, context))
 
         # Disable previously enabled programs not configured programs-enabled
         changes = []
-        programs = blueprint.get('programs') or []
-        auto_disable = blueprint.get('auto_disable_programs', True)
         if auto_disable:
             with silent():
                 enabled_program_links = run(
@@ -121,9 +145,11 @@ def configure():
 
         # Reload supervisor if new templates or any program has been
         # enabled/disabled.
-        if uploads or any(changes):
+        if updates or any(changes):
             reload()
 
+        state.update('supervisor', checksum=checksum)
+
 
 @task
 def disable(program, do_reload=True):
@@ -189,6 +215,25 @@ def supervisorctl(command, program=''):
         return run('supervisorctl {} {}'.format(command, program or ''))
 
 
+def get_child_pids(program):
+    """
+    Get pids of child processes of a running program, e.g. its workers.
+
+    :param program: The program to get children of
+    :return: Set of pids, or None if program is not running
+    """
+    with sudo(), silent():
+        output = run('pid=$(supervisorctl pid {}); echo "$pid"; '
+                     'case "$pid" in [1-9]*) pgrep -P "$pid";; esac; true'.format(program),
+                     pty=False)
+
+    lines = output.strip().split()
+    if not lines or not lines[0].isdigit() or lines[0] == '0':
+        return None
+
+    return set(int(pid) for pid in lines[1:] if pid.isdigit())
+
+
 @task
 def ctl(command, program=''):
     """
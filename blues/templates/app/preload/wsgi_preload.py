@@ -0,0 +1,16 @@
+"""
+Loads the wsgi app in the master process, before workers are forked.
+
+Objects allocated while loading are moved out of reach of the garbage
+collector, which would otherwise touch, and copy, their shared pages in
+every worker. Requires Python 3.7 to freeze, older versions only collect.
+"""
+import gc
+import importlib
+
+_module, _, _callable = '{{ module }}'.partition(':')
+application = eval(_callable or 'application', vars(importlib.import_module(_module)))
+
+gc.collect()
+if hasattr(gc, 'freeze'):
+    gc.freeze()
@@ -0,0 +1,343 @@
+"""
+Deploy Tracing
+==============
+
+Records a timeline of blues tasks, remote commands, template uploads and slow
+deploy steps, e.g. requirement installs, git resets and provider reloads, with
+host, blueprint, duration and return code.
+
+The timeline is written as Chrome trace-event JSON, one lane per host, to open
+in ``chrome://tracing`` or Perfetto, and summarized as the slowest steps and the
+time spent per blueprint.
+
+Enable for a whole run by prefixing the tasks, and optionally end with a report,
+e.g. ``fab tracing.trace app.deploy tracing.report``.
+
+**Fabric environment:**
+
+.. code-block:: yaml
+
+    settings:
+      tracing:
+        # path: blues-trace.json  # Chrome trace output file (Default: blues-trace.json)
+        # top: 15                 # Number of slowest steps to report (Default: 15)
+
+"""
+import atexit
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count
+
+import fabric.operations
+import fabric.tasks
+from fabric.decorators import task
+from fabric.state import env
+from fabric.utils import indent, puts
+
+from refabric.api import info
+from refabric.context_managers import hide_prefix
+from refabric.contrib import blueprints
+
+__all__ = ['trace', 'report']
+
+
+blueprint = blueprints.get(__name__)
+
+DEFAULT_PATH = 'blues-trace.json'
+DEFAULT_TOP = 15
+
+_run_command = fabric.operations._run_command
+_inner_run_command = None
+_upload = blueprints.Blueprint.upload.__func__
+_task_run = fabric.tasks.WrappedCallableTask.run.__func__
+
+_spool_path = None
+_owner_pid = None
+_export_path = None
+_stack = []
+_ids = count(1)
+
+
+def is_enabled():
+    return _spool_path is not None
+
+
+def blueprint_name(module):
+    """
+    Short blueprint name for module, e.g. blues.application.tasks -> app.
+    """
+    name = module.split('.', 1)[1] if module.startswith('blues.') else module
+    if name == 'application' or name.startswith('application.'):
+        return 'app'
+    return name
+
+
+@contextmanager
+def span(name, category='step', blueprint=None, **args):
+    """
+    Record a step on the timeline of current host.
+
+    :param name: Step name
+    :param category: task, run, upload or step
+    :param blueprint: Blueprint owning the step (Default: enclosing step's)
+    :param args: Extra details to record, e.g. command
+    """
+    if not is_enabled():
+        yield args
+        return
+
+    parent = _stack[-1] if _stack else None
+    event = {
+        'id': '{}-{}'.format(os.getpid(), next(_ids)),
+        'parent': parent['id'] if parent else None,
+        'name': name,
+        'category': category,
+        'blueprint': blueprint or (parent['blueprint'] if parent else None),
+        'host': env.host_string or 'local',
+        'args': args,
+    }
+
+    _stack.append(event)
+    event['start'] = time.time()
+    try:
+        yield args
+    except BaseException as e:
+        args.setdefault('error', str(e) or e.__class__.__name__)
+        raise
+    finally:
+        event['end'] = time.time()
+        _stack.pop()
+        record(event)
+
+
+def traced(name=None):
+    """
+    Decorate function to be recorded as a step, when tracing.
+
+    :param name: Step name (Default: <module>.<function>)
+    """
+    def decorator(func):
+        step = name or '{}.{}'.format(func.__module__.rsplit('.', 1)[-1], func.__name__)
+
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            with span(step, blueprint=blueprint_name(func.__module__)):
+                return func(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+def record(event):
+    # Appended per process, since parallel host workers are forked
+    path = os.path.join(_spool_path, '{}.jsonl'.format(os.getpid()))
+    with open(path, 'a') as f:
+        f.write(json.dumps(event, default=str) + '\n')
+
+
+def load_events():
+    events = []
+    if is_enabled():
+        for filename in sorted(os.listdir(_spool_path)):
+            with open(os.path.join(_spool_path, filename)) as f:
+                events.extend(json.loads(line) for line in f if line.strip())
+
+    return sorted(events, key=lambda event: event['start'])
+
+
+def traced_run_command(*args, **kwargs):
+    """
+    Replacement for fabric's _run_command, recording each remote command.
+    """
+    call = inspect.getcallargs(_run_command, *args, **kwargs)
+    command = call['command']
+
+    with span(command.split('\n', 1)[0][:80], category='run', command=command,
+              sudo=bool(call['sudo'])) as details:
+        result = _inner_run_command(*args, **kwargs)
+        details['return_code'] = getattr(result, 'return_code', None)
+        return result
+
+
+def traced_upload(self, template, destination, *args, **kwargs):
+    with span('upload {}'.format(template), category='upload',
+              blueprint=blueprint_name(self.name), template=template,
+              destination=destination) as details:
+        updates = _upload(self, template, destination, *args, **kwargs)
+        details['updated'] = len(updates or [])
+        return updates
+
+
+def traced_task_run(self, *args, **kwargs):
+    module = getattr(self.wrapped, '__module__', '') or ''
+    if not module.startswith('blues.') or module == __name__:
+        return _task_run(self, *args, **kwargs)
+
+    with span(self.name, category='task', blueprint=blueprint_name(module)):
+        return _task_run(self, *args, **kwargs)
+
+
+def get_run_command():
+    """
+    Get installed replacement for fabric's _run_command, beneath tracing if enabled.
+    """
+    return _inner_run_command if is_enabled() else fabric.operations._run_command
+
+
+def install_run_command(func):
+    """
+    Install replacement for fabric's _run_command, beneath tracing if enabled.
+    """
+    global _inner_run_command
+    if is_enabled():
+        _inner_run_command = func
+    else:
+        fabric.operations._run_command = func
+
+
+def enable():
+    global _spool_path, _owner_pid, _inner_run_command
+    if is_enabled():
+        return
+
+    _spool_path = tempfile.mkdtemp(prefix='blues-trace-')
+    _owner_pid = os.getpid()
+
+    _inner_run_command = fabric.operations._run_command
+    fabric.operations._run_command = traced_run_command
+    blueprints.Blueprint.upload = traced_upload
+    fabric.tasks.WrappedCallableTask.run = traced_task_run
+
+    atexit.register(finish)
+
+
+def disable():
+    global _spool_path
+    if not is_enabled():
+        return
+
+    fabric.operations._run_command = _inner_run_command
+    blueprints.Blueprint.upload = _upload
+    fabric.tasks.WrappedCallableTask.run = _task_run
+
+    shutil.rmtree(_spool_path, ignore_errors=True)
+    _spool_path = None
+
+
+def finish():
+    """
+    Export trace when the run ends, also if aborted.
+    """
+    if is_enabled() and os.getpid() == _owner_pid:
+        export()
+        disable()
+
+
+def export(path=None):
+    """
+    Write Chrome trace-event JSON.
+
+    :param path: Output file (Default: tracing.path setting or blues-trace.json)
+    :return: Output file
+    """
+    path = path or _export_path or blueprint.get('path', DEFAULT_PATH)
+    events = load_events()
+    origin = events[0]['start'] if events else 0
+    hosts = sorted(set(event['host'] for event in events))
+
+    trace_events = [{
+        'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+        'args': {'name': host}
+    } for tid, host in enumerate(hosts, start=1)]
+
+    for event in events:
+        args = dict(event['args'], blueprint=event['blueprint'])
+        trace_events.append({
+            'name': event['name'],
+            'cat': event['category'],
+            'ph': 'X',
+            'ts': int((event['start'] - origin) * 1e6),
+            'dur': int((event['end'] - event['start']) * 1e6),
+            'pid': 1,
+            'tid': hosts.index(event['host']) + 1,
+            'args': args,
+        })
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+    info('Wrote trace of {} step(s) on {} host(s) to {}', len(events), len(hosts), path)
+    return path
+
+
+def summarize(events):
+    """
+    Aggregate self time, i.e. excluding nested steps, per blueprint.
+
+    :return: list of (blueprint, seconds, steps), slowest first
+    """
+    nested = defaultdict(float)
+    for event in events:
+        if event['parent']:
+            nested[event['parent']] += event['end'] - event['start']
+
+    totals = defaultdict(lambda: [0.0, 0])
+    for event in events:
+        self_time = event['end'] - event['start'] - nested[event['id']]
+        total = totals[event['blueprint'] or '-']
+        total[0] += max(self_time, 0)
+        total[1] += 1
+
+    return sorted(((name, seconds, steps) for name, (seconds, steps) in totals.items()),
+                  key=lambda total: -total[1])
+
+
+@task
+def trace(path=None):
+    """
+    Record a timeline of all following tasks, written when the run ends
+
+    :param path: Chrome trace output file (Default: tracing.path setting or blues-trace.json)
+    """
+    global _export_path
+    _export_path = path
+    enable()
+
+
+@task
+def report(top=None):
+    """
+    Show slowest steps and time per blueprint, traced so far
+
+    :param top: Number of slowest steps to show (Default: tracing.top setting or 15)
+    """
+    top = int(top or blueprint.get('top', DEFAULT_TOP))
+    events = load_events()
+
+    with hide_prefix():
+        info('Slowest steps:')
+        # Tasks span all their steps, leave them out
+        slowest = sorted((event for event in events if event['category'] != 'task'),
+                         key=lambda event: event['start'] - event['end'])
+        for event in slowest[:top]:
+            return_code = event['args'].get('return_code')
+            puts(indent('{:8.2f}s  {:<12} {:<12} {}{}'.format(
+                event['end'] - event['start'],
+                event['host'],
+                event['blueprint'] or '-',
+                event['name'],
+                ' (exit {})'.format(return_code) if return_code else '')),
+                show_prefix=False)
+
+        info('Time per blueprint:')
+        for name, seconds, steps in summarize(events):
+            puts(indent('{:8.2f}s  {:<12} {} step(s)'.format(seconds, name, steps)),
+                 show_prefix=False)
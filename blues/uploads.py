@@ -0,0 +1,216 @@
+"""
+Bulk Uploads
+============
+
+Uploads a blueprint template directory, or a list of templates, as a single
+compressed archive instead of comparing and pushing file by file.
+
+All templates are rendered locally, through the render cache, and compared
+against one remote md5 listing. Only changed files are shipped, in one tar
+stream, and moved into place with atomic renames from a staging dir next to the
+destination.
+
+Returns the same list of updated remote paths as `blueprint.upload`, and falls
+back to it when bulk uploads are disabled.
+
+**Fabric environment:**
+
+.. code-block:: yaml
+
+    settings:
+      uploads:
+        bulk: true  # Enable bulk uploads (Default: false)
+
+"""
+import hashlib
+import io
+import os
+import tarfile
+import time
+import uuid
+from pipes import quote
+
+from fabric.operations import put
+
+from refabric.api import run, info
+from refabric.context_managers import silent
+from refabric.contrib import blueprints
+
+from . import debian
+from . import rendering
+
+blueprint = blueprints.get(__name__)
+
+DEFAULT_MODE = 0644
+
+
+def is_enabled():
+    return bool(blueprint.get('bulk', False))
+
+
+def upload(bp, source, destination, context=None, user=None):
+    """
+    Render and upload changed templates in one archive.
+
+    :param bp: Blueprint owning the templates
+    :param source: Template, template dir (ending with /) or list of templates
+    :param destination: Remote dir (ending with /) or file path for single template
+    :param context: Template context
+    :param user: Owner of uploaded files (Optional)
+    :return: list of updated remote paths
+    """
+    if not is_enabled():
+        if isinstance(source, (list, tuple)):
+            updates = []
+            for template in source:
+                updates.extend(bp.upload(template, destination, context=context,
+                                         user=user) or [])
+            return updates
+        return bp.upload(source, destination, context=context, user=user) or []
+
+    files = render(bp, source, destination, context=context)
+    if not files:
+        return []
+
+    changed = diff(files)
+    if changed:
+        push(changed, user=user)
+
+    return sorted(changed)
+
+
+def render(bp, source, destination, context=None):
+    """
+    Render templates locally.
+
+    :return: dict(remote path=(content, mode))
+    """
+    loader = bp.get_template_loader()
+    templates = loader.list_templates()
+    sources = source if isinstance(source, (list, tuple)) else [source]
+
+    files = {}
+    for src in sources:
+        src = os.path.normpath(src)
+
+        if src in templates:
+            if destination.endswith('/'):
+                matches = [(src, os.path.join(destination, os.path.basename(src)))]
+            else:
+                matches = [(src, destination)]
+        else:
+            prefix = '' if src == '.' else src + '/'
+            matches = [(name, os.path.join(destination, name[len(prefix):]))
+                       for name in templates if name.startswith(prefix)]
+
+        for name, remote_path in matches:
+            content = rendering.render(bp, name, context)
+            if isinstance(content, unicode):
+                content = content.encode('utf-8')
+            files[remote_path] = (content, template_mode(loader, name))
+
+    return files
+
+
+def render_all(bp, templates):
+    """
+    Render several template sources locally.
+
+    :param templates: list of (source, destination, context)
+    :return: dict(remote path=(content, mode))
+    """
+    files = {}
+    for source, destination, context in templates:
+        files.update(render(bp, source, destination, context=context))
+    return files
+
+
+def template_mode(loader, name):
+    try:
+        _, filename, _ = loader.get_source(None, name)
+        return os.stat(filename).st_mode & 0777
+    except Exception:
+        return DEFAULT_MODE
+
+
+def diff(files):
+    """
+    Compare rendered files against remote md5 listing, in one round-trip.
+
+    :return: dict of changed files
+    """
+    with silent():
+        output = run('md5sum {} 2>/dev/null; true'.format(
+            ' '.join(quote(path) for path in sorted(files))))
+
+    remote = {}
+    for line in output.splitlines():
+        checksum, _, path = line.strip().partition('  ')
+        remote[path] = checksum
+
+    return dict((path, f) for path, f in files.items()
+                if remote.get(path) != hashlib.md5(f[0]).hexdigest())
+
+
+def common_dir(paths):
+    parts = [os.path.dirname(path).split('/') for path in paths]
+    common = []
+    for segments in zip(*parts):
+        if len(set(segments)) != 1:
+            break
+        common.append(segments[0])
+    return '/'.join(common) or '/'
+
+
+def archive(files, root):
+    """
+    Build gzipped tar of files, relative to root.
+    """
+    buf = io.BytesIO()
+    tar = tarfile.open(fileobj=buf, mode='w:gz')
+    for path, (content, mode) in sorted(files.items()):
+        tarinfo = tarfile.TarInfo(os.path.relpath(path, root))
+        tarinfo.size = len(content)
+        tarinfo.mode = mode
+        tarinfo.mtime = time.time()
+        tar.addfile(tarinfo, io.BytesIO(content))
+    tar.close()
+    buf.seek(0)
+    return buf
+
+
+def push(files, user=None):
+    """
+    Ship files in one archive and move them into place atomically.
+    """
+    root = common_dir(files.keys())
+    remote_archive = '/tmp/blues-upload-{}.tar.gz'.format(uuid.uuid4().hex)
+
+    info('Uploading {} changed file(s) to {}', len(files), root)
+    with silent():
+        put(archive(files, root), remote_archive)
+
+    relative_paths = ' '.join(quote(os.path.relpath(path, root)) for path in sorted(files))
+    destination = quote(root.rstrip('/'))
+    commands = [
+        'mkdir -p {}'.format(quote(root)),
+        # Stage next to destination, for rename to be atomic
+        'stage=$(mktemp -d {})'.format(quote(root.rstrip('/') + '/.blues-upload-XXXXXX')),
+        'tar -xzf {} -C "$stage" --no-same-owner'.format(remote_archive),
+        'cd "$stage"',
+        'for f in {}; do mkdir -p {}/"$(dirname "$f")" && '
+        'mv -f "$f" {}/"$f" || exit 1; done'.format(relative_paths, destination, destination),
+        'cd /',
+        'rm -rf "$stage" {}'.format(remote_archive),
+    ]
+    with silent():
+        output = run(' && '.join(commands))
+
+    if output.return_code != 0:
+        raise Exception('Failed to extract uploaded archive {}, {}'.format(
+            remote_archive, output))
+
+    if user:
+        with debian.queued():
+            for path in sorted(files):
+                debian.chown(path, owner=user)
@@ -1,8 +1,26 @@
 from contextlib import contextmanager, nested
+from fabric.context_managers import cd
+from refabric.context_managers import silent
 from refabric.operations import run
+import hashlib
 import os
+import re
 import shlex
-from .compat import req_file, req_file_build_parser
+
+# Requirement files read from snapshots, besides the configured ones
+REQUIREMENT_EXTENSIONS = ('.txt', '.pip', '.in')
+
+# Same syntax as pip's requirements file parser
+SCHEME_RE = re.compile(r'^(http|https|file):', re.I)
+COMMENT_RE = re.compile(r'(^|\s+)#.*$')
+ENV_VAR_RE = re.compile(r'(?P<var>\$\{(?P<name>[A-Z0-9_]+)\})')
+
+# Options collecting file or url arguments, by short and long name
+REQUIREMENT_FILE_OPTIONS = {
+    '-r': 'requirements', '--requirement': 'requirements',
+    '-c': 'constraints', '--constraint': 'constraints',
+    '-e': 'editables', '--editable': 'editables',
+}
 
 
 @contextmanager
@@ -14,14 +32,111 @@ def maybe_managed(*context_managers):
         yield
 
 
+class RequirementOptions(object):
+    """
+    Options of a requirements file line, e.g. -r, -c and -e arguments.
+    """
+
+    def __init__(self):
+        self.requirements = []
+        self.constraints = []
+        self.editables = []
+        self.other = []
+
+
+def preprocess_requirements(text):
+    """
+    Join continued lines, strip comments and blank lines and expand ${VARS},
+    like pip.
+
+    :return: iterator of (line number, line)
+    """
+    primary_line_number, joined = None, []
+    lines = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.endswith('\\') or COMMENT_RE.match(line):
+            if COMMENT_RE.match(line):
+                # Make sure comment is matched below
+                line = ' ' + line
+            if joined:
+                joined.append(line)
+                lines.append((primary_line_number, ''.join(joined)))
+                joined = []
+            else:
+                lines.append((line_number, line))
+        else:
+            if not joined:
+                primary_line_number = line_number
+            joined.append(line.strip('\\'))
+
+    if joined:
+        lines.append((primary_line_number, ''.join(joined)))
+
+    for line_number, line in lines:
+        line = COMMENT_RE.sub('', line).strip()
+        if not line:
+            continue
+
+        for var, name in ENV_VAR_RE.findall(line):
+            value = os.getenv(name)
+            if value:
+                line = line.replace(var, value)
+
+        yield line_number, line
+
+
+def break_args_options(line):
+    """
+    Split line in requirement args and options, leaving markers in args intact.
+    """
+    tokens = line.split(' ')
+    args = []
+    for token in tokens:
+        if token.startswith('-'):
+            break
+        args.append(token)
+    return ' '.join(args), ' '.join(tokens[len(args):])
+
+
+def parse_options(options_str):
+    """
+    Parse options of a requirements file line.
+
+    :return: RequirementOptions
+    """
+    opts = RequirementOptions()
+    if not options_str:
+        return opts
+
+    # shlex is slow, only needed for quoting and escapes
+    if '"' in options_str or "'" in options_str or '\\' in options_str:
+        tokens = shlex.split(options_str)
+    else:
+        tokens = options_str.split()
+    while tokens:
+        token = tokens.pop(0)
+        if token.startswith('--'):
+            name, _, value = token.partition('=')
+        else:
+            # Value may be attached to short option, e.g. -rbase.txt
+            name, value = token[:2], token[2:]
+
+        if name in REQUIREMENT_FILE_OPTIONS:
+            if not value:
+                if not tokens:
+                    raise ValueError('{} option requires an argument'.format(name))
+                value = tokens.pop(0)
+            getattr(opts, REQUIREMENT_FILE_OPTIONS[name]).append(value)
+        else:
+            opts.other.append(token)
+
+    return opts
+
+
 def parse_requirements(text):
-    lines_enum = req_file.preprocess(text, options=None)
-    for line_number, line in lines_enum:
-        parser = req_file_build_parser(line=line)
-        defaults = parser.get_default_values()
-        defaults.index_url = None
-        args_str, options_str = req_file.break_args_options(line)
-        opts, _ = parser.parse_args(shlex.split(options_str), defaults)
+    for line_number, line in preprocess_requirements(text):
+        args_str, options_str = break_args_options(line)
+        opts = parse_options(options_str)
         yield args_str, options_str, opts
 
 
@@ -30,10 +145,78 @@ def iter_requirements(text):
         yield a + o
 
 
+def requirement_name(spec):
+    """
+    Get normalized package name of requirement specifier, e.g. Django==1.8 -> django.
+
+    :return: name or None, if not a named requirement, e.g. an option or a path
+    """
+    spec = spec.strip()
+    egg = re.search(r'#egg=([A-Za-z0-9._-]+)', spec)
+    if egg:
+        name = egg.group(1)
+    elif spec.startswith('-') or '/' in spec.split(';')[0] or spec.startswith('.'):
+        return None
+    else:
+        match = re.match(r'^([A-Za-z0-9][A-Za-z0-9._-]*)', spec)
+        if not match:
+            return None
+        name = match.group(1)
+
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def read_requirements(paths, repository_path):
+    """
+    Read requirement files and their includes, from checked out commit.
+
+    :param paths: Requirement files, relative to repository
+    :param repository_path: Repository path
+    :return: dict(path=content)
+    """
+    from . import git
+
+    with silent():
+        snapshot = git.show_files(repository_path, ['HEAD'],
+                                  extensions=REQUIREMENT_EXTENSIONS,
+                                  paths=paths)['HEAD']
+
+    with cd(repository_path), silent():
+        tree = RequirementTree(paths=paths, contents=snapshot)
+        return dict((os.path.normpath(path), tree.get_content(path))
+                    for path in tree.all_files())
+
+
+def requirements_key(requirements):
+    """
+    Hash requirement files and requested python version, e.g. to key
+    virtualenvs or wheelhouses by.
+
+    :param requirements: dict(path=content), see `read_requirements`
+    :return: hex digest
+    """
+    from . import python
+
+    checksum = hashlib.sha1()
+    checksum.update('python{}\n'.format('.'.join(map(str, python.requested_version()))))
+    for path, content in sorted(requirements.items()):
+        checksum.update('{}\0{}\0'.format(path, hashlib.sha1(content).hexdigest()))
+
+    return checksum.hexdigest()[:16]
+
+
 class RequirementTree(object):
-    def __init__(self, paths):
+    def __init__(self, paths, contents=None):
+        """
+        :param paths: Root requirement files
+        :param contents: Snapshot dict(path=content) to read files from,
+            instead of reading them remotely one by one (Optional)
+        """
         self.paths = paths
+        self.contents = contents
         self.tree = {}
+        self.requirements = set()
+        self.constraints = set()
         self._build(paths)
 
         self.parents = {}
@@ -49,22 +232,32 @@ class RequirementTree(object):
             if path not in self.tree[parent]:
                 self.tree[parent].append(path)
             if path not in self.tree:
-                self._build(paths=self.parse(path), parent=path)
+                self._build(paths=list(self.parse(path)), parent=path)
 
     def parse(self, path):
         text = self.get_content(path=path)
         for args_str, options_str, opts in parse_requirements(text=text):
-            if opts.constraints:
-                raise NotImplementedError
-            if opts.requirements:
-                r = opts.requirements[0]
-                if req_file.SCHEME_RE.search(r):
+            for r, kind in [(r, self.requirements) for r in opts.requirements or []] + \
+                    [(c, self.constraints) for c in opts.constraints or []]:
+                if SCHEME_RE.search(r):
                     raise NotImplementedError
-                yield os.path.join(os.path.dirname(path), r)
+                child = os.path.join(os.path.dirname(path), r)
+                kind.add(child)
+                yield child
 
     def get_content(self, path):
+        path = os.path.normpath(path)
+        if self.contents is not None and path in self.contents:
+            return self.contents[path]
         return run('cat {}'.format(path))
 
+    def is_constraint(self, path):
+        """
+        Is path only used as constraints file, i.e. not to be installed itself?
+        """
+        return path in self.constraints and path not in self.requirements \
+            and path not in self.paths
+
     def all_files(self):
         all_children = set()
         for parent, children in self.tree.items():
@@ -72,12 +265,31 @@ class RequirementTree(object):
         return all_children
 
     def get_changed(self, all_changed_files):
+        all_changed_files = self.resolve_constraints(all_changed_files)
         changed = []
         for path in all_changed_files:
             if not self.is_parent_changed(path, all_changed_files):
                 changed.append(path)
         return sorted(changed, key=self.get_order)
 
+    def resolve_constraints(self, all_changed_files):
+        """
+        Replace changed constraints files with the files constrained by them.
+        """
+        resolved = []
+        pending = list(all_changed_files)
+        tried = set()
+        while pending:
+            path = pending.pop(0)
+            if path in tried:
+                continue
+            tried.add(path)
+            if self.is_constraint(path):
+                pending.extend(self.parents.get(path, []))
+            elif path not in resolved:
+                resolved.append(path)
+        return resolved
+
     def is_parent_changed(self, child, all_changed_files, tried=None):
         if tried is None:
             tried = []
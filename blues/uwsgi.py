@@ -5,6 +5,10 @@ uWSGI Blueprint
 Installs uWSGI and contains service tasks and other useful helpers for other blueprints to use.
 Currently only acts as a provider for the application blueprint and can not be used standalone to deploy vassals.
 
+Run ``fab uwsgi.stats`` to read the stats socket of every vassal on all hosts in parallel,
+and write request rates, response times, busy and idle workers, listen queues and worker
+memory to ``uwsgi-stats.json`` and ``uwsgi-stats.prom``, in Prometheus text format.
+
 **Fabric environment:**
 
 .. code-block:: yaml
@@ -18,9 +22,13 @@ Currently only acts as a provider for the application blueprint and can not be u
         # emperor: /etc/uwsgi/vassals (Default: /srv/app/*/uwsgi.d)
 
 """
+import base64
+import json
 import os
+import time
 
-from fabric.decorators import task
+from fabric.decorators import task, runs_once
+from fabric.utils import warn
 
 from refabric.api import run, info
 from refabric.context_managers import sudo, hide_prefix, silent
@@ -30,7 +38,7 @@ from . import debian
 from . import python
 
 __all__ = ['start', 'stop', 'restart', 'reload', 'status', 'emperor_log',
-           'setup', 'configure', 'top', 'fifo']
+           'setup', 'configure', 'top', 'stats', 'fifo']
 
 
 blueprint = blueprints.get(__name__)
@@ -38,6 +46,12 @@ blueprint = blueprints.get(__name__)
 log_path = '/var/log/uwsgi'
 tmpfs_path = '/run/uwsgi/'
 
+# Reads a stats socket to stdout, with whichever python the host has
+READ_SOCKET = ('"$(command -v python3 || command -v python)" -c \''
+               'import shutil, socket, sys; '
+               's = socket.socket(socket.AF_UNIX); s.connect(sys.argv[1]); '
+               'shutil.copyfileobj(s.makefile("rb"), getattr(sys.stdout, "buffer", sys.stdout))\'')
+
 start = debian.service_task('uwsgi', 'start')
 stop = debian.service_task('uwsgi', 'stop')
 restart = debian.service_task('uwsgi', 'restart')
@@ -67,12 +81,13 @@ def install():
         python.pip('install', package)
         python.pip('install', 'uwsgitop', 'gevent')
 
-        # Create group
-        debian.groupadd('app-data', gid_min=10000)
+        with debian.queued():
+            # Create group
+            debian.groupadd('app-data', gid_min=10000)
 
-        # Create directories
-        debian.mkdir(log_path, owner='root', group='app-data', mode=1775)
-        debian.mkdir(tmpfs_path, owner='root', group='app-data', mode=1775)
+            # Create directories
+            debian.mkdir(log_path, owner='root', group='app-data', mode=1775)
+            debian.mkdir(tmpfs_path, owner='root', group='app-data', mode=1775)
 
 
 @task
@@ -100,8 +115,130 @@ def top(vassal_name=None):
     # TODO: fix missing output
     with sudo(), hide_prefix():
         vassal = vassal_name or blueprint.get('project')
-        stats_path = os.path.join(tmpfs_path, '{}-stats.sock'.format(vassal))
-        run('uwsgitop {}'.format(stats_path))
+        run('uwsgitop {}'.format(stats_path(vassal)))
+
+
+@task
+@runs_once
+def stats(path='uwsgi-stats', interval=1):
+    """
+    Collect stats of all vassals on all hosts, to <path>.json and <path>.prom
+
+    :param path: Local output path, without extension
+    :param interval: Seconds between the two stats reads, for request rates
+    """
+    from .application import parallel as parallel_execution
+
+    results = parallel_execution.execute(collect, interval=float(interval))
+
+    hosts = dict((host, result['result']) for host, result in results.items()
+                 if not result['error'])
+    failed = sorted(host for host in results if host not in hosts)
+    vassals = aggregate(hosts)
+
+    with open('{}.json'.format(path), 'w') as f:
+        json.dump({'collected': int(time.time()), 'hosts': hosts, 'vassals': vassals,
+                   'failed': failed}, f, indent=2, sort_keys=True)
+    with open('{}.prom'.format(path), 'w') as f:
+        f.write(format_prometheus(hosts))
+
+    with hide_prefix():
+        for vassal, totals in sorted(vassals.items()):
+            info('{}: {} req/s, {} ms, {}/{} workers busy, {} queued, on {} host(s)',
+                 vassal, totals['requests_per_second'],
+                 '-' if totals['avg_rt'] is None else totals['avg_rt'], totals['busy'],
+                 totals['workers'], totals['listen_queue'], totals['hosts'])
+    if failed:
+        warn('No stats from {} host(s): {}'.format(len(failed), ', '.join(failed)))
+    info('Wrote {0}.json and {0}.prom', path)
+
+    return vassals
+
+
+def collect(interval=1):
+    """
+    Read stats of all vassals on current host, twice, interval seconds apart.
+
+    :return: dict(vassal=summary), see `summarize_stats`
+    """
+    first = read_stats()
+    time.sleep(interval)
+    second = read_stats()
+
+    return dict((vassal, summarize_stats(first.get(vassal, {}), data, interval))
+                for vassal, data in second.items())
+
+
+def aggregate(hosts):
+    """
+    Aggregate vassal summaries over hosts.
+
+    :param hosts: dict(host=dict(vassal=summary))
+    :return: dict(vassal=totals), response time weighted by request rate
+    """
+    vassals = {}
+    for host, summaries in sorted(hosts.items()):
+        for vassal, summary in summaries.items():
+            totals = vassals.setdefault(vassal, {
+                'hosts': 0, 'workers': 0, 'busy': 0, 'idle': 0, 'listen_queue': 0,
+                'requests_per_second': 0, 'avg_rt': None, 'max_rss': 0})
+            totals['hosts'] += 1
+            for key in ('workers', 'busy', 'idle', 'listen_queue'):
+                totals[key] += summary[key]
+            totals['max_rss'] = max([totals['max_rss']] + summary['rss'].values())
+
+            rate = summary['requests_per_second'] or 0
+            if summary['avg_rt'] is not None and rate:
+                served = totals['requests_per_second'] if totals['avg_rt'] is not None else 0
+                totals['avg_rt'] = round(((totals['avg_rt'] or 0) * served +
+                                          summary['avg_rt'] * rate) / (served + rate), 1)
+            totals['requests_per_second'] += rate
+
+    return vassals
+
+
+def format_prometheus(hosts):
+    """
+    Format vassal summaries of hosts as Prometheus text exposition.
+
+    :param hosts: dict(host=dict(vassal=summary))
+    :return: text
+    """
+    metrics = [
+        ('uwsgi_requests_total', 'counter', 'Requests served by workers',
+         lambda summary: [({}, summary['requests'])]),
+        ('uwsgi_requests_per_second', 'gauge', 'Requests served per second',
+         lambda summary: [({}, summary['requests_per_second'])]),
+        ('uwsgi_avg_response_time_seconds', 'gauge', 'Average response time of workers',
+         lambda summary: [({}, summary['avg_rt'] and summary['avg_rt'] / 1000.0)]),
+        ('uwsgi_workers', 'gauge', 'Spawned workers by status',
+         lambda summary: [({'status': 'busy'}, summary['busy']),
+                          ({'status': 'idle'}, summary['idle']),
+                          ({'status': 'other'},
+                           summary['workers'] - summary['busy'] - summary['idle'])]),
+        ('uwsgi_listen_queue', 'gauge', 'Requests waiting in listen queue',
+         lambda summary: [({}, summary['listen_queue'])]),
+        ('uwsgi_listen_queue_max', 'gauge', 'Listen queue size',
+         lambda summary: [({}, summary['listen_queue_max'])]),
+        ('uwsgi_worker_rss_bytes', 'gauge', 'Resident memory of worker',
+         lambda summary: [({'worker': worker}, rss)
+                          for worker, rss in sorted(summary['rss'].items())]),
+    ]
+
+    lines = []
+    for name, kind, description, values in metrics:
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for host, summaries in sorted(hosts.items()):
+            for vassal, summary in sorted(summaries.items()):
+                for labels, value in values(summary):
+                    if value is None:
+                        continue
+                    labels = dict(labels, host=host, vassal=vassal)
+                    lines.append('{}{{{}}} {}'.format(name, ','.join(
+                        '{}="{}"'.format(key, labels[key]) for key in sorted(labels)), value))
+
+    return '\n'.join(lines) + '\n'
 
 
 @task
@@ -135,6 +272,69 @@ def reload(vassal_path=None):
             run('touch {}'.format(vassal_path))
 
 
+def chain_reload(vassal_path, timeout=120, interval=1):
+    """
+    Chain reload vassal via its master FIFO, one worker at a time, and wait
+    until every worker has been respawned with the new code.
+
+    Requires lazy-apps, otherwise workers are forked from the old app.
+
+    :param vassal_path: The absolute path to vassal ini to reload
+    :param timeout: Seconds to wait for all workers to respawn
+    :return: Seconds until all workers were serving again, or None if not chained
+    """
+    vassal_name = os.path.splitext(os.path.basename(vassal_path))[0]
+
+    stats = read_stats(vassal_name).get(vassal_name)
+    if stats is None:
+        # Not running, nothing to chain
+        reload(vassal_path)
+        return None
+
+    old_pids = worker_pids(stats)
+
+    info('Chain reloading {} uWSGI vassal, {} worker(s)', vassal_name, len(old_pids))
+    fifo(vassal_name, 'c')
+
+    duration = wait_for_workers(vassal_name, old_pids, timeout=timeout, interval=interval)
+    if duration is not None:
+        info('Chain reloaded {} in {:.1f}s', vassal_name, duration)
+    else:
+        warn('Chain reload of {} not done after {}s'.format(vassal_name, timeout))
+
+    return duration
+
+
+def worker_pids(stats):
+    """
+    Get pids of spawned workers from vassal stats.
+    """
+    return set(worker['pid'] for worker in stats.get('workers', []) if worker.get('pid'))
+
+
+def wait_for_workers(vassal_name, old_pids, timeout=120, interval=1):
+    """
+    Wait until every spawned worker of vassal is a new one, accepting requests.
+
+    :param vassal_name: The vassal to poll stats of
+    :param old_pids: Worker pids from before the reload
+    :param timeout: Seconds to wait
+    :return: Seconds until all workers were replaced, or None if timed out
+    """
+    started = time.time()
+    while time.time() - started < timeout:
+        time.sleep(interval)
+        stats = read_stats(vassal_name).get(vassal_name)
+        if stats is None:
+            continue
+        workers = [worker for worker in stats.get('workers', []) if worker.get('pid')]
+        if workers and all(worker['pid'] not in old_pids and worker.get('accepting', 1)
+                           for worker in workers):
+            return time.time() - started
+
+    return None
+
+
 @task
 def emperor_log():
     with sudo():
@@ -162,6 +362,52 @@ def get_cpu_affinity(cores, workers=None):
         return 3
 
 
+def get_cheaper_min(cores, workers):
+    """
+    Get minimum workers kept alive by cheaper, depending on server core count
+    """
+    return max(min(cores // 2, workers // 4), 1)
+
+
+def get_cheaper_initial(cores, workers):
+    """
+    Get workers spawned at start by cheaper, depending on server core count
+    """
+    return max(min(cores, workers), get_cheaper_min(cores, workers))
+
+
+def get_cheaper_step(cores, workers):
+    """
+    Get workers spawned at a time by cheaper, depending on server core count
+    """
+    return max(min(cores // 2, workers - get_cheaper_min(cores, workers)), 1)
+
+
+def get_cheaper_context(context, cores, budget):
+    """
+    Get cheaper, adaptive process spawning, settings for a web vassal
+
+    :param context: Web vassal context, with blueprint settings applied
+    :param cores: Server core count
+    :param budget: Memory budget for workers in bytes
+    :return: dict of cheaper settings not already in context
+    """
+    workers = int(context['workers'])
+    if not context.get('cheaper') or workers <= 1:
+        # Nothing to spawn adaptively
+        return {'cheaper': None}
+
+    # Stop spawning above soft, and kill workers above hard total rss
+    settings = {
+        'cheaper_min': get_cheaper_min(cores, workers),
+        'cheaper_initial': get_cheaper_initial(cores, workers),
+        'cheaper_step': get_cheaper_step(cores, workers),
+        'cheaper_rss_limit_soft': budget * 4 / 5,
+        'cheaper_rss_limit_hard': budget,
+    }
+    return dict((key, value) for key, value in settings.items() if key not in context)
+
+
 def get_max_requests(gb_memory):
     """
     Get max_requests setting depending on server memory in GB
@@ -188,3 +434,92 @@ def get_limit_as(gb_memory):
     Get limit_as setting depending on server memory in GB
     """
     return gb_memory * 512
+
+
+def stats_path(vassal_name):
+    """
+    Get path to stats socket of vassal
+    """
+    return os.path.join(tmpfs_path, '{}-stats.sock'.format(vassal_name))
+
+
+def read_stats(*vassal_names):
+    """
+    Read stats sockets of vassals, or of all vassals on host, in one round-trip.
+
+    :param vassal_names: Vassals to read, i.e. ini names without extension (Default: all)
+    :return: dict(vassal=stats), without vassals not running
+    """
+    if vassal_names:
+        paths = ' '.join('"{}"'.format(stats_path(name)) for name in vassal_names)
+    else:
+        paths = '{}*-stats.sock'.format(tmpfs_path)
+
+    with sudo(), silent():
+        output = run('for f in {}; do [ -S "$f" ] || continue; printf "%s\\t" "$f"; '
+                     '{} "$f" 2>/dev/null | base64 -w0; echo; done'.format(paths, READ_SOCKET),
+                     pty=False)
+
+    return parse_stats(output)
+
+
+def parse_stats(output):
+    """
+    Parse stats read by `read_stats`.
+
+    :param output: One "<socket path>\\t<base64 stats json>" per line
+    :return: dict(vassal=stats)
+    """
+    stats = {}
+    for line in output.splitlines():
+        path, _, content = line.strip().partition('\t')
+        if not path or not content:
+            continue
+        try:
+            data = json.loads(base64.b64decode(content))
+        except (TypeError, ValueError):
+            continue
+        vassal = os.path.basename(path)[:-len('-stats.sock')]
+        stats[vassal] = data
+
+    return stats
+
+
+def summarize_stats(first, second, seconds):
+    """
+    Summarize two stats reads of a vassal, seconds apart.
+
+    :return: dict of worker states, listen queue, request rate, average
+             response time in ms and rss and vsz in bytes per worker id
+    """
+    workers = second.get('workers', [])
+    # Workers not spawned, e.g. by cheaper, have no pid
+    spawned = [worker for worker in workers if worker.get('pid')]
+    response_times = [worker['avg_rt'] for worker in spawned if worker.get('avg_rt')]
+    requests = sum(worker.get('requests', 0) for worker in workers)
+
+    summary = {
+        'workers': len(spawned),
+        'busy': len([worker for worker in spawned if worker.get('status') == 'busy']),
+        'idle': len([worker for worker in spawned if worker.get('status') == 'idle']),
+        'listen_queue': second.get('listen_queue', 0),
+        'listen_queue_max': sum(socket.get('max_queue', 0)
+                                for socket in second.get('sockets', [])),
+        'requests': requests,
+        'requests_per_second': None,
+        # Microseconds to milliseconds
+        'avg_rt': round(sum(response_times) / 1000.0 / len(response_times), 1)
+        if response_times else None,
+        'rss': dict((str(worker.get('id')), worker['rss'])
+                    for worker in spawned if worker.get('rss')),
+        'vsz': dict((str(worker.get('id')), worker['vsz'])
+                    for worker in spawned if worker.get('vsz')),
+    }
+
+    # Request counters restart with the master
+    if first.get('pid') == second.get('pid') and seconds > 0:
+        served = requests - sum(worker.get('requests', 0) for worker in first.get('workers', []))
+        if served >= 0:
+            summary['requests_per_second'] = round(float(served) / seconds, 2)
+
+    return summary
@@ -0,0 +1,250 @@
+"""
+Wheelhouse
+==========
+
+Builds wheels for an app's resolved requirements once, and installs them with
+``pip install --no-index --find-links`` on every host, instead of each host
+downloading from the index and compiling e.g. lxml, psycopg2 and Pillow.
+
+Wheelhouses are keyed by a hash of the requirement files, including ``-r`` and
+``-c`` includes, and the requested python version. The first host missing a
+wheelhouse builds it, or the build host if set, and it is then kept locally and
+shipped to the other hosts as one archive.
+
+Set an index url to build from a local stand-in PyPI, e.g. for offline testing.
+
+**Fabric environment:**
+
+.. code-block:: yaml
+
+    settings:
+      wheelhouse:
+        enabled: true                          # Install app requirements from a shared wheelhouse (Default: false)
+        # build_host: 10.0.0.10                # App host to build wheels on, requirements must not refer to local paths (Default: first host installing them)
+        # index_url: http://127.0.0.1:3141/simple/  # Index to build wheels from (Default: pip's default)
+        # path: /srv/app/foobar/.wheelhouse    # Remote wheelhouse root (Default: .wheelhouse in project home)
+        # cache_path: ~/.cache/blues/wheelhouse  # Local wheelhouse archives (Default: ~/.cache/blues/wheelhouse)
+        # keep: 3                              # Wheelhouses kept per host (Default: 3)
+
+"""
+import io
+import os
+import tarfile
+import uuid
+
+from fabric.context_managers import cd, settings
+from fabric.operations import get, put
+from fabric.state import env
+
+from refabric.api import run, info
+from refabric.context_managers import silent
+from refabric.contrib import blueprints
+
+from . import debian
+from . import git
+from . import python
+from . import util
+from . import virtualenv
+from .tracing import traced
+
+__all__ = []
+
+
+blueprint = blueprints.get(__name__)
+
+DEFAULT_CACHE_PATH = '~/.cache/blues/wheelhouse'
+DEFAULT_KEEP = 3
+
+
+def is_enabled():
+    return bool(blueprint.get('enabled', False))
+
+
+def keep():
+    return max(int(blueprint.get('keep', DEFAULT_KEEP)), 1)
+
+
+def remote_root():
+    from .application.project import project_home
+    return blueprint.get('path') or os.path.join(project_home(), '.wheelhouse')
+
+
+def cache_path(*parts):
+    path = os.path.expanduser(blueprint.get('cache_path', DEFAULT_CACHE_PATH))
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Created by another parallel worker
+            if not os.path.isdir(path):
+                raise
+    return os.path.join(path, *parts)
+
+
+def index_options():
+    index_url = blueprint.get('index_url')
+    return ['--index-url', index_url] if index_url else []
+
+
+def get_key(requirements):
+    """
+    Hash requirement files and requested python version.
+
+    :param requirements: dict(path=content)
+    :return: hex digest
+    """
+    return util.requirements_key(requirements)
+
+
+def is_complete(path):
+    with silent():
+        return run('test -f {}/.complete'.format(path)).return_code == 0
+
+
+@traced()
+def build(installation_file, path):
+    """
+    Build wheels for requirements file on current host, in activated virtualenv.
+    """
+    info('Building wheelhouse {}', os.path.basename(path))
+    debian.mkdir(path)
+    # Not shipped by older virtualenv and pip
+    python.pip('install', 'wheel', *index_options())
+    python.pip('wheel', '-r', installation_file, '--wheel-dir', path, *index_options())
+    run('touch {}/.complete'.format(path))
+
+
+@traced()
+def build_remote(host, installation_file, requirements, path):
+    """
+    Build wheels from requirement files on build host, in a temporary virtualenv.
+    """
+    info('Building wheelhouse {} on {}', os.path.basename(path), host)
+    with settings(host_string=host):
+        archive_path = '/tmp/blues-requirements-{}.tar.gz'.format(uuid.uuid4().hex)
+        with silent():
+            # Owned by project user, unlike debian.mktemp
+            tmp_path = run('mktemp -d').stdout.strip()
+            put(archive(requirements), archive_path, mode=0644)
+            run('tar -xzf {} -C {} && rm -f {}'.format(archive_path, tmp_path, archive_path))
+
+        virtualenv.create(os.path.join(tmp_path, 'env'))
+        with virtualenv.activate(os.path.join(tmp_path, 'env')), cd(tmp_path):
+            build(installation_file, path)
+
+        debian.rm(tmp_path, recursive=True)
+
+
+def archive(requirements):
+    buf = io.BytesIO()
+    tar = tarfile.open(fileobj=buf, mode='w:gz')
+    for path, content in sorted(requirements.items()):
+        tarinfo = tarfile.TarInfo(path)
+        tarinfo.size = len(content)
+        tar.addfile(tarinfo, io.BytesIO(content))
+    tar.close()
+    buf.seek(0)
+    return buf
+
+
+def download(path, local_path):
+    """
+    Download remote wheelhouse as one archive.
+    """
+    remote_archive = '/tmp/blues-wheelhouse-{}.tar.gz'.format(uuid.uuid4().hex)
+    with silent():
+        run('tar -czf {} -C {} .'.format(remote_archive, path))
+        get(remote_archive, local_path + '.tmp')
+        run('rm -f {}'.format(remote_archive))
+    os.rename(local_path + '.tmp', local_path)
+
+
+def upload(local_path, path):
+    """
+    Ship local wheelhouse archive to current host.
+    """
+    info('Uploading wheelhouse {}', os.path.basename(path))
+    remote_archive = '/tmp/blues-wheelhouse-{}.tar.gz'.format(uuid.uuid4().hex)
+    with silent():
+        put(local_path, remote_archive, mode=0644)
+    debian.mkdir(path)
+    with silent():
+        # Mark complete only once all wheels are extracted
+        run('tar -xzf {archive} -C {path} --exclude=./.complete && touch {path}/.complete && '
+            'rm -f {archive}'.format(archive=remote_archive, path=path))
+
+
+def list_wheelhouses():
+    """
+    List wheelhouse keys on current host, newest first.
+    """
+    with silent():
+        output = run('ls -1t {} 2>/dev/null; true'.format(remote_root()), pty=False)
+
+    return output.split()
+
+
+def prune(current=None):
+    """
+    Remove wheelhouses on current host, keeping the newest and current one.
+    """
+    old = [key for key in list_wheelhouses()[keep():] if key != current]
+    if old:
+        info('Removing old wheelhouses {}', ', '.join(old))
+        debian.rm(' '.join(os.path.join(remote_root(), key) for key in old), recursive=True)
+
+
+def ensure(installation_file, repository_path):
+    """
+    Get wheelhouse for requirements file onto current host, building it if needed.
+
+    Called as project user, with the project virtualenv activated.
+
+    :return: Remote wheelhouse path
+    """
+    requirements = util.read_requirements([installation_file], repository_path)
+    key = get_key(requirements)
+    path = os.path.join(remote_root(), key)
+
+    if is_complete(path):
+        info('Wheelhouse {} already on host', key)
+        # Newest again, when pruning
+        run('touch {}'.format(path))
+    else:
+        provide(installation_file, repository_path, requirements, path)
+
+    prune(current=key)
+
+    return path
+
+
+def provide(installation_file, repository_path, requirements, path):
+    """
+    Build wheelhouse on current or build host, or upload it from local cache.
+    """
+    local_path = cache_path('{}.tar.gz'.format(os.path.basename(path)))
+    with git.locked(local_path):
+        if not os.path.exists(local_path):
+            build_host = blueprint.get('build_host')
+            if build_host and build_host != env.host_string:
+                build_remote(build_host, installation_file, requirements, path)
+                with settings(host_string=build_host):
+                    download(path, local_path)
+            else:
+                with cd(repository_path):
+                    build(installation_file, path)
+                download(path, local_path)
+                return
+
+    upload(local_path, path)
+
+
+def install(installation_file, repository_path):
+    """
+    Pip install requirements file from wheelhouse, without reaching an index.
+
+    Called as project user, with the project virtualenv activated.
+    """
+    path = ensure(installation_file, repository_path)
+    with cd(repository_path):
+        python.pip('install', '--no-index', '--find-links', path, '-r', installation_file)
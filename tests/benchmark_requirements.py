@@ -0,0 +1,46 @@
+"""
+Micro-benchmark of requirements parsing, pip-free vs pip-backed.
+
+Run with ``python -m tests.benchmark_requirements [lines]``.
+"""
+import sys
+import timeit
+
+from blues import util
+from blues import compat
+
+TEMPLATE = [
+    'package-{i}==1.{i}.0',
+    'package-{i}[extra]>=2.0,<3.0; python_version < "3"  # pinned',
+    '-r requirements/base-{i}.txt',
+    '-c constraints-{i}.txt',
+    '-e git+https://github.com/5monkeys/blues.git@{i}#egg=blues-{i}',
+    'https://example.com/package-{i}.tar.gz',
+    '--index-url https://pypi.example.com/simple/',
+    'package-{i} \\\n    --hash=sha256:{i:064d}',
+]
+
+
+def requirements(lines):
+    return '\n'.join(TEMPLATE[i % len(TEMPLATE)].format(i=i) for i in range(lines))
+
+
+def main(lines=2000, number=5):
+    text = requirements(lines)
+
+    assert list(util.iter_requirements(text)) == \
+        [a + o for a, o, _ in compat.parse_requirements(text)]
+
+    results = []
+    for name, parse in [('blues.util', util.parse_requirements),
+                        ('pip', compat.parse_requirements)]:
+        seconds = min(timeit.repeat(lambda: list(parse(text)), number=number,
+                                    repeat=3)) / number
+        results.append(seconds)
+        print('{:<12} {:8.2f} ms per {} lines'.format(name, seconds * 1000, lines))
+
+    print('{:.1f}x faster'.format(results[1] / results[0]))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,61 @@
+import subprocess
+import unittest
+
+from blues import debian
+
+
+class LocalOutput(str):
+    pass
+
+
+def local_run(command, *args, **kwargs):
+    process = subprocess.Popen(['bash', '-c', command], stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    stdout, _ = process.communicate()
+    output = LocalOutput(stdout.decode('utf-8').strip())
+    output.stdout = str(output)
+    output.return_code = process.returncode
+    return output
+
+
+class CommandQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.run = debian.run
+        debian.run = local_run
+
+    def tearDown(self):
+        debian.run = self.run
+
+    def test_flush(self):
+        with debian.queued() as queue:
+            first = debian.execute('echo foo')
+            second = debian.execute('echo bar')
+            self.assertEqual(len(queue), 2)
+            self.assertFalse(first.done)
+
+        self.assertTrue(first.succeeded)
+        self.assertTrue(second.succeeded)
+        self.assertEqual(first.output, 'foo')
+        self.assertEqual(second.output, 'bar')
+
+    def test_nested(self):
+        with debian.queued() as outer:
+            with debian.queued() as inner:
+                self.assertIs(outer, inner)
+                command = debian.execute('true')
+            self.assertFalse(command.done)
+
+        self.assertTrue(command.succeeded)
+
+    def test_failure(self):
+        with self.assertRaises(Exception):
+            with debian.queued() as queue:
+                debian.execute('true')
+                debian.execute('echo oops; exit 3', description='failing')
+                debian.execute('true')
+
+        first, failed, skipped = queue.flushed
+        self.assertTrue(first.succeeded)
+        self.assertEqual(failed.return_code, 3)
+        self.assertEqual(failed.output, 'oops')
+        self.assertFalse(skipped.done)
@@ -0,0 +1,31 @@
+import unittest
+
+from blues import facts
+
+
+class ParseFactsTests(unittest.TestCase):
+    def setUp(self):
+        self.facts = facts.parse('\r\n'.join([
+            'nproc\t4',
+            'mem_total\t2048000',
+            'lsb_release\t16.04',
+            'hostname\tweb1.example.com ',
+            'ipv4\teth0 10.0.0.10',
+            'ipv4\tlo 127.0.0.1',
+            'passwd\troot:x:0:0:root:/root:/bin/bash',
+            'passwd\tfoo:x:999:999::/srv/app/foo:/bin/bash',
+        ]))
+
+    def test_single_values(self):
+        self.assertEqual(self.facts['nproc'], '4')
+        self.assertEqual(self.facts['lsb_release'], '16.04')
+        self.assertEqual(self.facts['hostname'], 'web1.example.com')
+
+    def test_multi_values(self):
+        self.assertListEqual(self.facts['ipv4'],
+                             ['eth0 10.0.0.10', 'lo 127.0.0.1'])
+        self.assertEqual(len(self.facts['passwd']), 2)
+
+    def test_missing_multi_values(self):
+        self.assertDictEqual(facts.parse('nproc\t1'),
+                             {'nproc': '1', 'ipv4': [], 'passwd': []})
@@ -0,0 +1,53 @@
+import unittest
+
+from blues import git
+
+
+class CloneOptionsTests(unittest.TestCase):
+    def test_no_options(self):
+        self.assertEqual(git.clone_options(), '')
+
+    def test_options(self):
+        self.assertEqual(
+            git.clone_options(depth='50', filter='blob:none',
+                              reference='/srv/git/objects.git'),
+            ' --depth 50 --filter=blob:none'
+            ' --reference-if-able /srv/git/objects.git')
+
+
+class ChangedFilesTests(unittest.TestCase):
+    def setUp(self):
+        self.changes = git.ChangedFiles(git.parse_name_status(
+            'M\trequirements/base.txt\n'
+            'A\tfoo/migrations/0002_bar.py\n'
+            'D\tpackage.json\n'))
+
+    def test_parse_name_status(self):
+        self.assertEqual(len(self.changes), 3)
+        self.assertEqual(self.changes.files['package.json'], 'D')
+
+    def test_contains(self):
+        self.assertIn('package.json', self.changes)
+        self.assertIn('./requirements/base.txt', self.changes)
+        self.assertNotIn('bower.json', self.changes)
+
+    def test_dir(self):
+        self.assertTrue(self.changes.changed('requirements/'))
+        self.assertFalse(self.changes.changed('foo/static/'))
+        self.assertFalse(self.changes.changed('require/'))
+
+    def test_glob(self):
+        self.assertEqual(self.changes.matching('*/migrations/*', '*.json'),
+                         ['foo/migrations/0002_bar.py', 'package.json'])
+        self.assertFalse(self.changes.changed('*/static/*'))
+
+
+class ParseBatchTests(unittest.TestCase):
+    def test_parse_batch(self):
+        output = ('aaa blob 5 HEAD:a.txt\nsix\nb\n'
+                  'HEAD~1:a.txt missing\n'
+                  'bbb blob 3 HEAD~1:b.txt\nfoo')
+        self.assertDictEqual(git.parse_batch(output, ['HEAD~1', 'HEAD']), {
+            'HEAD': {'a.txt': 'six\nb'},
+            'HEAD~1': {'b.txt': 'foo'},
+        })
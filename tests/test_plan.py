@@ -0,0 +1,18 @@
+import unittest
+
+from blues import plan
+
+
+class PlanTests(unittest.TestCase):
+    def test_cost(self):
+        p = plan.Plan()
+        p.add('upload', 'upload nginx files', count=3)
+        p.add('restart', 'restart postgres')
+
+        self.assertEqual(p.cost, 3 * plan.DEFAULT_COSTS['upload'] +
+                         plan.DEFAULT_COSTS['restart'])
+
+    def test_unknown_kind_is_free(self):
+        p = plan.Plan()
+        p.add('unknown', 'something')
+        self.assertEqual(p.cost, 0)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from jinja2 import ChoiceLoader, FileSystemLoader
+
+from blues import rendering
+
+
+class TemplateBlueprint(object):
+    name = 'test'
+
+    def __init__(self, template_dir):
+        self.template_dir = template_dir
+
+    def get_template_loader(self):
+        return ChoiceLoader([FileSystemLoader(self.template_dir)])
+
+
+class RenderCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.template_dir, 'site.conf'), 'w') as f:
+            f.write('server_name {{ domain }};\n')
+        self.bp = TemplateBlueprint(self.template_dir)
+        rendering.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.template_dir)
+        rendering.clear()
+
+    def test_renders_once_per_context(self):
+        first = rendering.render(self.bp, 'site.conf', {'domain': 'example.com'})
+        second = rendering.render(self.bp, 'site.conf', {'domain': 'example.com'})
+        other = rendering.render(self.bp, 'site.conf', {'domain': 'example.org'})
+
+        self.assertEqual(first, 'server_name example.com;')
+        self.assertEqual(second, first)
+        self.assertEqual(other, 'server_name example.org;')
+        self.assertEqual(len(rendering._rendered), 2)
+
+    def test_shares_environment_per_blueprint(self):
+        self.assertIs(rendering.get_environment(self.bp),
+                      rendering.get_environment(self.bp))
+
+    def test_uncacheable_context(self):
+        context = {'domain': 'example.com', 'obj': object()}
+        self.assertIsNone(rendering.cache_key(
+            rendering.get_environment(self.bp), 'site.conf', context))
+        self.assertEqual(rendering.render(self.bp, 'site.conf', context),
+                         'server_name example.com;')
@@ -48,6 +48,28 @@ class RequirementTreeTests(unittest.TestCase):
         self.assertListEqual(result, ['a.txt'])
 
 
+class ConstraintsTreeTests(unittest.TestCase):
+    def setUp(self):
+        self.tree = util.RequirementTree(paths=['live.txt'], contents={
+            'live.txt': '-r base.txt\n-c constraints.txt\nDjango',
+            'base.txt': 'six\n-c constraints.txt',
+            'constraints.txt': 'six==1.10.0',
+        })
+
+    def test_tree(self):
+        self.assertDictEqual(self.tree.tree, {
+            None: ['live.txt'],
+            'live.txt': ['base.txt', 'constraints.txt'],
+            'base.txt': ['constraints.txt'],
+        })
+        self.assertTrue(self.tree.is_constraint('constraints.txt'))
+        self.assertFalse(self.tree.is_constraint('base.txt'))
+
+    def test_changed_constraints(self):
+        result = self.tree.get_changed(all_changed_files=['constraints.txt'])
+        self.assertListEqual(result, ['live.txt'])
+
+
 class ParseRequirementsTests(unittest.TestCase):
     def test_parse_requirements_txt(self):
         file_name = os.path.join(PACKAGE_ROOT, 'requirements.txt')
@@ -67,3 +89,98 @@ class ParseRequirementsTests(unittest.TestCase):
         text = '-r a.txt\nDjango==1.2.3'
         self.assertListEqual(list(util.iter_requirements(text)),
                              ['-r a.txt', 'Django==1.2.3'])
+
+
+class RequirementNameTests(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(util.requirement_name('Django==1.8.2'), 'django')
+        self.assertEqual(util.requirement_name('foo_bar[x]>=1.0'), 'foo-bar')
+        self.assertEqual(util.requirement_name(
+            'git+https://github.com/5monkeys/blues.git@abc#egg=Blues'), 'blues')
+
+    def test_unnamed(self):
+        self.assertIsNone(util.requirement_name('-r base.txt'))
+        self.assertIsNone(util.requirement_name('./src'))
+
+
+class IncrementalChangesTests(unittest.TestCase):
+    def changes(self, diffs, current=()):
+        from blues.application.deploy import get_incremental_changes
+        return get_incremental_changes({'diffs': diffs, 'current': set(current)})
+
+    def test_bump(self):
+        self.assertEqual(self.changes({'base.txt': ({'six==1.10'}, {'six==1.9'})},
+                                      current=['six==1.10']),
+                         (['six==1.10'], []))
+
+    def test_removed(self):
+        self.assertEqual(self.changes({'base.txt': (set(), {'six==1.9', 'lxml'})},
+                                      current=['lxml==3.0']),
+                         ([], ['six']))
+
+    def test_bump_normalized_name(self):
+        self.assertEqual(self.changes({'base.txt': ({'Foo_Bar==2.0'}, {'foo-bar==1.0'})},
+                                      current=['Foo_Bar==2.0']),
+                         (['Foo_Bar==2.0'], []))
+
+    def test_moved_between_files(self):
+        diffs = {'base.txt': (set(), {'six==1.10'}), 'web.txt': ({'six==1.10'}, set())}
+        self.assertEqual(self.changes(diffs, current=['six==1.10']), (['six==1.10'], []))
+
+    def test_still_required_elsewhere(self):
+        self.assertEqual(self.changes({'web.txt': (set(), {'six'})}, current=['six==1.10']),
+                         ([], []))
+
+    def test_unchanged(self):
+        self.assertEqual(self.changes({'base.txt': (set(), set())}), ([], []))
+
+    def test_full_install(self):
+        self.assertIsNone(self.changes({'base.txt': ({'-r extra.txt'}, set())}))
+        self.assertIsNone(self.changes({'setup.py': (None, None)}))
+        self.assertIsNone(self.changes({'base.txt': ({'./pkg'}, set())}))
+
+    def test_full_install_on_removed_options(self):
+        self.assertIsNone(self.changes({'base.txt': (set(), {'--index-url https://pypi'})}))
+        self.assertIsNone(self.changes({'base.txt': (
+            set(), {'-e git+https://github.com/5monkeys/blues.git#egg=blues'})}))
+
+    def test_full_install_on_unnamed_url(self):
+        self.assertIsNone(self.changes({'base.txt': (
+            {'https://example.com/pkg-1.0.tar.gz'}, set())}))
+        self.assertIsNone(self.changes({'base.txt': (
+            set(), {'https://example.com/pkg-1.0.tar.gz'})}))
+
+
+class PipCompatibilityTests(unittest.TestCase):
+    text = '\n'.join([
+        '# comment',
+        'Django==1.8.2  # pinned',
+        'foo[bar]>=1.0; python_version < "3"',
+        '-r base.txt',
+        '--requirement=extra.txt',
+        '-cconstraints.txt',
+        '-e git+https://github.com/5monkeys/blues.git#egg=blues',
+        'https://example.com/pkg.tar.gz',
+        '--index-url https://pypi.example.com/simple/',
+        'six \\',
+        '    --hash=sha256:abc',
+        '',
+    ])
+
+    def setUp(self):
+        try:
+            from blues import compat
+        except ImportError:
+            self.skipTest('pip not installed')
+        self.compat = compat
+
+    def test_same_as_pip(self):
+        expected = list(self.compat.parse_requirements(self.text))
+        result = list(util.parse_requirements(self.text))
+
+        self.assertListEqual([(a, o) for a, o, _ in result],
+                             [(a, o) for a, o, _ in expected])
+        for (_, _, opts), (_, _, pip_opts) in zip(result, expected):
+            self.assertEqual(opts.requirements, pip_opts.requirements or [])
+            self.assertEqual(opts.constraints, pip_opts.constraints or [])
+            self.assertEqual(opts.editables, pip_opts.editables or [])
@@ -0,0 +1,17 @@
+import unittest
+
+from blues.application import rolling
+
+
+class BatchTests(unittest.TestCase):
+    def test_batch_size_number(self):
+        self.assertEqual(rolling.batch_size('2', 10), 2)
+        self.assertEqual(rolling.batch_size(20, 10), 10)
+
+    def test_batch_size_percentage(self):
+        self.assertEqual(rolling.batch_size('25%', 10), 3)
+        self.assertEqual(rolling.batch_size('1%', 10), 1)
+
+    def test_split_batches(self):
+        self.assertListEqual(rolling.split_batches(['a', 'b', 'c'], 2),
+                             [['a', 'b'], ['c']])
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from blues import state
+
+
+class ChecksumTests(unittest.TestCase):
+    def test_stable_for_equal_inputs(self):
+        self.assertEqual(state.checksum({'b': 2, 'a': 1}, ['x']),
+                         state.checksum({'a': 1, 'b': 2}, ['x']))
+
+    def test_differs_for_changed_inputs(self):
+        self.assertNotEqual(state.checksum({'a': 1}), state.checksum({'a': 2}))
+        self.assertNotEqual(state.checksum('a', 'b'), state.checksum('ab'))
+
+
+class DirectoryChecksumTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, 'nginx'))
+        self.write('nginx/site.conf', 'server {}')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, content):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(content)
+
+    def test_content_change(self):
+        before = state.directory_checksum(self.path)
+        self.write('nginx/site.conf', 'server { listen 80; }')
+        self.assertNotEqual(before, state.directory_checksum(self.path))
+
+    def test_added_file(self):
+        before = state.directory_checksum(self.path)
+        self.write('nginx/other.conf', '')
+        self.assertNotEqual(before, state.directory_checksum(self.path))
+
+    def test_missing_dir(self):
+        self.assertEqual(state.directory_checksum(os.path.join(self.path, 'missing')),
+                         state.directory_checksum())
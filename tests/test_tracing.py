@@ -0,0 +1,37 @@
+import unittest
+
+from blues import tracing
+
+
+def event(id, start, end, blueprint, parent=None):
+    return {'id': id, 'parent': parent, 'start': start, 'end': end,
+            'blueprint': blueprint}
+
+
+class BlueprintNameTests(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(tracing.blueprint_name('blues.nginx'), 'nginx')
+        self.assertEqual(tracing.blueprint_name('blues.application.tasks'), 'app')
+        self.assertEqual(tracing.blueprint_name('blues.application.providers.uwsgi'), 'app')
+        self.assertEqual(tracing.blueprint_name('fabfile'), 'fabfile')
+
+
+class SummarizeTests(unittest.TestCase):
+    def test_self_time_per_blueprint(self):
+        totals = tracing.summarize([
+            event('1', 0.0, 10.0, 'app'),
+            event('2', 1.0, 7.0, 'app', parent='1'),
+            event('3', 7.0, 9.0, 'nginx', parent='1'),
+        ])
+
+        self.assertEqual(totals, [('app', 8.0, 2), ('nginx', 2.0, 1)])
+
+    def test_nested_longer_than_parent(self):
+        # Forked parallel workers may outlive the span they were started in
+        totals = tracing.summarize([
+            event('1', 0.0, 1.0, 'app'),
+            event('2', 0.0, 5.0, 'app', parent='1'),
+            event('3', 0.0, 5.0, 'app', parent='1'),
+        ])
+
+        self.assertEqual(totals, [('app', 10.0, 3)])
@@ -0,0 +1,79 @@
+import unittest
+
+from blues.application import tuning
+
+MB = 1024 * 1024
+
+
+def stats(pid, workers):
+    return {'pid': pid, 'listen_queue': 0, 'workers': workers}
+
+
+def worker(id, requests, rss=100, vsz=300, avg_rt=50000, pid=1):
+    return {'id': id, 'pid': pid, 'requests': requests, 'rss': rss * MB, 'vsz': vsz * MB,
+            'avg_rt': avg_rt}
+
+
+class SummarizeTests(unittest.TestCase):
+    def test_rate_and_busy_workers(self):
+        sample = tuning.summarize(stats(1, [worker(1, 100), worker(2, 100)]),
+                                  stats(1, [worker(1, 150), worker(2, 150)]), 5)
+        self.assertEqual(sample['workers'], 2)
+        self.assertListEqual(sample['rss'], [100.0, 100.0])
+        self.assertEqual(sample['avg_rt'], 50.0)
+        self.assertEqual(sample['rate'], 20.0)
+        self.assertEqual(sample['busy'], 1.0)
+
+    def test_restarted_master_has_no_rate(self):
+        sample = tuning.summarize(stats(1, [worker(1, 100)]), stats(2, [worker(1, 5)]), 5)
+        self.assertIsNone(sample['rate'])
+        self.assertIsNone(sample['busy'])
+
+    def test_skips_workers_not_spawned(self):
+        sample = tuning.summarize(stats(1, []), stats(1, [worker(1, 0), worker(2, 0, pid=0)]), 5)
+        self.assertEqual(sample['workers'], 1)
+
+
+class RecommendTests(unittest.TestCase):
+    def sample(self, rss, busy=None, listen_queue=0):
+        return {'rss': rss, 'vsz': [value * 3 for value in rss], 'busy': busy,
+                'listen_queue': listen_queue}
+
+    def test_nothing_sampled(self):
+        self.assertDictEqual(tuning.recommend([], 4, 4096), {})
+
+    def test_memory_limits_from_percentile(self):
+        context = tuning.recommend([self.sample([100] * 19 + [400])], 4, 8192)
+        self.assertEqual(context['reload_on_rss'], 150)
+        self.assertEqual(context['reload_on_as'], 450)
+        self.assertEqual(context['limit_as'], 900)
+
+    def test_workers_default_to_cores_without_load(self):
+        self.assertEqual(tuning.recommend([self.sample([100])], 4, 8192)['workers'], 8)
+
+    def test_workers_from_busiest_sample(self):
+        history = [self.sample([100], busy=2), self.sample([100], busy=5, listen_queue=1)]
+        self.assertEqual(tuning.recommend(history, 4, 8192)['workers'], 12)
+
+    def test_workers_capped_by_budget(self):
+        history = [self.sample([200], busy=10)]
+        self.assertEqual(tuning.recommend(history, 4, 1000)['workers'], 3)
+        self.assertEqual(tuning.recommend(history, 4, 100)['workers'], 1)
+
+
+class TuneTests(unittest.TestCase):
+    def setUp(self):
+        self.sampled = []
+        self.sample, tuning.sample = tuning.sample, self.sampled.append
+        self.read_history, tuning.read_history = tuning.read_history, lambda *args: []
+        tuning._tuned.clear()
+
+    def tearDown(self):
+        tuning.sample, tuning.read_history = self.sample, self.read_history
+        tuning._tuned.clear()
+
+    def test_samples_once_per_host_and_vassal(self):
+        tuning.tune('web', 4, 4096)
+        tuning.tune('web', 4, 4096)
+        tuning.tune('api', 4, 4096)
+        self.assertListEqual(self.sampled, ['web', 'api'])
@@ -0,0 +1,111 @@
+import base64
+import json
+import os
+import unittest
+
+from jinja2 import Environment, FileSystemLoader
+
+from blues import uwsgi
+
+TEMPLATES = os.path.join(os.path.dirname(uwsgi.__file__), 'templates')
+
+
+def summary(**kwargs):
+    defaults = {'workers': 4, 'busy': 1, 'idle': 3, 'listen_queue': 0, 'listen_queue_max': 100,
+                'requests': 1000, 'requests_per_second': 10.0, 'avg_rt': 50.0,
+                'rss': {'1': 100, '2': 200}, 'vsz': {}}
+    defaults.update(kwargs)
+    return defaults
+
+
+class ParseStatsTests(unittest.TestCase):
+    def test_vassal_names_from_socket_paths(self):
+        output = '\n'.join([
+            '/run/uwsgi/foo-stats.sock\t{}'.format(base64.b64encode(json.dumps({'pid': 1}))),
+            '/run/uwsgi/bar-stats.sock\t',
+            '/run/uwsgi/baz-stats.sock\tnot base64',
+        ])
+        self.assertDictEqual(uwsgi.parse_stats(output), {'foo': {'pid': 1}})
+
+
+class SummarizeStatsTests(unittest.TestCase):
+    def setUp(self):
+        self.first = {'pid': 1, 'workers': [{'id': 1, 'pid': 2, 'requests': 10},
+                                            {'id': 2, 'pid': 3, 'requests': 10}]}
+        self.second = {'pid': 1, 'listen_queue': 2, 'sockets': [{'max_queue': 100}], 'workers': [
+            {'id': 1, 'pid': 2, 'requests': 30, 'status': 'busy', 'rss': 100, 'avg_rt': 20000},
+            {'id': 2, 'pid': 3, 'requests': 20, 'status': 'idle', 'rss': 200, 'avg_rt': 40000},
+            {'id': 3, 'pid': 0, 'requests': 0, 'status': 'cheap'},
+        ]}
+
+    def test_summary(self):
+        result = uwsgi.summarize_stats(self.first, self.second, 2)
+        self.assertEqual(result['workers'], 2)
+        self.assertEqual((result['busy'], result['idle']), (1, 1))
+        self.assertEqual((result['listen_queue'], result['listen_queue_max']), (2, 100))
+        self.assertEqual(result['requests_per_second'], 15.0)
+        self.assertEqual(result['avg_rt'], 30.0)
+        self.assertDictEqual(result['rss'], {'1': 100, '2': 200})
+
+    def test_no_rate_without_first_read(self):
+        self.assertIsNone(uwsgi.summarize_stats({}, self.second, 2)['requests_per_second'])
+
+
+class AggregateTests(unittest.TestCase):
+    def test_totals_over_hosts(self):
+        totals = uwsgi.aggregate({
+            'web1': {'foo': summary(requests_per_second=10.0, avg_rt=50.0)},
+            'web2': {'foo': summary(requests_per_second=30.0, avg_rt=10.0, rss={'1': 300})},
+        })['foo']
+        self.assertEqual(totals['hosts'], 2)
+        self.assertEqual(totals['workers'], 8)
+        self.assertEqual(totals['requests_per_second'], 40.0)
+        self.assertEqual(totals['avg_rt'], 20.0)
+        self.assertEqual(totals['max_rss'], 300)
+
+    def test_idle_vassal_has_no_response_time(self):
+        totals = uwsgi.aggregate({'web1': {'foo': summary(requests_per_second=0.0)}})['foo']
+        self.assertIsNone(totals['avg_rt'])
+
+
+class FormatPrometheusTests(unittest.TestCase):
+    def test_labels_and_values(self):
+        text = uwsgi.format_prometheus({'web1': {'foo': summary(avg_rt=None)}})
+        lines = text.splitlines()
+        self.assertIn('# TYPE uwsgi_requests_total counter', lines)
+        self.assertIn('uwsgi_workers{host="web1",status="busy",vassal="foo"} 1', lines)
+        self.assertIn('uwsgi_worker_rss_bytes{host="web1",vassal="foo",worker="2"} 200', lines)
+        self.assertNotIn('uwsgi_avg_response_time_seconds{', text)
+        self.assertTrue(text.endswith('\n'))
+
+
+class CheaperTests(unittest.TestCase):
+    def test_bounds_within_workers(self):
+        for cores, workers in [(1, 2), (2, 4), (4, 8), (16, 32), (8, 3)]:
+            minimum = uwsgi.get_cheaper_min(cores, workers)
+            initial = uwsgi.get_cheaper_initial(cores, workers)
+            step = uwsgi.get_cheaper_step(cores, workers)
+            self.assertTrue(1 <= minimum < workers)
+            self.assertTrue(minimum <= initial <= workers)
+            self.assertTrue(1 <= step <= workers - minimum)
+
+    def test_scales_with_cores(self):
+        self.assertEqual((uwsgi.get_cheaper_min(4, 8), uwsgi.get_cheaper_initial(4, 8),
+                          uwsgi.get_cheaper_step(4, 8)), (2, 4, 2))
+
+    def test_settings_in_context_win(self):
+        context = {'workers': 8, 'cheaper': 'spare', 'cheaper_min': 3}
+        cheaper = uwsgi.get_cheaper_context(context, 4, 1000)
+        self.assertNotIn('cheaper_min', cheaper)
+        self.assertEqual(cheaper['cheaper_step'], 2)
+
+    def test_single_worker_renders_without_cheaper(self):
+        # Blueprint settings, e.g. web.cheaper, are applied to context first
+        context = {'workers': 1, 'cheaper': 'spare', 'env': {}}
+        context.update(uwsgi.get_cheaper_context(context, 4, 1000))
+
+        environment = Environment(loader=FileSystemLoader([
+            os.path.join(TEMPLATES, 'app'), os.path.join(TEMPLATES, 'uwsgi')]))
+        ini = environment.get_template('uwsgi/default/web.ini').render(context)
+        self.assertIn('processes = 1', ini)
+        self.assertNotIn('cheaper', ini)
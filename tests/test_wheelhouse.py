@@ -0,0 +1,28 @@
+import unittest
+
+from blues import python
+from blues import wheelhouse
+
+
+class KeyTests(unittest.TestCase):
+    def setUp(self):
+        self.requirements = {'requirements.txt': '-r base.txt\n', 'base.txt': 'six\n'}
+        self.requested_version = python.requested_version
+        python.requested_version = lambda: (2, 7)
+
+    def tearDown(self):
+        python.requested_version = self.requested_version
+
+    def test_stable_for_equal_requirements(self):
+        self.assertEqual(wheelhouse.get_key(self.requirements),
+                         wheelhouse.get_key(dict(self.requirements)))
+
+    def test_differs_for_changed_include(self):
+        changed = dict(self.requirements, **{'base.txt': 'six\nlxml\n'})
+        self.assertNotEqual(wheelhouse.get_key(self.requirements),
+                            wheelhouse.get_key(changed))
+
+    def test_differs_for_python_version(self):
+        key = wheelhouse.get_key(self.requirements)
+        python.requested_version = lambda: (3, 4)
+        self.assertNotEqual(key, wheelhouse.get_key(self.requirements))